@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""Benchmark httpstat's wall-clock overhead against a bare `curl -w`.
+
+Starts a local HTTP and HTTPS server (self-signed certificate made with
+openssl) and times both tools on the same scenarios, so it runs offline.
+
+    python bench/bench.py
+    python bench/bench.py --iterations 50 --json bench_output.json
+    python bench/bench.py --compare bench_output.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpstat  # noqa: E402
+
+HTTPSTAT = os.path.join(ROOT, 'httpstat.py')
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves `size` bytes after `delay` ms, both from the query string."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        size = int(query.get('size', ['0'])[0])
+        delay = float(query.get('delay', ['0'])[0])
+        if delay:
+            time.sleep(delay / 1000)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        chunk = b'x' * min(size, 65536)
+        remaining = size
+        while remaining > 0:
+            n = min(remaining, len(chunk))
+            self.wfile.write(chunk[:n])
+            remaining -= n
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_cert(directory: str) -> tuple[str, str] | None:
+    """Create a self-signed localhost certificate, None without openssl."""
+    if not shutil.which('openssl'):
+        return None
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+        check=True, capture_output=True)
+    return cert, key
+
+
+def start_server(cert: tuple[str, str] | None = None) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    if cert:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(*cert)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def curl_cmd(curl_bin: str, url: str, workdir: str) -> list[str]:
+    """The bare curl equivalent of one httpstat probe, which discards the
+    body with HTTPSTAT_SAVE_BODY=false.
+    """
+    return [curl_bin, '-w', httpstat.curl_format,
+            '-D', os.path.join(workdir, 'headers'), '-o', os.devnull,
+            '-s', '-S', '-k', url]
+
+
+def time_cmds(cmds: list[list[str]], env: dict[str, str]) -> float:
+    """Run cmds one after another, returning the wall-clock time in ms."""
+    start = time.perf_counter()
+    for cmd in cmds:
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def build_scenarios(args, http_base: str, https_base: str | None) -> list[dict]:
+    """Each scenario runs `runs` probes of one url, the same for both tools."""
+    small = f'?size={args.size}&delay={args.delay}'
+    scenarios = [
+        dict(name='http single', url=http_base + small, runs=1),
+        dict(name='http repeat', url=http_base + small, runs=args.repeat),
+        dict(name='http large body', url=http_base + f'?size={args.large_size}&delay={args.delay}', runs=1),
+    ]
+    if https_base:
+        scenarios += [
+            dict(name='https single', url=https_base + small, runs=1),
+            dict(name='https repeat', url=https_base + small, runs=args.repeat),
+        ]
+    return scenarios
+
+
+def run_scenario(scenario: dict, iterations: int, curl_bin: str, workdir: str,
+                 env: dict[str, str]) -> dict:
+    url, runs = scenario['url'], scenario['runs']
+    httpstat_cmd = [sys.executable, HTTPSTAT, url, '-k']
+    if runs > 1:
+        httpstat_cmd += ['--count', str(runs)]
+    timings = {'httpstat': [], 'curl': []}
+    # warm up the page cache and the server, then interleave both tools
+    time_cmds([httpstat_cmd], env)
+    for _ in range(iterations):
+        timings['httpstat'].append(time_cmds([httpstat_cmd], env))
+        timings['curl'].append(time_cmds([curl_cmd(curl_bin, url, workdir)] * runs, env))
+    result = {'name': scenario['name'], 'runs': runs}
+    for tool, samples in timings.items():
+        result[tool] = {
+            'median_ms': round(statistics.median(samples), 2),
+            'min_ms': round(min(samples), 2),
+            'p90_ms': round(httpstat.percentile(sorted(samples), 90), 2),
+        }
+    result['overhead_ms'] = round(result['httpstat']['median_ms'] - result['curl']['median_ms'], 2)
+    return result
+
+
+def format_results(results: list[dict], baseline: dict | None = None) -> str:
+    header = f'{"scenario":<18}{"runs":>5}{"curl":>10}{"httpstat":>10}{"overhead":>10}'
+    if baseline:
+        header += f'{"previous":>10}{"delta":>10}'
+    lines = [header, '-' * len(header)]
+    for r in results:
+        line = (f'{r["name"]:<18}{r["runs"]:>5}{r["curl"]["median_ms"]:>8.1f}ms'
+                f'{r["httpstat"]["median_ms"]:>8.1f}ms{r["overhead_ms"]:>8.1f}ms')
+        previous = baseline.get(r['name']) if baseline else None
+        if previous:
+            delta = r['overhead_ms'] - previous['overhead_ms']
+            line += f'{previous["overhead_ms"]:>8.1f}ms{delta:>+8.1f}ms'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark httpstat overhead against bare curl.')
+    parser.add_argument('--iterations', type=int, default=20, help='timed runs per scenario (default 20)')
+    parser.add_argument('--repeat', type=int, default=10, help='probes in the repeat scenarios (default 10)')
+    parser.add_argument('--size', type=int, default=1024, help='small response size in bytes (default 1024)')
+    parser.add_argument('--large-size', type=int, default=10 * 1024 * 1024,
+                        help='large response size in bytes (default 10MiB)')
+    parser.add_argument('--delay', type=float, default=0, help='server delay in ms (default 0)')
+    parser.add_argument('--curl-bin', default=os.environ.get('HTTPSTAT_CURL_BIN', 'curl'))
+    parser.add_argument('--json', metavar='PATH', help='also write results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='show overhead deltas against a previous --json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {r['name']: r for r in json.load(f)['results']}
+
+    # let python cache bytecode, otherwise every run pays for compiling httpstat,
+    # and don't keep a body tempfile per run
+    env = dict(os.environ, NO_COLOR='1', HTTPSTAT_SAVE_BODY='false')
+    for key in ('PYTHONDONTWRITEBYTECODE', 'HTTPSTAT_DEBUG'):
+        env.pop(key, None)
+    workdir = tempfile.mkdtemp(prefix='httpstat-bench-')
+    try:
+        cert = make_cert(workdir)
+        if not cert:
+            print('openssl not found, skipping https scenarios', file=sys.stderr)
+        http_server = start_server()
+        https_server = start_server(cert) if cert else None
+        http_base = f'http://127.0.0.1:{http_server.server_address[1]}/'
+        https_base = f'https://localhost:{https_server.server_address[1]}/' if https_server else None
+
+        results = []
+        for scenario in build_scenarios(args, http_base, https_base):
+            results.append(run_scenario(scenario, args.iterations, args.curl_bin, workdir, env))
+            print(f'  {scenario["name"]} done', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(format_results(results, baseline))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'httpstat_version': httpstat.__version__,
+                'python': sys.version.split()[0],
+                'iterations': args.iterations,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,20 @@ from __future__ import annotations
 # https://curl.haxx.se/libcurl/c/easy_getinfo_options.html
 # http://blog.kenweiner.com/2014/11/http-request-timings-with-curl.html
 
+# Only modules every probe needs are imported here, the rest (logging,
+# tempfile, re, concurrent.futures, ...) are imported where they are used
+# to keep startup fast for the common single-probe case.
+import time
+# --profile times the import from here
+_IMPORT_START = time.perf_counter()
+
+import io
 import os
 import json
 import sys
-import logging
-import tempfile
+import threading
 import subprocess
-from typing import NoReturn, overload
+from typing import Iterable, Iterator, NoReturn, overload
 
 
 __version__ = '2.0.0'
@@ -41,6 +48,7 @@ ENV_SAVE_BODY = Env('{prefix}_SAVE_BODY')
 ENV_CURL_BIN = Env('{prefix}_CURL_BIN')
 ENV_METRICS_ONLY = Env('{prefix}_METRICS_ONLY')
 ENV_DEBUG = Env('{prefix}_DEBUG')
+ENV_HISTORY_DB = Env('{prefix}_HISTORY_DB')
 
 
 curl_format = """{
@@ -51,13 +59,27 @@ curl_format = """{
 "time_redirect": %{time_redirect},
 "time_starttransfer": %{time_starttransfer},
 "time_total": %{time_total},
+"time_queue": "%{time_queue}",
+"time_posttransfer": "%{time_posttransfer}",
 "speed_download": %{speed_download},
 "speed_upload": %{speed_upload},
+"size_download": %{size_download},
+"size_header": %{size_header},
+"size_request": %{size_request},
+"num_connects": %{num_connects},
+"num_redirects": %{num_redirects},
+"http_version": "%{http_version}",
+"ssl_verify_result": %{ssl_verify_result},
 "remote_ip": "%{remote_ip}",
 "remote_port": "%{remote_port}",
 "local_ip": "%{local_ip}",
 "local_port": "%{local_port}"
 }"""
+# time_queue (curl 8.6+) and time_posttransfer (curl 8.10+) are quoted
+# above: older curl warns about the unknown variable on stderr and writes
+# nothing, which leaves "" instead of breaking the JSON.
+OPTIONAL_TIME_KEYS = ('time_queue', 'time_posttransfer')
+WRITE_OUT_WARNING = 'curl: unknown --write-out variable'
 
 https_template = """
   DNS Lookup   TCP Connection   TLS Handshake   Server Processing   Content Transfer
@@ -80,6 +102,75 @@ http_template = """
                                                                  total:{b0004}
 """[1:]
 
+# --phase connect and ttfb stop early, their templates end with the last
+# phase they reach
+https_connect_template = """
+  DNS Lookup   TCP Connection   TLS Handshake
+[   {a0000}  |     {a0001}    |    {a0002}    ]
+             |                |               |
+    namelookup:{b0000}        |               |
+                        connect:{b0001}       |
+                                    pretransfer:{b0002}
+"""[1:]
+
+http_connect_template = """
+  DNS Lookup   TCP Connection
+[   {a0000}  |     {a0001}    ]
+             |                |
+    namelookup:{b0000}        |
+                        connect:{b0001}
+"""[1:]
+
+https_ttfb_template = """
+  DNS Lookup   TCP Connection   TLS Handshake   Server Processing
+[   {a0000}  |     {a0001}    |    {a0002}    |      {a0003}      ]
+             |                |               |                   |
+    namelookup:{b0000}        |               |                   |
+                        connect:{b0001}       |                   |
+                                    pretransfer:{b0002}           |
+                                                      starttransfer:{b0003}
+"""[1:]
+
+http_ttfb_template = """
+  DNS Lookup   TCP Connection   Server Processing
+[   {a0000}  |     {a0001}    |      {a0003}      ]
+             |                |                   |
+    namelookup:{b0000}        |                   |
+                        connect:{b0001}           |
+                                      starttransfer:{b0003}
+"""[1:]
+
+# (phase, https) -> template
+TEMPLATES = {
+    ('full', True): https_template,
+    ('full', False): http_template,
+    ('connect', True): https_connect_template,
+    ('connect', False): http_connect_template,
+    ('ttfb', True): https_ttfb_template,
+    ('ttfb', False): http_ttfb_template,
+}
+
+# --phase connect stops after the TCP/TLS handshake, ttfb once the response
+# headers arrived. Metrics a phase never reaches are set to None.
+PHASES = ('full', 'connect', 'ttfb')
+PHASE_SKIPPED = {
+    'full': (),
+    'connect': ('time_starttransfer', 'time_posttransfer', 'time_total', 'range_server', 'range_transfer',
+                'size_request', 'size_header', 'size_download', 'speed_download', 'speed_upload',
+                'http_version'),
+    'ttfb': ('time_total', 'range_transfer', 'size_download', 'speed_download', 'speed_upload'),
+}
+PHASE_SLO_KEYS = {
+    'full': ('total', 'connect', 'ttfb', 'dns', 'tls'),
+    'connect': ('connect', 'dns', 'tls'),
+    'ttfb': ('connect', 'ttfb', 'dns', 'tls'),
+}
+# The curl binary has no connect-only option, so with --backend curl it is
+# stopped at the first body byte in both phases: -o points below a file,
+# which curl fails to create and exits with CURLE_WRITE_ERROR.
+PHASE_BODY_PATH = os.path.join(os.devnull, 'httpstat')
+CURLE_WRITE_ERROR = 23
+
 
 # Color code is copied from https://github.com/reorx/python-terminal-color/blob/master/color_simple.py
 ISATTY = sys.stdout.isatty() and 'NO_COLOR' not in os.environ
@@ -103,7 +194,18 @@ cyan = make_color(36)
 bold = make_color(1)
 underline = make_color(4)
 
-grayscale = {(i - 232): make_color(f'38;5;{i}') for i in range(232, 256)}
+
+class _Grayscale(dict):
+    """Grayscale colors 0-23, built on first use."""
+
+    def __missing__(self, key):
+        if not 0 <= key < 24:
+            raise KeyError(key)
+        func = self[key] = make_color(f'38;5;{key + 232}')
+        return func
+
+
+grayscale = _Grayscale()
 
 
 _TRUTHY = frozenset(('1', 'true', 'yes', 'on'))
@@ -145,38 +247,100 @@ SLO_KEY_MAP = {
 }
 
 
-def parse_slo(spec: str) -> dict[str, int]:
-    """Parse 'total=500,connect=100' → {'total': 500, 'connect': 100}.
+def parse_slo(spec: str) -> dict[str, float]:
+    """Parse 'total=500,connect=800us' → {'total': 500, 'connect': 0.8} in ms.
     Exits with error on invalid input.
     """
+    try:
+        return parse_slo_spec(spec)
+    except ValueError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+
+
+def parse_slo_spec(spec: str) -> dict[str, float]:
+    """Like parse_slo, but raises ValueError on invalid input."""
     result = {}
     for part in spec.split(','):
         part = part.strip()
         if not part:
-            print(f'Error: empty SLO spec')
-            sys.exit(1)
+            raise ValueError('empty SLO spec')
         if '=' not in part:
-            print(f'Error: invalid SLO spec "{part}", expected key=value')
-            sys.exit(1)
+            raise ValueError(f'invalid SLO spec "{part}", expected key=value')
         key, _, val = part.partition('=')
         key = key.strip()
         val = val.strip()
         if key not in SLO_KEY_MAP:
             valid = ', '.join(SLO_KEY_MAP.keys())
-            print(f'Error: unknown SLO key "{key}", valid keys: {valid}')
-            sys.exit(1)
+            raise ValueError(f'unknown SLO key "{key}", valid keys: {valid}')
+        # plain values are ms, a `us` suffix gives µs for use with --high-res
+        digits = val[:-2] if val.endswith(('us', 'ms')) else val
         try:
-            ms = int(val)
+            n = int(digits)
         except ValueError:
-            print(f'Error: SLO value for "{key}" must be a positive integer, got "{val}"')
-            sys.exit(1)
-        if ms <= 0:
-            print(f'Error: SLO value for "{key}" must be positive, got {ms}')
-            sys.exit(1)
-        result[key] = ms
+            raise ValueError(f'SLO value for "{key}" must be a positive integer, got "{val}"') from None
+        if n <= 0:
+            raise ValueError(f'SLO value for "{key}" must be positive, got {n}')
+        result[key] = n / 1000 if val.endswith('us') else n
     return result
 
 
+def parse_positive_int(spec: str, flag: str) -> int:
+    """Parse the value of a numeric flag, exits with error on invalid input."""
+    try:
+        n = int(spec)
+    except ValueError:
+        print(f'Error: {flag} must be a positive integer, got "{spec}"')
+        sys.exit(1)
+    if n <= 0:
+        print(f'Error: {flag} must be positive, got {n}')
+        sys.exit(1)
+    return n
+
+
+def parse_rate(spec: str) -> float:
+    """Parse the --rate value in probes per second, exits with error on invalid input."""
+    try:
+        rate = float(spec)
+    except ValueError:
+        print(f'Error: --rate must be a number of probes per second, got "{spec}"')
+        sys.exit(1)
+    if rate <= 0:
+        print(f'Error: --rate must be positive, got {spec}')
+        sys.exit(1)
+    return rate
+
+
+def parse_count(spec: str) -> int:
+    """Parse the --count value, exits with error on invalid input."""
+    return parse_positive_int(spec, '--count')
+
+
+DURATION_UNITS = {
+    'ms': 0.001,
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+}
+
+
+def parse_duration(spec: str, flag: str) -> float:
+    """Parse '500ms', '1s', '5m', '2h', '7d' or plain seconds into seconds.
+    Exits with error on invalid input.
+    """
+    import re
+    m = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(ms|s|m|h|d)?\s*', spec)
+    if not m:
+        print(f'Error: {flag} must be a duration like 500ms, 1s or 5m, got "{spec}"')
+        sys.exit(1)
+    seconds = float(m.group(1)) * DURATION_UNITS[m.group(2) or 's']
+    if seconds <= 0:
+        print(f'Error: {flag} must be positive, got "{spec}"')
+        sys.exit(1)
+    return seconds
+
+
 def check_slo(slo: dict[str, int], timings: dict) -> tuple[bool, list[dict]]:
     """Check timings against SLO thresholds.
     Returns (pass, violations). Each violation: {'key': ..., 'threshold_ms': ..., 'actual_ms': ...}
@@ -194,83 +358,2634 @@ def check_slo(slo: dict[str, int], timings: dict) -> tuple[bool, list[dict]]:
     return (len(violations) == 0, violations)
 
 
-def build_json_result(url: str, d: dict, headers_text: str,
-                      slo_result: tuple[bool, list[dict]] | None,
-                      exit_code: int) -> dict:
-    """Build the v1 JSON schema output dict."""
-    # Parse status line from headers
-    first_line = headers_text.split('\n')[0].strip().rstrip('\r')
-    status_line = first_line
+def convert_metrics(d: dict, high_res: bool = False) -> dict:
+    """Convert curl's time_ metrics to int milliseconds in place, then add
+    the derived range_ keys. Returns d for convenience.
+    With high_res, time_ and range_ values are float milliseconds that
+    keep curl's microseconds, ranges are taken before converting.
+    """
+    for k in d:
+        if k.startswith('time_'):
+            v = d[k]
+            if k in OPTIONAL_TIME_KEYS:
+                # quoted in curl_format, None when this curl does not know it
+                if v is None or v == '':
+                    d[k] = None
+                    continue
+                if isinstance(v, str):
+                    v = float(v) if '.' in v else int(v)
+            # Convert time_ values to milliseconds in int, or microseconds
+            # in int for high_res
+            if isinstance(v, float):
+                # Before 7.61.0, time values are represented as seconds in float
+                d[k] = round(v * 1000000) if high_res else int(v * 1000)
+            elif isinstance(v, int):
+                # Starting from 7.61.0, libcurl uses microsecond in int
+                # to return time values, references:
+                # https://daniel.haxx.se/blog/2018/07/11/curl-7-61-0/
+                # https://curl.se/bug/?i=2495
+                d[k] = v if high_res else int(v / 1000)
+            else:
+                raise TypeError(f'{k} value type is invalid: {type(v)}')
+
+    # curl reports time_connect as 0 when an existing connection is reused,
+    # clamp it so that range_connection is 0 instead of negative
+    if d['time_connect'] < d['time_namelookup']:
+        d['time_connect'] = d['time_namelookup']
+
+    # calculate ranges
+    d.update(
+        range_dns=d['time_namelookup'],
+        range_connection=d['time_connect'] - d['time_namelookup'],
+        range_ssl=d['time_pretransfer'] - d['time_connect'],
+        range_server=d['time_starttransfer'] - d['time_pretransfer'],
+        range_transfer=d['time_total'] - d['time_starttransfer'],
+    )
+    if high_res:
+        for k in d:
+            if k.startswith(('time_', 'range_')) and d[k] is not None:
+                d[k] = d[k] / 1000
+    return d
+
+
+def is_high_res(d: dict) -> bool:
+    """Whether converted metrics come from convert_metrics(high_res=True)."""
+    return isinstance(d['time_namelookup'], float)
+
+
+def limit_phase(d: dict, phase: str) -> dict:
+    """Set the converted metrics `phase` never reaches to None, in place.
+    Returns d for convenience.
+    """
+    for k in PHASE_SKIPPED[phase]:
+        d[k] = None
+    return d
+
+
+def fmt_duration(ms: float) -> str:
+    """Format milliseconds with an adaptive unit: µs below 1ms, s from 1s."""
+    if ms < 1:
+        return f'{round(ms * 1000)}µs'
+    if ms < 1000:
+        return f'{ms:.{2 if ms < 100 else 1}f}ms'
+    return f'{ms / 1000:.{3 if ms < 10000 else 2}f}s'
+
+
+# max body bytes shown with HTTPSTAT_SHOW_BODY
+BODY_LIMIT = 1024
+
+
+def read_body_preview(path: str, limit: int = BODY_LIMIT) -> bytes:
+    """Read at most limit bytes from the start of a body file."""
+    with open(path, 'rb') as f:
+        return f.read(limit)
+
+
+def decode_body_preview(preview: bytes) -> str | None:
+    """Decode a body preview as UTF-8, returns None for binary content.
+    A multi-byte character cut off at the end of the preview is dropped.
+    """
+    if b'\x00' in preview:
+        return None
+    import codecs
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    return decoder.decode(preview, final=False)
+
+
+# (json key, metrics key, pretty label)
+AGGREGATE_FIELDS = (
+    ('dns', 'range_dns', 'DNS Lookup'),
+    ('connect', 'range_connection', 'TCP Connection'),
+    ('tls', 'range_ssl', 'TLS Handshake'),
+    ('server', 'range_server', 'Server Processing'),
+    ('transfer', 'range_transfer', 'Content Transfer'),
+    ('total', 'time_total', 'Total'),
+)
+
+AGGREGATE_STATS = ('min', 'mean', 'p50', 'p90', 'p95', 'p99', 'max')
+
+
+def percentile(values: list, pct: float) -> float:
+    """Return the pct-th percentile of values using linear interpolation
+    between closest ranks (same as numpy's default method).
+    """
+    if not values:
+        raise ValueError('percentile of empty sequence')
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summarize(values: list, digits: int = 1) -> dict[str, float]:
+    """Compute AGGREGATE_STATS for a list of numbers, rounded to digits."""
+    ordered = sorted(values)
+    return {
+        'min': ordered[0],
+        'mean': round(sum(ordered) / len(ordered), digits),
+        'p50': round(percentile(ordered, 50), digits),
+        'p90': round(percentile(ordered, 90), digits),
+        'p95': round(percentile(ordered, 95), digits),
+        'p99': round(percentile(ordered, 99), digits),
+        'max': ordered[-1],
+    }
+
+
+def aggregate_samples(samples: list[dict]) -> dict:
+    """Aggregate converted metrics dicts into per-phase statistics.
+    Returns {'count': n, 'dns': {'min': ..., 'p50': ..., ...}, ...}.
+    """
+    result: dict = {'count': len(samples)}
+    # µs are kept for high_res metrics
+    digits = 3 if is_high_res(samples[0]) else 1
+    for name, key, _ in AGGREGATE_FIELDS:
+        # null for phases --phase skipped
+        values = [s[key] for s in samples]
+        result[name] = None if values[0] is None else summarize(values, digits)
+    return result
+
+
+def worst_timings(samples: list[dict]) -> dict:
+    """Return the per-key maximum of time_ metrics across samples, so that
+    check_slo on the result fails if any single sample violates a threshold.
+    """
+    return {k: max(s[k] for s in samples) for k in samples[0]
+            if k.startswith('time_') and samples[0][k] is not None}
+
+
+def render_template(d: dict, https: bool, phase: str = 'full') -> str:
+    """Fill the TEMPLATES entry for phase with converted metrics."""
+    template = TEMPLATES[(phase, https)]
+
+    # colorize template first line
+    tpl_parts = template.split('\n')
+    tpl_parts[0] = grayscale[16](tpl_parts[0])
+    template = '\n'.join(tpl_parts)
+
+    fmt = fmt_duration if is_high_res(d) else lambda s: str(s) + 'ms'
+
+    def fmta(s):
+        return '' if s is None else cyan(f'{fmt(s):^7}')
+
+    def fmtb(s):
+        return '' if s is None else cyan(f'{fmt(s):<7}')
+
+    return template.format(
+        # a
+        a0000=fmta(d['range_dns']),
+        a0001=fmta(d['range_connection']),
+        a0002=fmta(d['range_ssl']),
+        a0003=fmta(d['range_server']),
+        a0004=fmta(d['range_transfer']),
+        # b
+        b0000=fmtb(d['time_namelookup']),
+        b0001=fmtb(d['time_connect']),
+        b0002=fmtb(d['time_pretransfer']),
+        b0003=fmtb(d['time_starttransfer']),
+        b0004=fmtb(d['time_total']),
+    )
+
+
+def render_details(d: dict, https: bool) -> str:
+    """Render the curl metrics beyond the phase template, a few
+    `name: value` pairs per line. Metrics this curl does not report are
+    left out.
+    """
+    def pairs(items):
+        return '   '.join(grayscale[14](f'{k}: ') + cyan(v) for k, v in items)
+
+    lines = []
+    conn = [('http_version', d.get('http_version')),
+            ('num_connects', d.get('num_connects')),
+            ('num_redirects', d.get('num_redirects'))]
+    if https and d.get('ssl_verify_result') is not None:
+        v = d['ssl_verify_result']
+        conn.append(('ssl_verify_result', f'{v} ({"ok" if v == 0 else "failed"})'))
+    sizes = [(k, f'{d[k]}B') for k in ('size_request', 'size_header', 'size_download') if d.get(k) is not None]
+    times = [(k, _fmt_ms(d[k])) for k in OPTIONAL_TIME_KEYS if d.get(k) is not None]
+    if d.get('time_redirect'):
+        times.insert(0, ('time_redirect', _fmt_ms(d['time_redirect'])))
+    for items in ([(k, str(v)) for k, v in conn if v not in (None, '')], sizes, times):
+        if items:
+            lines.append(pairs(items))
+    return '\n'.join(lines)
+
+
+def format_aggregate(aggregate: dict, show_tls: bool = True, fmt=None) -> str:
+    """Render an aggregate block as a plain-text table for pretty mode,
+    cells formatted with fmt, _fmt_ms by default.
+    """
+    fmt = fmt or _fmt_ms
+    lines = [grayscale[16](f'{"":<19}' + ''.join(f'{s:>9}' for s in AGGREGATE_STATS))]
+    for name, _, label in AGGREGATE_FIELDS:
+        stats = aggregate[name]
+        if (name == 'tls' and not show_tls) or stats is None:
+            continue
+        cells = ''.join(f'{fmt(stats[s]):>9}' for s in AGGREGATE_STATS)
+        lines.append(f'{label:<19}' + cyan(cells))
+    return '\n'.join(lines)
+
+
+def _fmt_ms(v: float) -> str:
+    if isinstance(v, float) and not v.is_integer():
+        return f'{v:.1f}ms'
+    return f'{int(v)}ms'
+
+
+class ProbeError(Exception):
+    """A probe failed, exit_code mirrors curl's exit codes where possible."""
+
+    def __init__(self, exit_code: int, message: str):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def make_cmd_env() -> dict[str, str]:
+    """Environment for curl subprocesses, forcing the C locale so that
+    time values never use a comma as decimal separator.
+    """
+    cmd_env = os.environ.copy()
+    cmd_env.update(
+        LC_ALL='C',
+    )
+    return cmd_env
+
+
+def build_curl_cmd(curl_bin: str, curl_args: list[str], url: str,
+                   header_path: str, body_path: str) -> list[str]:
+    """Build the curl command line. The -w/-D/-o values sit at fixed
+    positions (2, 4, 6), which the error output relies on for masking.
+    """
+    cmd_core = [curl_bin, '-w', curl_format, '-D', header_path, '-o', body_path, '-s', '-S']
+    return cmd_core + curl_args + [url]
+
+
+# curl can write its header dump and body to an inherited pipe through
+# /dev/fd/N, which avoids tempfiles when nothing needs to be kept on disk.
+PIPES_SUPPORTED = os.name == 'posix' and os.path.isdir('/dev/fd')
+
+
+class PipeSink:
+    """A pipe whose read end is drained by a thread while curl writes to
+    `path`. At most `limit` bytes are kept in `data`, `size` counts all of
+    them. Pass it to run_curl, which closes the write end and waits for EOF.
+    """
+
+    def __init__(self, limit: int | None = None):
+        self._r, self.fd = os.pipe()
+        self.path = f'/dev/fd/{self.fd}'
+        self.limit = limit
+        self.data = bytearray()
+        self.size = 0
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        with os.fdopen(self._r, 'rb', buffering=0) as f:
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    break
+                self.size += len(chunk)
+                if self.limit is None:
+                    self.data += chunk
+                elif len(self.data) < self.limit:
+                    self.data += chunk[:self.limit - len(self.data)]
+
+    def close_writer(self):
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+    def wait(self) -> bytes:
+        self.close_writer()
+        self._thread.join()
+        return bytes(self.data)
+
+    def text(self) -> str:
+        return self.wait().decode(errors='replace')
+
+
+def run_curl(cmd: list[str], cmd_env: dict[str, str],
+             sinks: Iterable[PipeSink] = ()) -> tuple[int, str, str]:
+    """Run curl and return (returncode, stdout, stderr) as text.
+    Sinks referenced by path in cmd are inherited by curl and fully
+    drained when this returns.
+    """
+    sinks = list(sinks)
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=cmd_env,
+                             pass_fds=[s.fd for s in sinks])
+    finally:
+        for sink in sinks:
+            sink.close_writer()
+    out, err = p.communicate()
+    for sink in sinks:
+        sink.wait()
+    return p.returncode, out.decode(errors='replace'), decode_curl_err(err)
+
+
+def decode_curl_err(err: bytes) -> str:
+    """Decode curl's stderr, dropping the warnings for write-out
+    variables newer than this curl, see OPTIONAL_TIME_KEYS.
+    """
+    err_text = err.decode(errors='replace')
+    if WRITE_OUT_WARNING in err_text:
+        err_text = ''.join(line for line in err_text.splitlines(keepends=True)
+                           if not line.startswith(WRITE_OUT_WARNING))
+    return err_text
+
+
+def build_reuse_cmd(curl_bin: str, curl_args: list[str], url: str,
+                    header_path: str, body_path: str, n: int,
+                    rest_body_path: str | None = None) -> list[str]:
+    """Like build_curl_cmd, but requests url n times in the same curl
+    process so that requests after the first reuse its connection.
+    Headers of all requests are appended to header_path, bodies after the
+    first go to rest_body_path if given.
+    """
+    cmd = build_curl_cmd(curl_bin, curl_args, url, header_path, body_path)
+    for _ in range(n - 1):
+        cmd += ['-o', rest_body_path or body_path, url]
+    return cmd
+
+
+def split_write_out(out: str) -> list[dict]:
+    """Parse the concatenated -w records curl prints for multiple transfers."""
+    decoder = json.JSONDecoder()
+    records = []
+    out = out.strip()
+    pos = 0
+    while pos < len(out):
+        record, pos = decoder.raw_decode(out, pos)
+        records.append(record)
+        while pos < len(out) and out[pos].isspace():
+            pos += 1
+    return records
+
+
+def split_header_blocks(headers_text: str) -> list[str]:
+    """Split a header dump of several responses into one block per response."""
+    blocks = headers_text.replace('\r\n', '\n').split('\n\n')
+    return [b.strip() for b in blocks if b.strip()]
+
+
+def parse_status_line(block: str) -> tuple[str, int]:
+    """Return (status line, status code) of a header block, code 0 if the
+    status line cannot be parsed.
+    """
+    status_line = block.split('\n')[0].strip().rstrip('\r')
     # Extract status code: "HTTP/2 200" or "HTTP/1.1 301 Moved Permanently"
-    parts = first_line.split(None, 2)
+    parts = status_line.split(None, 2)
     try:
         status_code = int(parts[1]) if len(parts) >= 2 else 0
     except (ValueError, IndexError):
         status_code = 0
+    return status_line, status_code
+
+
+LOCATION_ARGS = ('-L', '--location', '--location-trusted')
+
+
+def redirect_chain(url: str, headers_text: str) -> list[str]:
+    """Return the urls a `curl -L` run went through, url first, from the
+    Location headers of the redirect responses in its header dump.
+    """
+    from urllib.parse import urljoin
+
+    # curl assumes http:// for urls without a scheme
+    chain = [url if '://' in url else 'http://' + url]
+    for block in split_header_blocks(headers_text):
+        _, status_code = parse_status_line(block)
+        if not 300 <= status_code < 400:
+            continue
+        for line in block.split('\n')[1:]:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'location' and value.strip():
+                chain.append(urljoin(chain[-1], value.strip()))
+                break
+    return chain
 
-    ok = exit_code == 0
 
-    # Parse headers into dict (skip status line)
-    headers_dict: dict[str, str] = {}
-    for line in headers_text.split('\n')[1:]:
+def build_hops_result(hops: list[tuple[str, int, dict]]) -> list[dict]:
+    """Build the `hops` JSON block from (url, status code, converted
+    metrics) per hop of a redirect chain.
+    """
+    return [{
+        'url': url,
+        'status_code': status_code,
+        'num_connects': d.get('num_connects'),
+        'timings_ms': build_timings(d),
+    } for url, status_code, d in hops]
+
+
+def build_ips_result(ips: list[tuple[str, dict | ProbeError, str]]) -> list[dict]:
+    """Build the `ips` JSON block from (ip, converted metrics or the
+    ProbeError, headers text) per resolved address.
+    """
+    result = []
+    for ip, d, headers_text in ips:
+        if isinstance(d, ProbeError):
+            result.append({'ip': ip, 'ok': False, 'exit_code': d.exit_code, 'error': str(d),
+                           'status_code': None, 'timings_ms': None})
+        else:
+            result.append({'ip': ip, 'ok': True, 'exit_code': 0, 'error': None,
+                           'status_code': parse_status_line(split_header_blocks(headers_text)[-1])[1],
+                           'timings_ms': build_timings(d)})
+    return result
+
+
+def slowest_ip(ips: list[tuple[str, dict | ProbeError, str]]) -> int | None:
+    """Index of the successful probe with the highest time_total."""
+    ok = [i for i, (_, d, _) in enumerate(ips) if not isinstance(d, ProbeError)]
+    return max(ok, key=lambda i: ips[i][1]['time_total']) if ok else None
+
+
+def format_ips(ips: list[tuple[str, dict | ProbeError, str]], show_tls: bool) -> str:
+    """Render one phase table row per address, the slowest in red, then
+    the addresses that failed.
+    """
+    ok = [(ip, d) for ip, d, _ in ips if not isinstance(d, ProbeError)]
+    lines = []
+    if ok:
+        slowest = [ip for ip, _ in ok].index(ips[slowest_ip(ips)][0]) if len(ok) > 1 else None
+        lines.append(format_phase_table(ok, show_tls, highlight=slowest))
+    for ip, e, _ in ips:
+        if isinstance(e, ProbeError):
+            lines.append(f'{ip}  ' + yellow(str(e)))
+    return '\n'.join(lines)
+
+
+def build_reuse_result(samples: list[dict]) -> dict:
+    """Build the `reuse` JSON block: per-request timings and connection
+    counts, plus statistics over the warm requests, those that reused a
+    connection (num_connects 0). A server that closes the connection
+    leaves no warm requests.
+    """
+    warm = [d for d in samples[1:] if d.get('num_connects') == 0]
+    return {
+        'count': len(samples),
+        'requests': [dict(build_timings(d), num_connects=d.get('num_connects')) for d in samples],
+        'warm': aggregate_samples(warm) if warm else None,
+    }
+
+
+# Forces a new TCP connection per request while keeping curl's TLS session
+# cache, HTTP/2 would otherwise multiplex over the first connection.
+TLS_RESUME_ARGS = ['--http1.1', '-H', 'Connection: close']
+
+
+def build_tls_resumption_result(samples: list[dict]) -> dict:
+    """Build the `tls_resumption` JSON block from samples where the first
+    request did a full TLS handshake and the rest resumed its session.
+    Handshake time is time_appconnect - time_connect.
+    """
+    # µs are kept for high_res metrics
+    digits = 3 if is_high_res(samples[0]) else 1
+    handshakes = [round(d['time_appconnect'] - d['time_connect'], digits) for d in samples]
+    result: dict = {
+        'count': len(samples),
+        'full_ms': handshakes[0],
+        'resumed_ms': handshakes[1:],
+        'resumed': None,
+        'saved_ms': None,
+    }
+    if len(handshakes) > 1:
+        resumed = summarize(handshakes[1:], digits)
+        result['resumed'] = resumed
+        result['saved_ms'] = round(handshakes[0] - resumed['p50'], digits)
+    return result
+
+
+def format_phase_table(rows: list[tuple[str, dict]], show_tls: bool = True,
+                       highlight: int | None = None) -> str:
+    """Render one row of phase timings per (label, converted metrics) pair,
+    the row at index `highlight` in red.
+    """
+    fmt = fmt_duration if is_high_res(rows[0][1]) else _fmt_ms
+    fields = [f for f in AGGREGATE_FIELDS if show_tls or f[0] != 'tls']
+    width = max(len(label) for label, _ in rows)
+    lines = [grayscale[16](' ' * width + ''.join(f'{label:>19}' for _, _, label in fields))]
+    for i, (label, d) in enumerate(rows):
+        cells = ''.join(f'{fmt(d[key]):>19}' for _, key, _ in fields)
+        lines.append(f'{label:<{width}}' + (red if i == highlight else cyan)(cells))
+    return '\n'.join(lines)
+
+
+def format_hops(hops: list[tuple[str, int, dict]]) -> str:
+    """Render a redirect chain as a phase table, one row per hop, followed
+    by the url of each hop.
+    """
+    show_tls = any(url.startswith('https://') for url, _, _ in hops)
+    rows = [(f'#{i + 1} {status_code}', d) for i, (_, status_code, d) in enumerate(hops)]
+    lines = [format_phase_table(rows, show_tls)]
+    for label, (url, _, d) in zip((label for label, _ in rows), hops):
+        reused = ' (reused connection)' if d.get('num_connects') == 0 else ''
+        lines.append(f'{label:<8}' + grayscale[14](url + reused))
+    return '\n'.join(lines)
+
+
+def build_timings(d: dict) -> dict:
+    """Map converted metrics to the `timings_ms` block of the JSON schema."""
+    return {
+        'dns': d['range_dns'],
+        'connect': d['range_connection'],
+        'tls': d['range_ssl'],
+        'server': d['range_server'],
+        'transfer': d['range_transfer'],
+        'total': d['time_total'],
+        'namelookup': d['time_namelookup'],
+        'initial_connect': d['time_connect'],
+        'pretransfer': d['time_pretransfer'],
+        'starttransfer': d['time_starttransfer'],
+        # null when curl is too old to report them
+        'queue': d.get('time_queue'),
+        'posttransfer': d.get('time_posttransfer'),
+    }
+
+
+def build_timings_us(d: dict) -> dict:
+    """The `timings_us` block for high_res metrics, timings_ms in int µs."""
+    return {k: None if v is None else round(v * 1000) for k, v in build_timings(d).items()}
+
+
+class ProbeResult:
+    """The outcome of one probe: converted metrics `metrics`, the final
+    response's status and headers, and the SLO verdict. probe() returns
+    it, to_dict() renders the v1 JSON schema.
+    """
+
+    __slots__ = ('url', 'metrics', 'headers_text', 'status_line', 'status_code',
+                 'headers', 'slo', 'exit_code')
+
+    def __init__(self, url: str, metrics: dict, headers_text: str,
+                 slo: tuple[bool, list[dict]] | None = None, exit_code: int = 0):
+        self.url = url
+        self.metrics = metrics
+        self.headers_text = headers_text
+        # with -L the response is the last one in headers_text
+        blocks = split_header_blocks(headers_text)
+        final = blocks[-1] if blocks else ''
+        self.status_line, self.status_code = parse_status_line(final)
+        self.headers = parse_headers(final)
+        self.slo = slo
+        self.exit_code = exit_code
+
+    def __repr__(self) -> str:
+        total = self.metrics['time_total']
+        return f'<ProbeResult {self.status_code} {self.url}' + ('>' if total is None else f' total={total}ms>')
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    @property
+    def slo_pass(self) -> bool | None:
+        """None when no SLO was checked."""
+        return None if self.slo is None else self.slo[0]
+
+    @property
+    def timings(self) -> dict:
+        """Phase durations and cumulative times in ms, see build_timings."""
+        return build_timings(self.metrics)
+
+    @property
+    def speed(self) -> dict:
+        def kbs(key):
+            # null for phases --phase skipped
+            v = self.metrics.get(key, 0)
+            return None if v is None else round(v / 1024, 1)
+        return {'download_kbs': kbs('speed_download'), 'upload_kbs': kbs('speed_upload')}
+
+    def to_dict(self, **extra) -> dict:
+        """Build the v1 JSON schema output dict, blocks in `extra` that
+        are not None (aggregate, reuse, hops, ...) are appended.
+        """
+        d = self.metrics
+        result = {
+            'schema_version': 1,
+            'url': self.url,
+            'ok': self.ok,
+            'exit_code': self.exit_code,
+            'response': {
+                'status_line': self.status_line,
+                'status_code': self.status_code,
+                'remote_ip': d.get('remote_ip', ''),
+                'remote_port': d.get('remote_port', ''),
+                'http_version': d.get('http_version', ''),
+                'headers': self.headers,
+            },
+            'timings_ms': self.timings,
+            'connection': {
+                'num_connects': d.get('num_connects'),
+                'num_redirects': d.get('num_redirects'),
+                'ssl_verify_result': d.get('ssl_verify_result'),
+            },
+            'size_bytes': {
+                'request': d.get('size_request'),
+                'header': d.get('size_header'),
+                'download': d.get('size_download'),
+            },
+            'speed': self.speed,
+            'slo': None,
+        }
+
+        if self.slo is not None:
+            result['slo'] = {
+                'pass': self.slo[0],
+                'violations': self.slo[1],
+            }
+        if is_high_res(d):
+            result['timings_us'] = build_timings_us(d)
+
+        for key, block in extra.items():
+            if block is not None:
+                result[key] = block
+        return result
+
+
+def parse_headers(block: str) -> dict[str, str]:
+    """Parse one response's header block into a dict, skipping the status line."""
+    headers: dict[str, str] = {}
+    for line in block.split('\n')[1:]:
         line = line.strip().rstrip('\r')
         if not line:
             continue
         pos = line.find(':')
         if pos != -1:
-            key = line[:pos].strip()
-            value = line[pos + 1:].strip()
-            headers_dict[key] = value
+            headers[line[:pos].strip()] = line[pos + 1:].strip()
+    return headers
+
+
+def build_json_result(url: str, d: dict, headers_text: str,
+                      slo_result: tuple[bool, list[dict]] | None,
+                      exit_code: int, aggregate: dict | None = None,
+                      reuse: dict | None = None,
+                      tls_resumption: dict | None = None,
+                      load: dict | None = None,
+                      hops: list[dict] | None = None,
+                      baseline: dict | None = None) -> dict:
+    """Build the v1 JSON schema output dict.
+    `aggregate`, `reuse`, `tls_resumption`, `load`, `hops` and `baseline`
+    are only included when given, i.e. in --count, --reuse, --tls-resume,
+    --rate, --hops and --baseline mode.
+    """
+    return ProbeResult(url, d, headers_text, slo_result, exit_code).to_dict(
+        aggregate=aggregate, reuse=reuse, tls_resumption=tls_resumption,
+        load=load, hops=hops, baseline=baseline)
 
-    result = {
+
+def build_error_result(url: str, exit_code: int, error: str) -> dict:
+    """Build a v1 JSON record for a probe that produced no metrics."""
+    return {
         'schema_version': 1,
         'url': url,
-        'ok': ok,
+        'ok': False,
         'exit_code': exit_code,
-        'response': {
-            'status_line': status_line,
-            'status_code': status_code,
-            'remote_ip': d.get('remote_ip', ''),
-            'remote_port': d.get('remote_port', ''),
-            'headers': headers_dict,
-        },
-        'timings_ms': {
-            'dns': d['range_dns'],
-            'connect': d['range_connection'],
-            'tls': d['range_ssl'],
-            'server': d['range_server'],
-            'transfer': d['range_transfer'],
-            'total': d['time_total'],
-            'namelookup': d['time_namelookup'],
-            'initial_connect': d['time_connect'],
-            'pretransfer': d['time_pretransfer'],
-            'starttransfer': d['time_starttransfer'],
-        },
-        'speed': {
-            'download_kbs': round(d.get('speed_download', 0) / 1024, 1),
-            'upload_kbs': round(d.get('speed_upload', 0) / 1024, 1),
-        },
-        'slo': None,
+        'error': error,
+    }
+
+
+def read_urls(path: str) -> list[str]:
+    """Read target urls from a file, or stdin if path is `-`.
+    One url per line, blank lines and `#` comments are ignored.
+    """
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, 'r') as f:
+            lines = f.read().splitlines()
+    urls = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            urls.append(line)
+    return urls
+
+
+def run_probe_cmd(make_cmd, cmd_env: dict[str, str]) -> tuple[str, str]:
+    """Run the curl command `make_cmd(header_path)` builds, which must
+    discard the body. Returns (write-out, headers text), raises ProbeError
+    when curl fails.
+    """
+    if PIPES_SUPPORTED:
+        sink = PipeSink()
+        returncode, out, err = run_curl(make_cmd(sink.path), cmd_env, [sink])
+        headers_text = sink.text().strip()
+    else:
+        import tempfile
+        headerf = tempfile.NamedTemporaryFile(delete=False)
+        headerf.close()
+        try:
+            returncode, out, err = run_curl(make_cmd(headerf.name), cmd_env)
+            with open(headerf.name, 'r') as f:
+                headers_text = f.read().strip()
+        finally:
+            try:
+                os.remove(headerf.name)
+            except OSError:
+                pass
+
+    if returncode != 0:
+        raise ProbeError(returncode, f'curl error: {err.strip()}')
+    return out, headers_text
+
+
+def probe_metrics(url: str, curl_bin: str, curl_args: list[str],
+                  cmd_env: dict[str, str], high_res: bool = False) -> tuple[dict, str]:
+    """Probe url once with curl, discarding the body.
+    Returns (converted metrics, headers text), raises ProbeError on failure.
+    """
+    out, headers_text = run_probe_cmd(
+        lambda header_path: build_curl_cmd(curl_bin, curl_args, url, header_path, os.devnull),
+        cmd_env)
+    try:
+        d = convert_metrics(json.loads(out), high_res)
+    except ValueError as e:
+        raise ProbeError(1, f'Could not decode json: {e}')
+    return d, headers_text
+
+
+def probe_hops(urls: list[str], curl_bin: str, curl_args: list[str],
+               cmd_env: dict[str, str], high_res: bool = False) -> list[tuple[str, int, dict]]:
+    """Probe each url of a redirect chain without following redirects,
+    all in one curl process so that hops to the same host reuse its
+    connection. Returns (url, status code, converted metrics) per hop,
+    raises ProbeError on failure.
+    """
+    args = [a for a in curl_args if a not in LOCATION_ARGS]
+
+    def make_cmd(header_path):
+        cmd = build_curl_cmd(curl_bin, args, urls[0], header_path, os.devnull)
+        for url in urls[1:]:
+            cmd += ['-o', os.devnull, url]
+        return cmd
+
+    out, headers_text = run_probe_cmd(make_cmd, cmd_env)
+    try:
+        records = split_write_out(out)
+    except ValueError as e:
+        raise ProbeError(1, f'Could not decode json: {e}')
+    blocks = split_header_blocks(headers_text)
+    return [(url, parse_status_line(blocks[i])[1] if i < len(blocks) else 0, convert_metrics(d, high_res))
+            for i, (url, d) in enumerate(zip(urls, records))]
+
+
+# curl options that pin the address --all-ips chooses itself
+ADDRESS_ARGS = ('--resolve', '--connect-to')
+
+
+def resolve_all(url: str, curl_args: list[str]) -> tuple[str, int, list[str]]:
+    """Resolve every address of url's host, honoring -4/-6 in curl_args.
+    Returns (host, port, unique addresses in resolver order), raises
+    ProbeError like curl when the host does not resolve.
+    """
+    import socket
+    from urllib.parse import urlsplit
+
+    parts = urlsplit(url if '://' in url else 'http://' + url)
+    host = parts.hostname or ''
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    family = socket.AF_UNSPEC
+    if '-4' in curl_args or '--ipv4' in curl_args:
+        family = socket.AF_INET
+    elif '-6' in curl_args or '--ipv6' in curl_args:
+        family = socket.AF_INET6
+    try:
+        infos = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ProbeError(6, f'Could not resolve host: {host}')
+    ips = list(dict.fromkeys(info[4][0] for info in infos))
+    return host, port, ips
+
+
+def probe_ips(url: str, host: str, port: int, ips: list[str], concurrency: int,
+              curl_bin: str, curl_args: list[str], cmd_env: dict[str, str],
+              high_res: bool = False) -> list[tuple[str, dict | ProbeError, str]]:
+    """Probe url once per address at the same time, pinning curl to it
+    with --resolve so that Host and SNI stay those of url. Returns
+    (ip, converted metrics or the ProbeError, headers text) in ips order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def run(ip):
+        pinned = f'[{ip}]' if ':' in ip else ip
+        try:
+            d, headers_text = probe_metrics(url, curl_bin, ['--resolve', f'{host}:{port}:{pinned}'] + curl_args,
+                                            cmd_env, high_res)
+        except ProbeError as e:
+            return ip, e, ''
+        return ip, d, headers_text
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(ips))) as pool:
+        return list(pool.map(run, ips))
+
+
+def probe_url(url: str, curl_bin: str, curl_args: list[str],
+              cmd_env: dict[str, str], slo: dict[str, int] | None) -> dict:
+    """Probe url once without printing anything, return its JSON result.
+    The body is discarded, curl failures are reported as error records.
+    """
+    try:
+        result = probe(url, curl_args, slo, curl_bin, cmd_env)
+    except ProbeError as e:
+        return build_error_result(url, e.exit_code, str(e))
+    return result.to_dict()
+
+
+def probe(url: str, curl_args: Iterable[str] = (), slo: str | dict[str, float] | None = None,
+          curl_bin: str | None = None, cmd_env: dict[str, str] | None = None,
+          high_res: bool = False) -> ProbeResult:
+    """Probe url once with curl and return a ProbeResult, the body is
+    discarded. This is the library entry point, it never prints or exits:
+
+        >>> r = httpstat.probe('https://example.com', ['-H', 'Accept: text/html'], slo='total=500')
+        >>> r.status_code, r.timings['starttransfer'], r.slo_pass
+
+    `slo` is a spec like the --slo flag takes or its parsed dict, high_res
+    keeps microseconds like --high-res. Raises ValueError for an invalid
+    slo and ProbeError when curl fails.
+    """
+    slo = coerce_slo(slo)
+    if curl_bin is None:
+        curl_bin = ENV_CURL_BIN.get('curl')
+    if cmd_env is None:
+        cmd_env = make_cmd_env()
+    d, headers_text = probe_metrics(url, curl_bin, list(curl_args), cmd_env, high_res)
+    return finish_probe(url, d, headers_text, slo)
+
+
+def coerce_slo(slo: str | dict[str, float] | None) -> dict[str, float] | None:
+    """Accept an SLO spec string or dict for the library API, raising
+    ValueError for unknown keys.
+    """
+    if isinstance(slo, str):
+        return parse_slo_spec(slo)
+    if slo:
+        unknown = set(slo) - set(SLO_KEY_MAP)
+        if unknown:
+            raise ValueError(f'unknown SLO keys: {", ".join(sorted(unknown))}')
+    return slo or None
+
+
+def finish_probe(url: str, d: dict, headers_text: str,
+                 slo: dict[str, int] | None) -> ProbeResult:
+    """Check SLO for converted metrics and wrap them in a ProbeResult."""
+    slo_result = check_slo(slo, d) if slo else None
+    exit_code = 4 if slo_result and not slo_result[0] else 0
+    return ProbeResult(url, d, headers_text, slo_result, exit_code)
+
+
+async def aprobe(url: str, curl_args: Iterable[str] = (), slo: str | dict[str, float] | None = None,
+                 curl_bin: str | None = None, cmd_env: dict[str, str] | None = None,
+                 high_res: bool = False) -> ProbeResult:
+    """Like probe(), but awaits curl with asyncio instead of blocking, so
+    that an event loop can run many probes without a thread each.
+    """
+    import asyncio
+
+    slo = coerce_slo(slo)
+    if curl_bin is None:
+        curl_bin = ENV_CURL_BIN.get('curl')
+    if cmd_env is None:
+        cmd_env = make_cmd_env()
+    # headers go to stdout ahead of the write-out, no pipe or tempfile to manage
+    cmd = build_curl_cmd(curl_bin, list(curl_args), url, '-', os.devnull)
+    p = await asyncio.create_subprocess_exec(
+        *cmd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE, env=cmd_env)
+    try:
+        out, err = await p.communicate()
+    finally:
+        if p.returncode is None:
+            # cancelled, don't leave curl running
+            p.kill()
+    if p.returncode != 0:
+        raise ProbeError(p.returncode, f'curl error: {decode_curl_err(err).strip()}')
+    headers_text, write_out = split_header_dump(out.decode(errors='replace'))
+    try:
+        d = convert_metrics(json.loads(write_out), high_res)
+    except ValueError as e:
+        raise ProbeError(1, f'Could not decode json: {e}')
+    return finish_probe(url, d, headers_text, slo)
+
+
+# curl_format's literal start, which no header line can contain
+WRITE_OUT_START = curl_format[:curl_format.index('%')]
+
+
+def split_header_dump(out: str) -> tuple[str, str]:
+    """Split curl's stdout with `-D -` into (headers text, write-out).
+    The write-out starts at the last WRITE_OUT_START, servers may end
+    header lines with a bare LF so line endings can't be relied on.
+    """
+    pos = out.rfind(WRITE_OUT_START)
+    if pos == -1:
+        return '', out
+    return out[:pos].strip(), out[pos:]
+
+
+async def aprobe_many(urls: Iterable[str], curl_args: Iterable[str] = (),
+                      slo: str | dict[str, float] | None = None, limit: int = 10,
+                      curl_bin: str | None = None, high_res: bool = False):
+    """Probe urls with aprobe(), at most `limit` in flight, yielding
+    (url, ProbeResult or ProbeError) in completion order. Urls are taken
+    from the iterable as slots free up, pending probes are cancelled when
+    the consumer stops early.
+    """
+    import asyncio
+
+    if limit < 1:
+        raise ValueError(f'limit must be positive, got {limit}')
+    slo = coerce_slo(slo)
+    curl_args = list(curl_args)
+    if curl_bin is None:
+        curl_bin = ENV_CURL_BIN.get('curl')
+    cmd_env = make_cmd_env()
+
+    async def run(url):
+        try:
+            return url, await aprobe(url, curl_args, slo, curl_bin, cmd_env, high_res)
+        except ProbeError as e:
+            return url, e
+
+    todo = iter(urls)
+    pending = set()
+    try:
+        while True:
+            for url in todo:
+                pending.add(asyncio.ensure_future(run(url)))
+                if len(pending) >= limit:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def render_watch(url: str, latest: dict | None, samples: Iterable[dict], ticks: int,
+                 errors: int, last_error: str | None, slo: dict[str, int] | None) -> str:
+    """Render one watch-mode screen: the latest sample's breakdown next to
+    rolling p50/p95 over the window, and SLO status.
+    """
+    samples = list(samples)
+    https = url.startswith('https://')
+    lines = [f"{green('Watching')} {cyan(url)}: {ticks} probes, {len(samples)} in window, {errors} errors",
+             time.strftime('%Y-%m-%d %H:%M:%S'), '']
+    if latest is not None:
+        lines.append(render_template(latest, https))
+    else:
+        lines.append(yellow(f'last probe failed: {last_error}'))
+        lines.append('')
+
+    if samples:
+        stats = ('latest', 'p50', 'p95')
+        lines.append(grayscale[16](f'{"":<19}' + ''.join(f'{s:>9}' for s in stats)))
+        for name, key, label in AGGREGATE_FIELDS:
+            if name == 'tls' and not https:
+                continue
+            values = [d[key] for d in samples]
+            cells = [
+                _fmt_ms(latest[key]) if latest is not None else '-',
+                _fmt_ms(round(percentile(values, 50), 1)),
+                _fmt_ms(round(percentile(values, 95), 1)),
+            ]
+            lines.append(f'{label:<19}' + cyan(''.join(f'{c:>9}' for c in cells)))
+
+    if slo:
+        lines.append('')
+        for key, threshold in slo.items():
+            timing_key = SLO_KEY_MAP[key]
+            violations = sum(1 for d in samples if d[timing_key] > threshold)
+            line = f'SLO {key} <= {threshold}ms: {violations}/{len(samples)} violations in window'
+            if latest is not None and latest[timing_key] > threshold:
+                line = red(f'SLO VIOLATION: {key} = {latest[timing_key]}ms (threshold: {threshold}ms), ') + \
+                    red(f'{violations}/{len(samples)} in window')
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def run_watch(url: str, curl_bin: str, curl_args: list[str], cmd_env: dict[str, str],
+              interval: float, window: int, slo: dict[str, int] | None,
+              output_format: str, ticks: int | None = None, save_path: str | None = None) -> int:
+    """Probe url every `interval` seconds until interrupted, or for `ticks`
+    probes. Keeps the last `window` samples in a ring buffer for rolling
+    statistics. Pretty mode redraws in place on a terminal, json formats
+    print one jsonl record per probe, which are also appended to save_path.
+    Returns 4 if the window ends with SLO violations, otherwise 0.
+    """
+    import math
+    from collections import deque
+
+    samples: deque[dict] = deque(maxlen=window)
+    errors = 0
+    last_error = None
+    tick = 0
+    next_run = time.monotonic()
+    savef = open(save_path, 'w') if save_path else None
+    try:
+        while ticks is None or tick < ticks:
+            try:
+                d, headers_text = probe_metrics(url, curl_bin, curl_args, cmd_env)
+            except ProbeError as e:
+                d = None
+                errors += 1
+                last_error = str(e)
+                result = build_error_result(url, e.exit_code, last_error)
+            else:
+                samples.append(d)
+                result = finish_result(url, d, headers_text, slo)
+            tick += 1
+
+            if output_format != 'pretty' or savef:
+                result['aggregate'] = aggregate_samples(list(samples)) if samples else None
+            if output_format == 'pretty':
+                screen = render_watch(url, d, samples, tick, errors, last_error, slo)
+                if ISATTY:
+                    # cursor home and clear screen, then redraw
+                    print('\x1b[H\x1b[J' + screen, flush=True)
+                else:
+                    print(screen + '\n', flush=True)
+            else:
+                print(json.dumps(result), flush=True)
+            if savef:
+                savef.write(json.dumps(result) + '\n')
+                savef.flush()
+
+            if ticks is not None and tick >= ticks:
+                break
+            # fixed rate schedule, a slow probe does not shift later ticks,
+            # ticks it overran are skipped rather than fired in a burst
+            next_run += interval
+            now = time.monotonic()
+            if next_run < now:
+                next_run += math.ceil((now - next_run) / interval) * interval
+            time.sleep(next_run - now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if savef:
+            savef.close()
+
+    if slo and samples and not check_slo(slo, worst_timings(list(samples)))[0]:
+        return 4
+    return 0
+
+
+def run_load(url: str, rate: float, duration: float, concurrency: int, curl_bin: str,
+             curl_args: list[str], cmd_env: dict[str, str]) -> dict:
+    """Fire probes open-loop at `rate` per second for `duration` seconds.
+
+    Probe i is scheduled at start + i / rate no matter how long earlier
+    probes take, with up to `concurrency` curl processes in flight. When
+    all of them are busy a probe starts late; that schedule lag is added
+    to its total time (coordinated-omission correction), so a stalled
+    server shows up as latency instead of as fewer samples.
+
+    Returns {'samples': [...], 'lags': [...], 'errors': [...],
+    'headers_text': ..., 'elapsed': seconds}, lags in int ms.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    samples: list[dict] = []
+    lags: list[int] = []
+    errors: list[ProbeError] = []
+    last_headers = ['']
+    lock = threading.Lock()
+
+    def probe_at(intended: float):
+        lag = max(0, int((time.monotonic() - intended) * 1000))
+        try:
+            d, headers_text = probe_metrics(url, curl_bin, curl_args, cmd_env)
+        except ProbeError as e:
+            with lock:
+                errors.append(e)
+            return
+        with lock:
+            samples.append(d)
+            lags.append(lag)
+            last_headers[0] = headers_text
+
+    total = max(1, int(rate * duration))
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            intended = start + i / rate
+            time.sleep(max(0.0, intended - time.monotonic()))
+            pool.submit(probe_at, intended)
+    return {
+        'samples': samples,
+        'lags': lags,
+        'errors': errors,
+        'headers_text': last_headers[0],
+        'elapsed': time.monotonic() - start,
     }
 
-    if slo_result is not None:
-        result['slo'] = {
-            'pass': slo_result[0],
-            'violations': slo_result[1],
+
+def build_load_result(rate: float, duration: float, run: dict) -> dict:
+    """Build the `load` JSON block from a run_load result."""
+    samples, lags = run['samples'], run['lags']
+    sent = len(samples) + len(run['errors'])
+    result: dict = {
+        'rate': rate,
+        'duration_s': duration,
+        'sent': sent,
+        'errors': len(run['errors']),
+        'achieved_rate': round(sent / run['elapsed'], 1) if run['elapsed'] else 0.0,
+        'aggregate': None,
+        'schedule_lag_ms': None,
+        'total_corrected_ms': None,
+    }
+    if samples:
+        result['aggregate'] = aggregate_samples(samples)
+        result['schedule_lag_ms'] = summarize(lags)
+        result['total_corrected_ms'] = summarize([d['time_total'] + lag for d, lag in zip(samples, lags)])
+    return result
+
+
+def format_load(load: dict, show_tls: bool = True) -> str:
+    """Render a `load` block for pretty mode."""
+    lines = [
+        f"{green('Load')}: {load['sent']} probes at {load['rate']:g}/s over {load['duration_s']:g}s, "
+        f"achieved {load['achieved_rate']:g}/s, {load['errors']} errors",
+    ]
+    if load['aggregate']:
+        lines.append(format_aggregate(load['aggregate'], show_tls=show_tls))
+        for label, key in (('Schedule Lag', 'schedule_lag_ms'), ('Total (corrected)', 'total_corrected_ms')):
+            stats = load[key]
+            cells = ''.join(f'{_fmt_ms(stats[s]):>9}' for s in AGGREGATE_STATS)
+            lines.append(f'{label:<19}' + cyan(cells))
+    return '\n'.join(lines)
+
+
+def finish_result(url: str, d: dict, headers_text: str,
+                  slo: dict[str, int] | None) -> dict:
+    """Check SLO for converted metrics and build the JSON result."""
+    return finish_probe(url, d, headers_text, slo).to_dict()
+
+
+def probe_pool(urls: list[str], concurrency: int, curl_bin: str, curl_args: list[str],
+               cmd_env: dict[str, str], slo: dict[str, int] | None) -> Iterator[dict]:
+    """Probe urls with one curl process each, at most `concurrency` in
+    flight, yielding results in completion order.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(probe_url, url, curl_bin, curl_args, cmd_env, slo) for url in urls]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# `%{json}` (curl 7.70+) is used instead of curl_format in the parallel
+# engine, because it escapes errormsg properly for failed transfers
+# (errormsg and exitcode are curl 7.75+).
+# Each -w record is one line, keyed by the transfer's index in the batch.
+parallel_format = '{{"index": {index}, "metrics": %{{json}}}}\n'
+
+CURL_FORMAT_KEYS = tuple(line.split('"')[1] for line in curl_format.splitlines()[1:-1])
+
+
+def build_parallel_cmd(curl_bin: str, curl_args: list[str], urls: list[str],
+                       header_dir: str, concurrency: int) -> list[str]:
+    """Build a single curl --parallel command that fetches all urls,
+    each transfer dumping its headers to `<header_dir>/<index>`.
+    """
+    cmd = [curl_bin, '--parallel', '--parallel-max', str(concurrency)]
+    for i, url in enumerate(urls):
+        if i:
+            cmd.append('--next')
+        cmd += [
+            '-w', parallel_format.format(index=i),
+            '-D', os.path.join(header_dir, str(i)),
+            '-o', os.devnull, '-s', '-S',
+        ]
+        cmd += curl_args + [url]
+    return cmd
+
+
+def parallel_record_error(metrics: dict) -> tuple[int, str] | None:
+    """(exit code, error) of a failed transfer's `%{json}` record, None
+    if it succeeded. exitcode and errormsg are curl 7.75+, older curl only
+    tells a failure by the missing response, reported as exit code 1.
+    """
+    code = metrics.get('exitcode')
+    if code is None:
+        if metrics.get('response_code'):
+            return None
+        return 1, 'curl error: transfer failed, curl older than 7.75 reports no exit code'
+    if code:
+        return code, f"curl error: curl: ({code}) {metrics.get('errormsg')}"
+    return None
+
+
+def parallel_record_metrics(metrics: dict) -> dict:
+    """Pick the curl_format keys out of a `%{json}` record, with the same
+    value types as curl_format produces.
+    """
+    d = {k: metrics.get(k) for k in CURL_FORMAT_KEYS}
+    for k in ('remote_port', 'local_port'):
+        d[k] = str(d[k])
+    return d
+
+
+def probe_parallel(urls: list[str], concurrency: int, curl_bin: str, curl_args: list[str],
+                   cmd_env: dict[str, str], slo: dict[str, int] | None) -> Iterator[dict]:
+    """Probe all urls with a single curl --parallel process, yielding
+    results as curl reports each finished transfer.
+    """
+    import shutil
+    import tempfile
+
+    header_dir = tempfile.mkdtemp(prefix='httpstat-')
+    try:
+        cmd = build_parallel_cmd(curl_bin, curl_args, urls, header_dir, concurrency)
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=cmd_env)
+        assert p.stdout is not None
+        seen = set()
+        for line in p.stdout:
+            try:
+                record = json.loads(line)
+                index = record['index']
+                metrics = record['metrics']
+            except (ValueError, KeyError, TypeError):
+                continue
+            seen.add(index)
+            url = urls[index]
+            error = parallel_record_error(metrics)
+            if error:
+                yield build_error_result(url, *error)
+                continue
+            d = convert_metrics(parallel_record_metrics(metrics))
+            try:
+                with open(os.path.join(header_dir, str(index)), 'r') as f:
+                    headers_text = f.read().strip()
+            except OSError:
+                headers_text = ''
+            yield finish_result(url, d, headers_text, slo)
+        returncode = p.wait()
+        # transfers curl never reported, e.g. curl too old for --parallel
+        for index, url in enumerate(urls):
+            if index not in seen:
+                yield build_error_result(url, returncode or 1, 'curl error: no result for transfer')
+    finally:
+        shutil.rmtree(header_dir, ignore_errors=True)
+
+
+BATCH_ENGINES = {
+    'pool': probe_pool,
+    'parallel': probe_parallel,
+}
+
+
+COLUMNAR_MAGIC = b'HTTPSTAT-COLUMNAR\x01'
+# timings_ms keys, -1 where a result has none (failed probes, old curl)
+COLUMNAR_TIMINGS = ('dns', 'connect', 'tls', 'server', 'transfer', 'total', 'namelookup',
+                    'initial_connect', 'pretransfer', 'starttransfer', 'queue', 'posttransfer')
+# speed keys, NaN for failed probes
+COLUMNAR_SPEEDS = ('download_kbs', 'upload_kbs')
+# stored as codes into a per-file dictionary of distinct values
+COLUMNAR_DICTS = ('url', 'remote_ip', 'status_code', 'error')
+SAVE_FORMATS = ('jsonl', 'columnar')
+
+
+class ColumnarWriter:
+    """Collect batch results into typed arrays, one per column, and write
+    them as a columnar file: the magic, a length-prefixed JSON header with
+    the column layout and dictionaries, then the raw bytes of each column.
+    Headers and nested keys of the JSON records are not kept.
+    """
+
+    def __init__(self):
+        from array import array
+
+        self.rows = 0
+        self.columns = {'exit_code': array('i')}
+        self.columns.update((name, array('i')) for name in COLUMNAR_TIMINGS)
+        self.columns.update((name, array('d')) for name in COLUMNAR_SPEEDS)
+        self.columns.update((name, array('I')) for name in COLUMNAR_DICTS)
+        self.dictionaries: dict[str, dict] = {name: {} for name in COLUMNAR_DICTS}
+
+    def _code(self, name: str, value) -> int:
+        codes = self.dictionaries[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def append(self, result: dict):
+        columns = self.columns
+        columns['exit_code'].append(result['exit_code'])
+        timings = result.get('timings_ms') or {}
+        for name in COLUMNAR_TIMINGS:
+            v = timings.get(name)
+            columns[name].append(-1 if v is None else int(v))
+        speed = result.get('speed') or {}
+        for name in COLUMNAR_SPEEDS:
+            columns[name].append(speed.get(name, float('nan')))
+        response = result.get('response') or {}
+        columns['url'].append(self._code('url', result['url']))
+        columns['remote_ip'].append(self._code('remote_ip', response.get('remote_ip', '')))
+        columns['status_code'].append(self._code('status_code', response.get('status_code', 0)))
+        columns['error'].append(self._code('error', result.get('error', '')))
+        self.rows += 1
+
+    def write(self, f):
+        header = json.dumps({
+            'rows': self.rows,
+            'byteorder': sys.byteorder,
+            'columns': [[name, a.typecode, a.itemsize] for name, a in self.columns.items()],
+            'dictionaries': {name: list(codes) for name, codes in self.dictionaries.items()},
+        }).encode()
+        f.write(COLUMNAR_MAGIC)
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        for a in self.columns.values():
+            a.tofile(f)
+
+
+def read_columnar(path: str) -> dict:
+    """Load a file written with --save-format columnar.
+    Returns {'rows': n, 'columns': {name: array}, 'dictionaries': {name: [...]}}.
+    Dictionary-encoded columns hold codes, dictionaries[name][code] is the
+    value. Raises ValueError if path is not a columnar file.
+    """
+    from array import array
+
+    with open(path, 'rb') as f:
+        if f.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+            raise ValueError(f'{path} is not an httpstat columnar file')
+        header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+        rows = header['rows']
+        columns = {}
+        for name, typecode, itemsize in header['columns']:
+            a = array(typecode)
+            if a.itemsize != itemsize:
+                raise ValueError(f'column {name} has {itemsize}-byte items, this platform uses {a.itemsize}')
+            a.fromfile(f, rows)
+            if header['byteorder'] != sys.byteorder:
+                a.byteswap()
+            columns[name] = a
+    return {'rows': rows, 'columns': columns, 'dictionaries': header['dictionaries']}
+
+
+def run_batch(results: Iterable[dict], save_path: str | None = None,
+              save_format: str = 'jsonl') -> int:
+    """Print one jsonl record per result as it arrives, optionally saving
+    them to save_path as well, as jsonl or, written once all results are
+    in, as a columnar file. Returns the highest exit code among results.
+    """
+    exit_code = 0
+    columnar = ColumnarWriter() if save_path and save_format == 'columnar' else None
+    savef = open(save_path, 'w') if save_path and not columnar else None
+    try:
+        for result in results:
+            line = json.dumps(result)
+            print(line, flush=True)
+            if savef:
+                savef.write(line + '\n')
+                savef.flush()
+            if columnar:
+                columnar.append(result)
+            exit_code = max(exit_code, result['exit_code'])
+    finally:
+        if savef:
+            savef.close()
+        # also keeps what was probed before an interrupt
+        if columnar:
+            with open(save_path, 'wb') as f:
+                columnar.write(f)
+    return exit_code
+
+
+def parse_inprocess_args(curl_args: list[str]) -> dict:
+    """Parse the subset of curl options the in-process backends understand:
+    -k/--insecure, -H/--header, -X/--request and -m/--max-time.
+    Raises ValueError on anything else.
+    """
+    opts: dict = {'insecure': False, 'headers': [], 'method': None, 'timeout': None}
+    args = list(curl_args)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-k', '--insecure'):
+            opts['insecure'] = True
+            continue
+        if arg not in ('-H', '--header', '-X', '--request', '-m', '--max-time'):
+            raise ValueError(f'{arg} is not supported by in-process backends')
+        if not args:
+            raise ValueError(f'{arg} needs a value')
+        value = args.pop(0)
+        if arg in ('-H', '--header'):
+            opts['headers'].append(value)
+        elif arg in ('-X', '--request'):
+            opts['method'] = value
+        else:
+            try:
+                opts['timeout'] = float(value)
+            except ValueError:
+                raise ValueError(f'{arg} must be a number of seconds, got "{value}"')
+    return opts
+
+
+# CURLINFO_HTTP_VERSION values, spelled like curl's %{http_version}
+PYCURL_HTTP_VERSIONS = {1: '1', 2: '1.1', 3: '2', 30: '3'}
+
+
+def _pycurl_info(c, name: str):
+    """getinfo for constants only newer pycurl/libcurl have, else None."""
+    import pycurl
+
+    option = getattr(pycurl, name, None)
+    if option is None:
+        return None
+    try:
+        return c.getinfo(option)
+    except (pycurl.error, ValueError):
+        return None
+
+
+def _pycurl_info_t(c, name: str):
+    """getinfo for the curl_off_t `<name>_T` variant, falling back to the
+    deprecated double one where pycurl/libcurl lack it.
+    """
+    import pycurl
+
+    value = _pycurl_info(c, f'{name}_T')
+    if value is None:
+        value = c.getinfo(getattr(pycurl, name))
+    return value
+
+
+def fetch_pycurl(url: str, opts: dict, header_path: str, body_path: str) -> dict:
+    """Probe url with libcurl in-process through pycurl, opts['phase']
+    `connect` stops after the handshake, `ttfb` at the first body byte.
+    Returns the same keys as curl_format, time values in float seconds.
+    """
+    import pycurl
+
+    phase = opts.get('phase', 'full')
+    header_chunks: list[bytes] = []
+    c = pycurl.Curl()
+    try:
+        with open(body_path, 'wb') as bodyf:
+            c.setopt(pycurl.URL, url)
+            c.setopt(pycurl.WRITEDATA, bodyf)
+            c.setopt(pycurl.HEADERFUNCTION, header_chunks.append)
+            if opts['insecure']:
+                c.setopt(pycurl.SSL_VERIFYPEER, 0)
+                c.setopt(pycurl.SSL_VERIFYHOST, 0)
+            if opts['headers']:
+                c.setopt(pycurl.HTTPHEADER, opts['headers'])
+            if opts['method']:
+                c.setopt(pycurl.CUSTOMREQUEST, opts['method'])
+            if opts['timeout']:
+                c.setopt(pycurl.TIMEOUT_MS, int(opts['timeout'] * 1000))
+            if phase == 'connect':
+                c.setopt(pycurl.CONNECT_ONLY, 1)
+            elif phase == 'ttfb':
+                # taking no bytes aborts the transfer with CURLE_WRITE_ERROR
+                c.setopt(pycurl.WRITEFUNCTION, lambda data: 0)
+            try:
+                c.perform()
+            except pycurl.error as e:
+                code, message = e.args
+                if not (phase == 'ttfb' and code == CURLE_WRITE_ERROR):
+                    raise ProbeError(code, message)
+        d = {
+            'time_namelookup': c.getinfo(pycurl.NAMELOOKUP_TIME),
+            'time_connect': c.getinfo(pycurl.CONNECT_TIME),
+            'time_appconnect': c.getinfo(pycurl.APPCONNECT_TIME),
+            'time_pretransfer': c.getinfo(pycurl.PRETRANSFER_TIME),
+            'time_redirect': c.getinfo(pycurl.REDIRECT_TIME),
+            'time_starttransfer': c.getinfo(pycurl.STARTTRANSFER_TIME),
+            'time_total': c.getinfo(pycurl.TOTAL_TIME),
+            # microseconds like curl's write-out, None if libcurl lacks them
+            'time_queue': _pycurl_info(c, 'QUEUE_TIME_T'),
+            'time_posttransfer': _pycurl_info(c, 'POSTTRANSFER_TIME_T'),
+            'speed_download': _pycurl_info_t(c, 'SPEED_DOWNLOAD'),
+            'speed_upload': _pycurl_info_t(c, 'SPEED_UPLOAD'),
+            'size_download': int(_pycurl_info_t(c, 'SIZE_DOWNLOAD')),
+            'size_header': c.getinfo(pycurl.HEADER_SIZE),
+            'size_request': c.getinfo(pycurl.REQUEST_SIZE),
+            'num_connects': c.getinfo(pycurl.NUM_CONNECTS),
+            'num_redirects': c.getinfo(pycurl.REDIRECT_COUNT),
+            'http_version': PYCURL_HTTP_VERSIONS.get(_pycurl_info(c, 'INFO_HTTP_VERSION'), ''),
+            'ssl_verify_result': c.getinfo(pycurl.SSL_VERIFYRESULT),
+            'remote_ip': c.getinfo(pycurl.PRIMARY_IP),
+            'remote_port': str(c.getinfo(pycurl.PRIMARY_PORT)),
+            'local_ip': c.getinfo(pycurl.LOCAL_IP),
+            'local_port': str(c.getinfo(pycurl.LOCAL_PORT)),
         }
+    finally:
+        c.close()
+
+    with open(header_path, 'wb') as f:
+        f.write(b''.join(header_chunks))
+    return d
+
+
+class _PrefixedSocket:
+    """Socket stand-in for http.client.HTTPResponse that replays bytes
+    already received before reading on from the real socket.
+    """
+
+    class _Reader(io.RawIOBase):
+        def __init__(self, sock, prefix: bytes):
+            self._sock = sock
+            self._prefix = prefix
+
+        def readable(self) -> bool:
+            return True
+
+        def readinto(self, b) -> int:
+            if self._prefix:
+                n = min(len(b), len(self._prefix))
+                b[:n] = self._prefix[:n]
+                self._prefix = self._prefix[n:]
+                return n
+            return self._sock.recv_into(b)
+
+    def __init__(self, sock, prefix: bytes):
+        self._sock = sock
+        self._prefix = prefix
+
+    def makefile(self, mode: str):
+        return io.BufferedReader(self._Reader(self._sock, self._prefix))
+
+
+def fetch_socket(url: str, opts: dict, header_path: str, body_path: str) -> dict:
+    """Probe url with plain sockets, taking the phase timestamps itself.
+    Speaks HTTP/1.1 only and does not follow redirects. opts['phase']
+    `connect` stops after the handshake, `ttfb` after the headers.
+    Returns the same keys as curl_format, time values in float seconds.
+    """
+    import http.client
+    import socket
+    import ssl
+    from urllib.parse import urlsplit
+
+    if '://' not in url:
+        url = 'http://' + url
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+        raise ProbeError(1, f'Protocol "{parts.scheme}" not supported')
+    is_https = parts.scheme == 'https'
+    host = parts.hostname or ''
+    port = parts.port or (443 if is_https else 80)
+    path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+    method = opts['method'] or 'GET'
+    timeout = opts['timeout']
+    phase = opts.get('phase', 'full')
+
+    # loading CA certificates is slow, keep it out of the measured phases
+    ctx = None
+    if is_https:
+        ctx = ssl.create_default_context()
+        if opts['insecure']:
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        ctx.set_alpn_protocols(['http/1.1'])
+
+    start = time.perf_counter()
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise ProbeError(6, f'Could not resolve host: {host}')
+    time_namelookup = time.perf_counter() - start
+
+    sock = None
+    last_error: OSError | None = None
+    for family, type_, proto, _, addr in infos:
+        try:
+            sock = socket.socket(family, type_, proto)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(timeout)
+            sock.connect(addr)
+            break
+        except OSError as e:
+            last_error = e
+            if sock is not None:
+                sock.close()
+            sock = None
+    if sock is None:
+        raise ProbeError(7, f'Failed to connect to {host} port {port}: {last_error}')
+    time_connect = time.perf_counter() - start
 
+    try:
+        time_appconnect = 0.0
+        if ctx is not None:
+            try:
+                sock = ctx.wrap_socket(sock, server_hostname=host)
+            except ssl.SSLCertVerificationError as e:
+                raise ProbeError(60, f'SSL certificate problem: {e.verify_message}')
+            except ssl.SSLError as e:
+                raise ProbeError(35, f'SSL connect error: {e}')
+            time_appconnect = time.perf_counter() - start
+        remote_ip, remote_port = sock.getpeername()[:2]
+        local_ip, local_port = sock.getsockname()[:2]
+
+        resp = None
+        size = size_request = 0
+        if phase == 'connect':
+            # nothing is sent, the remaining times end with the handshake
+            time_pretransfer = time_posttransfer = time_starttransfer = time.perf_counter() - start
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+            conn.sock = sock
+
+            def send(data: bytes):
+                nonlocal size_request
+                size_request += len(data)
+                sock.sendall(data)
+            conn.send = send
+            defaults = {
+                'Host': parts.netloc.rpartition('@')[2],
+                'User-Agent': f'httpstat/{__version__}',
+                'Accept': '*/*',
+            }
+            extra = []
+            for h in opts['headers']:
+                name, _, value = h.partition(':')
+                extra.append((name.strip(), value.strip()))
+            overridden = {name.lower() for name, _ in extra}
+
+            time_pretransfer = time.perf_counter() - start
+            conn.putrequest(method, path, skip_host=True, skip_accept_encoding=True)
+            for name, value in defaults.items():
+                if name.lower() not in overridden:
+                    conn.putheader(name, value)
+            for name, value in extra:
+                if value:
+                    conn.putheader(name, value)
+            conn.endheaders()
+            time_posttransfer = time.perf_counter() - start
+
+            # block on the first byte of the response, with TLS 1.3 the socket
+            # already turns readable when the server sends its session tickets
+            first = sock.recv(1)
+            time_starttransfer = time.perf_counter() - start
+            if not first:
+                raise ProbeError(52, 'Empty reply from server')
+
+            resp = http.client.HTTPResponse(_PrefixedSocket(sock, first), method=method)
+            resp.begin()
+            if phase != 'ttfb':
+                with open(body_path, 'wb') as f:
+                    while True:
+                        chunk = resp.read(65536)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        size += len(chunk)
+        time_total = time.perf_counter() - start
+    except socket.timeout:
+        raise ProbeError(28, 'Operation timed out')
+    except (http.client.HTTPException, OSError) as e:
+        raise ProbeError(56, f'Failure when receiving data from the peer: {e}')
+    finally:
+        sock.close()
+
+    header_bytes = b''
+    if resp is not None:
+        version = {10: 'HTTP/1.0', 11: 'HTTP/1.1'}.get(resp.version, 'HTTP/1.1')
+        lines = [f'{version} {resp.status} {resp.reason}']
+        lines += [f'{k}: {v}' for k, v in resp.getheaders()]
+        header_bytes = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1', errors='replace')
+    with open(header_path, 'wb') as f:
+        f.write(header_bytes)
+
+    return {
+        'time_namelookup': time_namelookup,
+        'time_connect': time_connect,
+        'time_appconnect': time_appconnect,
+        'time_pretransfer': time_pretransfer,
+        'time_redirect': 0.0,
+        'time_starttransfer': time_starttransfer,
+        'time_total': time_total,
+        'time_queue': 0.0,
+        'time_posttransfer': time_posttransfer,
+        'speed_download': size / time_total if time_total else 0.0,
+        'speed_upload': 0.0,
+        'size_download': size,
+        'size_header': len(header_bytes),
+        'size_request': size_request,
+        'num_connects': 1,
+        'num_redirects': 0,
+        # curl's spelling, 1.0 is reported as "1"
+        'http_version': '' if resp is None else '1' if resp.version == 10 else '1.1',
+        # a failed verification raises above, with -k nothing was checked
+        'ssl_verify_result': None if is_https and opts['insecure'] else 0,
+        'remote_ip': remote_ip,
+        'remote_port': str(remote_port),
+        'local_ip': local_ip,
+        'local_port': str(local_port),
+    }
+
+
+def _pycurl_available() -> bool:
+    try:
+        import pycurl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# in-process alternatives to running the curl binary, `curl` is the default
+INPROCESS_BACKENDS = {
+    'pycurl': fetch_pycurl,
+    'socket': fetch_socket,
+}
+
+BACKEND_NAMES = ('curl', 'inprocess') + tuple(INPROCESS_BACKENDS)
+
+
+def resolve_backend(name: str) -> str:
+    """Resolve `inprocess` to pycurl if it is installed, otherwise socket."""
+    if name == 'inprocess':
+        return 'pycurl' if _pycurl_available() else 'socket'
+    return name
+
+
+# histogram buckets in seconds, same as the Prometheus client defaults
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# phases exported by `httpstat serve`, keys of the timings_ms JSON block
+EXPORTED_PHASES = ('dns', 'connect', 'tls', 'server', 'transfer', 'total')
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """Pre-aggregated probe metrics for `httpstat serve`, rendered in the
+    Prometheus text exposition format. Only bucket counts are kept, never
+    raw samples. Safe to update from the probe thread while serving.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (target, phase) -> [bucket counts..., +Inf count], sum in seconds
+        self._hist: dict[tuple[str, str], list[int]] = {}
+        self._hist_sum: dict[tuple[str, str], float] = {}
+        self._probes: dict[str, int] = {}
+        self._errors: dict[str, int] = {}
+        self._success: dict[str, int] = {}
+        self._slo_violations: dict[tuple[str, str], int] = {}
+
+    def observe(self, result: dict):
+        """Record one JSON result from probe_url."""
+        target = result['url']
+        with self._lock:
+            self._probes[target] = self._probes.get(target, 0) + 1
+            if 'timings_ms' not in result:
+                self._errors[target] = self._errors.get(target, 0) + 1
+                self._success[target] = 0
+                return
+            self._success[target] = 1
+            for phase in EXPORTED_PHASES:
+                seconds = result['timings_ms'][phase] / 1000
+                key = (target, phase)
+                counts = self._hist.setdefault(key, [0] * (len(self.buckets) + 1))
+                for i, le in enumerate(self.buckets):
+                    if seconds <= le:
+                        counts[i] += 1
+                counts[-1] += 1
+                self._hist_sum[key] = self._hist_sum.get(key, 0.0) + seconds
+            for v in (result.get('slo') or {}).get('violations', []):
+                key = (target, v['key'])
+                self._slo_violations[key] = self._slo_violations.get(key, 0) + 1
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [
+                '# HELP httpstat_phase_duration_seconds Duration of each HTTP request phase.',
+                '# TYPE httpstat_phase_duration_seconds histogram',
+            ]
+            for (target, phase), counts in sorted(self._hist.items()):
+                labels = f'target="{_escape_label(target)}",phase="{phase}"'
+                for le, count in zip(self.buckets, counts):
+                    lines.append(f'httpstat_phase_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f'httpstat_phase_duration_seconds_bucket{{{labels},le="+Inf"}} {counts[-1]}')
+                lines.append(f'httpstat_phase_duration_seconds_sum{{{labels}}} {self._hist_sum[(target, phase)]:.6f}')
+                lines.append(f'httpstat_phase_duration_seconds_count{{{labels}}} {counts[-1]}')
+
+            for name, help_, kind, values in (
+                ('httpstat_probes_total', 'Number of probes run.', 'counter', self._probes),
+                ('httpstat_probe_errors_total', 'Number of probes that got no response.', 'counter', self._errors),
+                ('httpstat_probe_success', 'Whether the last probe got a response.', 'gauge', self._success),
+            ):
+                lines.append(f'# HELP {name} {help_}')
+                lines.append(f'# TYPE {name} {kind}')
+                for target, value in sorted(values.items()):
+                    lines.append(f'{name}{{target="{_escape_label(target)}"}} {value}')
+
+            lines.append('# HELP httpstat_slo_violations_total Number of probes violating an SLO threshold.')
+            lines.append('# TYPE httpstat_slo_violations_total counter')
+            for (target, key), value in sorted(self._slo_violations.items()):
+                lines.append(f'httpstat_slo_violations_total{{target="{_escape_label(target)}",key="{key}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def run_probe_loop(registry: MetricsRegistry, urls: list[str], interval: float,
+                   concurrency: int, curl_bin: str, curl_args: list[str],
+                   cmd_env: dict[str, str], slo: dict[str, int] | None,
+                   stop: threading.Event):
+    """Probe all urls every `interval` seconds until stop is set.
+    Unexpected failures are recorded as probe errors for the targets that
+    got no result, the loop itself keeps going.
+    """
+    next_run = time.monotonic()
+    while not stop.is_set():
+        pending = set(urls)
+        try:
+            for result in probe_pool(urls, concurrency, curl_bin, curl_args, cmd_env, slo):
+                registry.observe(result)
+                pending.discard(result['url'])
+        except Exception as e:
+            for url in pending:
+                registry.observe(build_error_result(url, 1, f'{type(e).__name__}: {e}'))
+        next_run += interval
+        stop.wait(max(0.0, next_run - time.monotonic()))
+
+
+def parse_listen(spec: str) -> tuple[str, int]:
+    """Parse 'host:port' or ':port', exits with error on invalid input."""
+    host, _, port = spec.rpartition(':')
+    try:
+        port_num = int(port)
+    except ValueError:
+        print(f'Error: --listen must be HOST:PORT, got "{spec}"')
+        sys.exit(1)
+    return host.strip('[]') or '127.0.0.1', port_num
+
+
+def serve_main(args: list[str]) -> int:
+    """`httpstat serve`: probe targets on a schedule and expose /metrics."""
+    import shutil
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    urls_file = pop_arg(args, '--urls-file')
+    listen = parse_listen(pop_arg(args, '--listen') or '127.0.0.1:9345')
+    interval_spec = pop_arg(args, '--interval')
+    interval = parse_duration(interval_spec, '--interval') if interval_spec else 15.0
+    concurrency_spec = pop_arg(args, '--concurrency')
+    concurrency = parse_positive_int(concurrency_spec, '--concurrency') if concurrency_spec else 10
+    slo_spec = pop_arg(args, '--slo')
+    slo = parse_slo(slo_spec) if slo_spec else None
+    curl_bin = ENV_CURL_BIN.get('curl')
+
+    # urls before `--`, curl options after it
+    if '--' in args:
+        idx = args.index('--')
+        urls, curl_args = args[:idx], args[idx + 1:]
+    else:
+        urls, curl_args = args, []
+    check_curl_args(curl_args)
+    if urls_file:
+        try:
+            urls += read_urls(urls_file)
+        except OSError as e:
+            _exit(yellow(f'Error: could not read urls file: {e}'), 1)
+    if not urls:
+        _exit('Error: serve needs at least one target url', 1)
+    if shutil.which(curl_bin) is None:
+        _exit(yellow(f'Error: curl binary "{curl_bin}" not found'), 1)
+
+    registry = MetricsRegistry()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer(listen, Handler)
+    except OSError as e:
+        _exit(yellow(f'Error: could not listen on {listen[0]}:{listen[1]}: {e}'), 1)
+
+    stop = threading.Event()
+    prober = threading.Thread(
+        target=run_probe_loop,
+        args=(registry, urls, interval, concurrency, curl_bin, curl_args, make_cmd_env(), slo, stop),
+        daemon=True,
+    )
+    prober.start()
+    print(f"{green('Serving')} metrics for {len(urls)} targets on http://{listen[0]}:{listen[1]}/metrics, "
+          f'probing every {interval:g}s', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    return 0
+
+
+# a phase regresses when its p50 is this much above the baseline p50, and
+# by at least REGRESSION_MIN_MS so that 1ms -> 2ms on a fast phase is not +100%
+REGRESSION_THRESHOLD = 0.2
+REGRESSION_MIN_MS = 2
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    ts REAL NOT NULL,
+    exit_code INTEGER NOT NULL,
+    dns INTEGER NOT NULL,
+    connect INTEGER NOT NULL,
+    tls INTEGER NOT NULL,
+    server INTEGER NOT NULL,
+    transfer INTEGER NOT NULL,
+    total INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_url_ts ON probes (url, ts);
+"""
+
+
+def default_history_path() -> str:
+    """HTTPSTAT_HISTORY_DB, or history.db in the XDG data directory."""
+    path = ENV_HISTORY_DB.get()
+    if path:
+        return path
+    data_home = os.environ.get('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share')
+    return os.path.join(data_home, 'httpstat', 'history.db')
+
+
+def open_history(path: str):
+    """Open (and create) the SQLite history store, an append-only table of
+    per-probe phase timings indexed by (url, ts).
+    """
+    import sqlite3
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    # readers do not block the writer, e.g. a cron job recording while
+    # someone queries a baseline
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(HISTORY_SCHEMA)
+    return conn
+
+
+def record_history(conn, url: str, samples: list[dict], exit_code: int, ts: float):
+    """Append converted metrics of one run to the history store."""
+    columns = [name for name, _, _ in AGGREGATE_FIELDS]
+    rows = [(url, ts, exit_code, *(d[key] for _, key, _ in AGGREGATE_FIELDS)) for d in samples]
+    with conn:
+        conn.executemany(
+            f'INSERT INTO probes (url, ts, exit_code, {", ".join(columns)}) '
+            f'VALUES (?, ?, ?, {", ".join("?" * len(columns))})', rows)
+
+
+def load_history(conn, url: str, since: float) -> list[dict]:
+    """Return the phase timings stored for url since the `since` timestamp,
+    keyed like the metrics dicts, so that percentile code can be shared.
+    """
+    columns = [name for name, _, _ in AGGREGATE_FIELDS]
+    cursor = conn.execute(
+        f'SELECT {", ".join(columns)} FROM probes WHERE url = ? AND ts >= ?', (url, since))
+    keys = [key for _, key, _ in AGGREGATE_FIELDS]
+    return [dict(zip(keys, row)) for row in cursor]
+
+
+def build_baseline_result(history: list[dict], samples: list[dict], window: str) -> dict:
+    """Build the `baseline` JSON block: per phase the p50 over the history
+    window against the p50 of this run, and which phases regressed.
+    """
+    result: dict = {'window': window, 'count': len(history), 'phases': {}, 'regressions': []}
+    if not history:
+        return result
+    for name, key, _ in AGGREGATE_FIELDS:
+        baseline = percentile([h[key] for h in history], 50)
+        current = percentile([d[key] for d in samples], 50)
+        change_pct = round((current - baseline) / baseline * 100, 1) if baseline else None
+        regression = (current - baseline >= REGRESSION_MIN_MS
+                      and current > baseline * (1 + REGRESSION_THRESHOLD))
+        result['phases'][name] = {
+            'baseline_p50': round(baseline, 1),
+            'current_p50': round(current, 1),
+            'change_pct': change_pct,
+            'regression': regression,
+        }
+        if regression:
+            result['regressions'].append(name)
     return result
 
 
+def format_baseline(url: str, baseline: dict) -> list[str]:
+    """Lines for pretty mode, one per regressed phase."""
+    if not baseline['count']:
+        return [yellow(f"No history for {url} in the last {baseline['window']}, nothing to compare")]
+    labels = {name: label for name, _, label in AGGREGATE_FIELDS}
+    lines = []
+    for name in baseline['regressions']:
+        phase = baseline['phases'][name]
+        change = f"{phase['change_pct']:.0f}%" if phase['change_pct'] is not None else 'from 0ms'
+        lines.append(red(f"REGRESSION: {labels[name].lower()} p50 up {change} vs last {baseline['window']} "
+                         f"({_fmt_ms(phase['baseline_p50'])} -> {_fmt_ms(phase['current_p50'])}, "
+                         f"{baseline['count']} stored probes)"))
+    if not lines:
+        lines.append(green(f"No regression vs last {baseline['window']} ({baseline['count']} stored probes)"))
+    return lines
+
+
+def rank(values: list) -> list[float]:
+    """Return the 1-based rank of each value, ties get their average rank."""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+
+def mann_whitney_u(a: list, b: list) -> tuple[float, float]:
+    """Two-sided Mann-Whitney U test of a against b, using the normal
+    approximation with tie and continuity correction.
+    Returns (U of a, p-value).
+    """
+    import math
+
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    ranks = rank(list(a) + list(b))
+    u = sum(ranks[:n1]) - n1 * (n1 + 1) / 2
+    ties: dict[float, int] = {}
+    for r in ranks:
+        ties[r] = ties.get(r, 0) + 1
+    tie_term = sum(t ** 3 - t for t in ties.values()) / (n * (n - 1))
+    sigma = math.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        # every sample is the same value
+        return u, 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / sigma
+    return u, min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+
+def bootstrap_median_diff_ci(a: list, b: list, resamples: int = 2000,
+                             confidence: float = 95, seed: int = 0) -> tuple[float, float]:
+    """Percentile bootstrap confidence interval for median(b) - median(a),
+    resampling both sides independently. Seeded, so reruns on the same
+    samples give the same interval.
+    """
+    import random
+
+    rng = random.Random(seed)
+    diffs = sorted(
+        percentile(rng.choices(b, k=len(b)), 50) - percentile(rng.choices(a, k=len(a)), 50)
+        for _ in range(resamples))
+    tail = (100 - confidence) / 2
+    return percentile(diffs, tail), percentile(diffs, 100 - tail)
+
+
+def compare_samples(samples_a: list[dict], samples_b: list[dict]) -> dict:
+    """Build the `phases` of the `comparison` JSON block: per phase the
+    median of both sides, their difference (B - A) with a 95% bootstrap
+    confidence interval, and the Mann-Whitney U p-value.
+    """
+    phases = {}
+    for name, key, _ in AGGREGATE_FIELDS:
+        a = [s[key] for s in samples_a]
+        b = [s[key] for s in samples_b]
+        lo, hi = bootstrap_median_diff_ci(a, b)
+        _, p_value = mann_whitney_u(a, b)
+        phases[name] = {
+            'median_a': round(percentile(a, 50), 1),
+            'median_b': round(percentile(b, 50), 1),
+            'diff': round(percentile(b, 50) - percentile(a, 50), 1),
+            'ci95': [round(lo, 1), round(hi, 1)],
+            'p_value': round(p_value, 4),
+            'significant': p_value < 0.05,
+        }
+    return phases
+
+
+def run_compare(side_a: tuple[str, list[str]], side_b: tuple[str, list[str]], count: int,
+                curl_bin: str, cmd_env: dict[str, str]) -> list[dict]:
+    """Probe both sides `count` times each, interleaved in ABBA order so
+    that drift during the run affects both alike.
+    Returns per side {'samples': [...], 'headers_text': ..., 'errors': [...]}.
+    """
+    runs = [{'samples': [], 'headers_text': '', 'errors': []} for _ in range(2)]
+    sides = (side_a, side_b)
+    for i in range(count):
+        for which in ((0, 1) if i % 2 == 0 else (1, 0)):
+            url, curl_args = sides[which]
+            run = runs[which]
+            try:
+                d, run['headers_text'] = probe_metrics(url, curl_bin, curl_args, cmd_env)
+            except ProbeError as e:
+                run['errors'].append(e)
+                continue
+            run['samples'].append(d)
+    return runs
+
+
+def format_compare(phases: dict, show_tls: bool) -> str:
+    """Render the comparison as a table, significant differences colored
+    red when B is slower and green when it is faster.
+    """
+    lines = [grayscale[16](f'{"":<19}{"A p50":>9}{"B p50":>9}{"B - A":>10}{"95% CI":>20}{"p-value":>10}')]
+    for name, _, label in AGGREGATE_FIELDS:
+        if name == 'tls' and not show_tls:
+            continue
+        phase = phases[name]
+        lo, hi = phase['ci95']
+        diff = f"{phase['diff']:+.1f}ms"
+        if phase['significant']:
+            diff = (red if phase['diff'] > 0 else green)(f'{diff:>10}')
+        else:
+            diff = cyan(f'{diff:>10}')
+        lines.append(f'{label:<19}' + cyan(f"{_fmt_ms(phase['median_a']):>9}{_fmt_ms(phase['median_b']):>9}")
+                     + diff + cyan(f'{f"[{lo:+.1f}, {hi:+.1f}]ms":>20}{phase["p_value"]:>10.4f}'))
+    return '\n'.join(lines)
+
+
+def compare_main(args: list[str]) -> int:
+    """`httpstat compare`: interleaved A/B probes with significance tests."""
+    import shlex
+
+    # urls and flags before `--`, curl options for both sides after it
+    if '--' in args:
+        idx = args.index('--')
+        args, curl_args = args[:idx], args[idx + 1:]
+    else:
+        curl_args = []
+    output_format = pop_arg(args, '--format') or pop_arg(args, '-f') or 'pretty'
+    count_spec = pop_arg(args, '--count')
+    count = parse_count(count_spec) if count_spec else 20
+    if count < 2:
+        # the Mann-Whitney test and the bootstrap need two samples per side
+        _exit('Error: compare needs --count of at least 2', 1)
+    args_a = shlex.split(pop_arg(args, '--a-args') or '')
+    args_b = shlex.split(pop_arg(args, '--b-args') or '')
+    if output_format not in ('pretty', 'json', 'jsonl'):
+        _exit(f'Error: invalid format "{output_format}", must be pretty, json, or jsonl', 1)
+    if len(args) == 1:
+        args = args * 2
+        if args_a == args_b:
+            _exit('Error: compare needs two urls, or one url with different --a-args and --b-args', 1)
+    if len(args) != 2:
+        _exit('Error: compare needs two urls, or one url with --a-args and --b-args', 1)
+
+    side_a = (args[0], curl_args + args_a)
+    side_b = (args[1], curl_args + args_b)
+    check_curl_args(side_a[1] + side_b[1])
+    curl_bin = ENV_CURL_BIN.get('curl')
+    runs = run_compare(side_a, side_b, count, curl_bin, make_cmd_env())
+    for label, run in zip('AB', runs):
+        if len(run['samples']) < 2:
+            if not run['errors']:
+                _exit(yellow(f'Too few successful probes for {label}'), 1)
+            e = run['errors'][-1]
+            _exit(yellow(f'Too few successful probes for {label}, last error: {e}'), e.exit_code)
+
+    phases = compare_samples(runs[0]['samples'], runs[1]['samples'])
+    if output_format in ('json', 'jsonl'):
+        sides = {}
+        for key, (url, side_args), run in zip(('a', 'b'), (side_a, side_b), runs):
+            # each side is a regular result for its last probe, plus statistics
+            result = build_json_result(url, run['samples'][-1], run['headers_text'], None, 0,
+                                       aggregate_samples(run['samples']))
+            result['curl_args'] = side_args
+            result['errors'] = len(run['errors'])
+            sides[key] = result
+        output = {
+            'schema_version': 1,
+            'a': sides['a'],
+            'b': sides['b'],
+            'comparison': {'count': count, 'phases': phases},
+        }
+        print(json.dumps(output, indent=2 if output_format == 'json' else None))
+        return 0
+
+    for label, (url, side_args), run in zip('AB', (side_a, side_b), runs):
+        errors = f", {red(str(len(run['errors'])) + ' failed')}" if run['errors'] else ''
+        print(f"{green(label)}: {url} {' '.join(side_args)}".rstrip()
+              + f" ({len(run['samples'])} runs{errors})")
+    print()
+    show_tls = any(url.startswith('https://') for url, _ in (side_a, side_b))
+    print(format_compare(phases, show_tls))
+    print()
+    print(grayscale[14]('Runs are interleaved (ABBA). The CI is a bootstrap interval for the difference of '
+                        'medians, the p-value comes from a two-sided Mann-Whitney U test.'))
+    return 0
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with bounded relative error (DDSketch).
+    Values go to logarithmic buckets, so every quantile is within
+    `relative_accuracy` of a true value and memory grows with the log of
+    the value range instead of the number of values. Past `max_buckets`
+    the lowest buckets are folded together, which only costs accuracy
+    at the low end.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        import math
+
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: dict[int, int] = {}
+        # values <= 0, e.g. 0ms phases, have no logarithm
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value: float):
+        import math
+
+        if value > 0:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: QuantileSketch):
+        if other.gamma != self.gamma:
+            raise ValueError('cannot merge sketches with different relative accuracy')
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self):
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        target = keys[excess]
+        for key in keys[:excess]:
+            self.buckets[target] += self.buckets.pop(key)
+
+    def quantile(self, q: float) -> float | None:
+        """The q-quantile (0 <= q <= 1), None if nothing was added."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zeros:
+            return 0.0
+        seen = self.zeros
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'zeros': self.zeros,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'buckets': {str(k): n for k, n in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> QuantileSketch:
+        """Rebuild a sketch from to_dict(), ValueError if data is malformed."""
+        try:
+            accuracy = data['relative_accuracy']
+            buckets = {int(k): n for k, n in data['buckets'].items()}
+            counts = [data['zeros'], data['count'], *buckets.values()]
+            values = [data['sum']] + ([data['min'], data['max']] if data['count'] else [])
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f'invalid sketch: {e!r}')
+        if not (is_number(accuracy) and 0 < accuracy < 1) \
+                or not all(isinstance(n, int) and n >= 0 for n in counts) \
+                or not all(is_number(v) for v in values):
+            raise ValueError('invalid sketch')
+        sketch = cls(accuracy)
+        sketch.buckets = buckets
+        sketch.zeros = data['zeros']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        if sketch.count:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+
+def is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+STREAM_QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+
+class StreamAggregator:
+    """Per-url, per-phase quantile sketches over a stream of jsonl records.
+    Takes httpstat results (anything with `timings_ms`) as well as the
+    reports of other `httpstat aggregate` runs, whose sketches are merged.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.skipped = 0
+        self.targets: dict[str, dict] = {}
+
+    def _target(self, url: str) -> dict:
+        target = self.targets.get(url)
+        if target is None:
+            target = self.targets[url] = {
+                'count': 0,
+                'errors': 0,
+                'phases': {name: QuantileSketch() for name, _, _ in AGGREGATE_FIELDS},
+            }
+        return target
+
+    def add_line(self, line: str):
+        """Add one jsonl line, lines that are not a valid result or
+        report are counted as skipped.
+        """
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('not an object')
+            if 'aggregate_stream' in record:
+                self.merge_report(record['aggregate_stream'])
+            elif isinstance(record.get('url'), str):
+                self.add_result(record)
+            else:
+                raise ValueError('not a result')
+        except ValueError:
+            self.skipped += 1
+
+    def add_result(self, record: dict):
+        timings = record.get('timings_ms')
+        if timings and not (isinstance(timings, dict) and all(
+                timings.get(name) is None or is_number(timings[name]) for name, _, _ in AGGREGATE_FIELDS)):
+            raise ValueError('invalid timings_ms')
+        self.records += 1
+        target = self._target(record['url'])
+        # failed probes have no timings, SLO violations do and count
+        if not timings:
+            target['errors'] += 1
+            return
+        target['count'] += 1
+        for name, sketch in target['phases'].items():
+            if timings.get(name) is not None:
+                sketch.add(timings[name])
+
+    def merge_report(self, report: dict):
+        """Merge another run's report, ValueError if it is malformed, in
+        which case nothing is merged.
+        """
+        def count(value) -> int:
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ValueError(f'invalid count: {value!r}')
+            return value
+
+        try:
+            records, skipped = count(report['records']), count(report['skipped'])
+            targets = [(url, count(data['count']), count(data['errors']),
+                        {name: QuantileSketch.from_dict(sketch) for name, sketch in data['sketches'].items()})
+                       for url, data in report['targets'].items()]
+        except (KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f'invalid aggregate report: {e!r}')
+        # merge() only takes sketches of the same accuracy
+        gamma = QuantileSketch().gamma
+        names = {name for name, _, _ in AGGREGATE_FIELDS}
+        for _, _, _, sketches in targets:
+            for name, sketch in sketches.items():
+                if name not in names or sketch.gamma != gamma:
+                    raise ValueError(f'invalid sketch for {name!r}')
+
+        self.records += records
+        self.skipped += skipped
+        for url, n, errors, sketches in targets:
+            target = self._target(url)
+            target['count'] += n
+            target['errors'] += errors
+            for name, sketch in sketches.items():
+                target['phases'][name].merge(sketch)
+
+    def report(self, sketches: bool = True) -> dict:
+        """The `aggregate_stream` JSON block. With `sketches`, another
+        aggregate run can merge it.
+        """
+        targets = {}
+        for url, target in self.targets.items():
+            phases = {}
+            for name, sketch in target['phases'].items():
+                if not sketch.count:
+                    continue
+                stats = {'min': sketch.min, 'mean': round(sketch.sum / sketch.count, 1)}
+                stats.update((label, round(sketch.quantile(q), 1)) for label, q in STREAM_QUANTILES)
+                stats['max'] = sketch.max
+                phases[name] = stats
+            targets[url] = {'count': target['count'], 'errors': target['errors'], 'phases': phases}
+            if sketches:
+                targets[url]['sketches'] = {name: s.to_dict() for name, s in target['phases'].items()}
+        return {'records': self.records, 'skipped': self.skipped, 'targets': targets}
+
+
+def format_stream_report(report: dict) -> str:
+    """Render an `aggregate_stream` block as one phase table per url."""
+    stats = ('min', 'mean') + tuple(label for label, _ in STREAM_QUANTILES) + ('max',)
+    lines = [f"{green('Aggregated')} {report['records']} records for {len(report['targets'])} targets"
+             + (f", {report['skipped']} lines skipped" if report['skipped'] else '')]
+    for url, target in sorted(report['targets'].items()):
+        errors = f", {red(str(target['errors']) + ' errors')}" if target['errors'] else ''
+        lines += ['', f"{cyan(url)} ({target['count']} probes{errors})"]
+        if not target['phases']:
+            continue
+        lines.append(grayscale[16](f'{"":<19}' + ''.join(f'{s:>9}' for s in stats)))
+        for name, _, label in AGGREGATE_FIELDS:
+            phase = target['phases'].get(name)
+            if phase:
+                lines.append(f'{label:<19}' + cyan(''.join(f'{_fmt_ms(phase[s]):>9}' for s in stats)))
+    return '\n'.join(lines)
+
+
+def aggregate_main(args: list[str], stream=None) -> int:
+    """`httpstat aggregate`: summarize a jsonl stream on stdin in constant
+    memory per url, refreshing every --interval while records arrive.
+    """
+    output_format = pop_arg(args, '--format') or pop_arg(args, '-f') or 'pretty'
+    interval_spec = pop_arg(args, '--interval')
+    interval = parse_duration(interval_spec, '--interval') if interval_spec else None
+    if output_format not in ('pretty', 'json', 'jsonl'):
+        _exit(f'Error: invalid format "{output_format}", must be pretty, json, or jsonl', 1)
+    if args:
+        _exit(f'Error: unexpected arguments for aggregate: {" ".join(args)}', 1)
+
+    def emit(final: bool):
+        if output_format == 'pretty':
+            screen = format_stream_report(aggregator.report(sketches=False))
+            if ISATTY and interval:
+                # cursor home and clear screen, then redraw
+                print('\x1b[H\x1b[J' + screen, flush=True)
+            else:
+                print(screen + ('' if final else '\n'), flush=True)
+        else:
+            doc = {'schema_version': 1, 'aggregate_stream': aggregator.report()}
+            print(json.dumps(doc, indent=2 if output_format == 'json' else None), flush=True)
+
+    aggregator = StreamAggregator()
+    last = time.monotonic()
+    try:
+        for line in stream or sys.stdin:
+            aggregator.add_line(line)
+            if interval and time.monotonic() - last >= interval:
+                emit(final=False)
+                last = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    emit(final=True)
+    return 0
+
+
+PROFILE_STAGES = (
+    # (stage, label)
+    ('interpreter', 'Interpreter startup'),
+    ('import', 'Import httpstat'),
+    ('args', 'Parse arguments'),
+    ('tempfile', 'Tempfile/pipe setup'),
+    ('curl', 'curl spawn to exit'),
+    ('decode', 'Decode curl output'),
+    ('headers', 'Parse headers'),
+    ('history', 'History store'),
+    ('render', 'Render output'),
+)
+
+
+def interpreter_startup_ms(import_start: float) -> float | None:
+    """Time from process start until `import_start` (a perf_counter value),
+    from /proc on Linux only, with the kernel's clock tick resolution
+    (usually 10ms). None where that is not available.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # the process name may contain spaces, fields after it are fixed
+            fields = f.read().rsplit(')', 1)[1].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        now = time.clock_gettime(time.CLOCK_BOOTTIME)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+    since_import = time.perf_counter() - import_start
+    return max(0.0, (now - since_import - started) * 1000)
+
+
+class StageTimer:
+    """Wall-clock time per httpstat stage for --profile. Each mark()
+    charges the time since the previous mark to a stage, repeated stages
+    (e.g. one curl per --count run) add up.
+    """
+
+    def __init__(self, start: float):
+        self.start = start
+        self.stages: dict[str, float] = {}
+        self._last = start
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self._last) * 1000
+        self._last = now
+
+    def result(self, interpreter_ms: float | None = None) -> dict:
+        """The `overhead_ms` block: ms per stage, `total` wall time and
+        `httpstat`, the part of it not spent in curl.
+        """
+        stages = dict(self.stages)
+        if interpreter_ms is not None:
+            stages['interpreter'] = interpreter_ms
+        overhead = {name: round(stages[name], 2) for name, _ in PROFILE_STAGES if name in stages}
+        total = sum(stages.values())
+        overhead['total'] = round(total, 2)
+        overhead['httpstat'] = round(total - stages.get('curl', 0.0), 2)
+        return overhead
+
+
+def format_profile(overhead: dict) -> str:
+    """Render an `overhead_ms` block as a two-column table."""
+    lines = []
+    for name, label in PROFILE_STAGES:
+        if name in overhead:
+            lines.append(f'{label:<22}' + cyan(f'{overhead[name]:>9.2f}ms'))
+    lines.append(f'{"Total":<22}' + cyan(f'{overhead["total"]:>9.2f}ms'))
+    lines.append(f'{"httpstat (not curl)":<22}' + cyan(f'{overhead["httpstat"]:>9.2f}ms'))
+    return '\n'.join(lines)
+
+
+class _NullLogger:
+    """Drops debug messages when HTTPSTAT_DEBUG is off."""
+
+    def debug(self, *args, **kwargs):
+        pass
+
+
 def _exit(s, code=0) -> NoReturn:
     if s is not None:
         print(s)
     sys.exit(code)
 
 
+# options httpstat passes to curl itself
+EXCLUDED_CURL_ARGS = (
+    '-w', '--write-out',
+    '-D', '--dump-header',
+    '-o', '--output',
+    '-s', '--silent',
+)
+
+
+def check_curl_args(curl_args: list[str]) -> None:
+    for i in EXCLUDED_CURL_ARGS:
+        if i in curl_args:
+            _exit(yellow(f'Error: {i} is not allowed in extra curl args'), 1)
+
+
 def print_help():
     help = """
 Usage: httpstat URL [CURL_OPTIONS]
+       httpstat --urls-file FILE [--concurrency N] [CURL_OPTIONS]
+       httpstat serve [URL ...] [--urls-file FILE] [--listen HOST:PORT]
+                      [--interval 15s] [--slo SPEC] [-- CURL_OPTIONS]
        httpstat -h | --help
        httpstat --version
 
@@ -284,9 +2999,72 @@ Options:
   --version     show version.
   -f --format   output format: pretty, json, jsonl. Default is `pretty`.
   --slo         SLO thresholds as key=value pairs, e.g. `total=500,connect=100`.
-                Valid keys: total, connect, ttfb, dns, tls.
+                Valid keys: total, connect, ttfb, dns, tls. Values are ms,
+                or µs with a `us` suffix, e.g. `connect=800us`.
                 Exits with code 4 on violation.
   --save        save structured output to a file path.
+  --save-format format of --save with --urls-file: `jsonl` (default) or
+                `columnar`, a compact binary file of typed columns with
+                dictionary-encoded url, IP, status and error, see
+                read_columnar().
+  --count N     run the probe N times and report min/mean/p50/p90/p95/p99/max
+                for each phase. SLO thresholds must hold for every run.
+  --reuse N     make N sequential requests in one curl process so that later
+                requests reuse the connection, shows cold vs warm timings.
+  --tls-resume N
+                open N new connections to an https url in one curl process,
+                the first with a full TLS handshake and the rest resuming its
+                session. Reports the handshake time saved by resumption.
+  --watch       keep probing every --interval and redraw the latest breakdown
+                next to rolling p50/p95 over the last --window probes.
+                With --count, stop after that many probes. --save writes one
+                jsonl record per probe.
+  --interval    time between probes in --watch mode, e.g. 500ms, 2s.
+                Default is 1s.
+  --window      number of probes kept for rolling statistics. Default is 60.
+  --rate R      open-loop load: start R probes per second for --duration,
+                independent of how long earlier probes take, with up to
+                --concurrency (default 100) in flight. Reports per-phase
+                distributions and total time corrected for schedule lag
+                (coordinated omission).
+  --duration    how long --rate mode runs, e.g. 30s, 5m. Default is 10s.
+  --hops        follow redirects (adds -L) and time DNS/TCP/TLS/server/transfer
+                for each hop of the chain separately, probing the hops in
+                one curl process so same-host hops reuse the connection.
+  --record      append this run's phase timings to the local history store
+                (SQLite, see HTTPSTAT_HISTORY_DB).
+  --baseline    compare this run with the stored history of the url over a
+                window, e.g. 7d, and flag phases whose p50 is up more than
+                20% (and 2ms). Exits with code 5 on regression.
+  --phase       stop the probe early: `connect` after the TCP/TLS handshake,
+                `ttfb` once the response headers arrived, without downloading
+                the body. Only the phases reached are shown, the others are
+                null in JSON output. Default is `full`. `connect` uses the
+                socket backend unless --backend is given.
+  --all-ips     resolve every A/AAAA record of the host and probe each address
+                at once (up to --concurrency), pinned with --resolve so Host
+                and SNI are unchanged. Shows one row per address with the
+                slowest in red. Fails when any address fails.
+  --high-res    keep curl's microseconds instead of truncating to whole ms:
+                phases are shown in µs/ms/s, SLOs are checked at µs precision
+                and JSON output gains a `timings_us` block.
+  --profile     time httpstat's own stages (startup, import, arguments,
+                tempfile setup, curl, decoding, headers, history store,
+                rendering) to tell the tool's overhead from network time.
+                JSON output gains an `overhead_ms` block.
+  --backend     how to run the probe: `curl` runs the curl binary (default),
+                `pycurl` and `socket` probe in-process, `inprocess` picks
+                pycurl if installed, otherwise socket. In-process backends
+                only accept -k, -H, -X and -m as curl options.
+  --urls-file   probe every url listed in a file (`-` for stdin), one per line.
+                Writes one jsonl record per target as soon as it finishes.
+  --concurrency max number of probes in flight in --urls-file, --all-ips and
+                --rate modes. Default is 10, or 100 with --rate.
+  --batch-engine
+                how --urls-file mode runs curl: `pool` starts one curl per
+                target, `parallel` fetches all targets in a single
+                `curl --parallel` process (needs curl 7.70+, 7.75+ to report
+                curl's exit code for failed targets). Default is `pool`.
 
 Environments:
   HTTPSTAT_SHOW_BODY    Set to `true` to show response body in the output,
@@ -301,21 +3079,71 @@ Environments:
   HTTPSTAT_CURL_BIN     Indicate the curl bin path to use. Default is `curl`
                         from current shell $PATH.
   HTTPSTAT_DEBUG        Set to `true` to see debugging logs. Default is `false`
+  HTTPSTAT_HISTORY_DB   Path of the history store used by --record and
+                        --baseline. Default is
+                        $XDG_DATA_HOME/httpstat/history.db, falling back to
+                        ~/.local/share/httpstat/history.db.
   NO_COLOR              Disable colored output (see https://no-color.org).
+
+Subcommands:
+  serve         probe targets every --interval (default 15s) and expose
+                Prometheus metrics on http://--listen/metrics (default
+                127.0.0.1:9345): per-phase duration histograms, probe and
+                error counters, and SLO violation counters.
+  aggregate     read httpstat jsonl records on stdin and keep per-url,
+                per-phase quantile sketches (bounded memory, mergeable);
+                prints a final report, or refreshes every --interval while
+                records arrive. Reports written with --format jsonl can be
+                fed to another aggregate run and are merged.
+  compare       httpstat compare URL_A URL_B [--count N] [-- curl options], or
+                one url with --a-args/--b-args option sets (e.g. --a-args
+                --http1.1 --b-args --http2): interleaved runs, per-phase
+                median differences with 95% bootstrap confidence intervals
+                and Mann-Whitney U p-values.
 """[1:-1]
     print(help)
 
 
 def main():
+    timer = StageTimer(_IMPORT_START)
+    timer.mark('import')
     args = sys.argv[1:]
     if not args:
         print_help()
         _exit(None, 0)
 
+    # subcommands
+    if args[0] == 'serve':
+        _exit(None, serve_main(args[1:]))
+    if args[0] == 'compare':
+        _exit(None, compare_main(args[1:]))
+    if args[0] == 'aggregate':
+        _exit(None, aggregate_main(args[1:]))
+
     # pop httpstat-specific flags before anything else
     output_format = pop_arg(args, '--format') or pop_arg(args, '-f') or 'pretty'
     slo_spec = pop_arg(args, '--slo')
     save_path = pop_arg(args, '--save')
+    save_format = pop_arg(args, '--save-format') or 'jsonl'
+    count_spec = pop_arg(args, '--count')
+    urls_file = pop_arg(args, '--urls-file')
+    concurrency_spec = pop_arg(args, '--concurrency')
+    batch_engine = pop_arg(args, '--batch-engine') or 'pool'
+    reuse_spec = pop_arg(args, '--reuse')
+    tls_resume_spec = pop_arg(args, '--tls-resume')
+    backend_spec = pop_arg(args, '--backend')
+    watch = pop_arg(args, '--watch', has_value=False)
+    interval_spec = pop_arg(args, '--interval')
+    window_spec = pop_arg(args, '--window')
+    rate_spec = pop_arg(args, '--rate')
+    duration_spec = pop_arg(args, '--duration')
+    profile = pop_arg(args, '--profile', has_value=False)
+    hops = pop_arg(args, '--hops', has_value=False)
+    record = pop_arg(args, '--record', has_value=False)
+    baseline_spec = pop_arg(args, '--baseline')
+    high_res = pop_arg(args, '--high-res', has_value=False)
+    phase = pop_arg(args, '--phase') or 'full'
+    all_ips = pop_arg(args, '--all-ips', has_value=False)
 
     # get envs
     show_body = parse_bool(ENV_SHOW_BODY.get('false'))
@@ -337,127 +3165,410 @@ def main():
     # parse SLO spec
     slo = parse_slo(slo_spec) if slo_spec else None
 
-    # configure logging
+    # parse repeat count
+    count = parse_count(count_spec) if count_spec else 1
+
+    if urls_file and count > 1:
+        _exit('Error: --count cannot be used with --urls-file', 1)
+    # parse connection reuse count
+    reuse = parse_positive_int(reuse_spec, '--reuse') if reuse_spec else 0
+    if reuse and count > 1:
+        _exit('Error: --reuse and --count cannot be used together', 1)
+    if reuse and urls_file:
+        _exit('Error: --reuse cannot be used with --urls-file', 1)
+
+    # parse TLS resumption handshake count
+    tls_resume = parse_positive_int(tls_resume_spec, '--tls-resume') if tls_resume_spec else 0
+    if tls_resume and (reuse or count > 1 or urls_file):
+        _exit('Error: --tls-resume cannot be used with --reuse, --count or --urls-file', 1)
+
+    # parse watch mode options, --count limits the number of probes
+    interval = parse_duration(interval_spec, '--interval') if interval_spec else 1.0
+    window = parse_positive_int(window_spec, '--window') if window_spec else 60
+    if watch and (reuse or tls_resume or urls_file):
+        _exit('Error: --watch cannot be used with --reuse, --tls-resume or --urls-file', 1)
+
+    # parse open-loop load options
+    rate = parse_rate(rate_spec) if rate_spec else 0.0
+    duration = parse_duration(duration_spec, '--duration') if duration_spec else 10.0
+    if rate and (reuse or tls_resume or urls_file or watch or count > 1):
+        _exit('Error: --rate cannot be used with --count, --reuse, --tls-resume, --urls-file or --watch', 1)
+
+    # parse concurrency, open-loop load keeps more probes in flight
+    if concurrency_spec:
+        concurrency = parse_positive_int(concurrency_spec, '--concurrency')
+    else:
+        concurrency = 100 if rate else 10
+
+    if phase not in PHASES:
+        _exit(f'Error: invalid phase "{phase}", must be one of {", ".join(PHASES)}', 1)
+    if phase != 'full':
+        if reuse or tls_resume or urls_file or watch or rate or hops or record or baseline_spec or profile:
+            _exit('Error: --phase cannot be used with --reuse, --tls-resume, --urls-file, --watch, --rate, '
+                  '--hops, --record, --baseline or --profile', 1)
+        for key in slo or ():
+            if key not in PHASE_SLO_KEYS[phase]:
+                _exit(f'Error: SLO key "{key}" is not measured with --phase {phase}, '
+                      f'valid keys: {", ".join(PHASE_SLO_KEYS[phase])}', 1)
+        # the body is never downloaded
+        show_body = save_body = False
+
+    # validate probe backend, only the curl binary supports every mode.
+    # The curl binary cannot stop after the handshake, so --phase connect
+    # uses the socket backend unless told otherwise.
+    backend = backend_spec or ('socket' if phase == 'connect' else 'curl')
+    if backend not in BACKEND_NAMES:
+        _exit(f'Error: invalid backend "{backend}", must be one of {", ".join(BACKEND_NAMES)}', 1)
+    backend = resolve_backend(backend)
+    if backend == 'pycurl' and not _pycurl_available():
+        _exit('Error: backend "pycurl" needs the pycurl package installed', 1)
+    if backend != 'curl' and (reuse or tls_resume or urls_file or watch or rate):
+        _exit('Error: --reuse, --tls-resume, --urls-file, --watch and --rate need the curl backend', 1)
+
+    if batch_engine not in BATCH_ENGINES:
+        _exit(f'Error: invalid batch engine "{batch_engine}", must be pool or parallel', 1)
+
+    if save_format not in SAVE_FORMATS:
+        _exit(f'Error: invalid save format "{save_format}", must be jsonl or columnar', 1)
+    if save_format == 'columnar' and not urls_file:
+        _exit('Error: --save-format columnar needs --urls-file', 1)
+
+    if profile and (urls_file or watch or rate):
+        _exit('Error: --profile cannot be used with --urls-file, --watch or --rate', 1)
+    # history store, --baseline takes a window such as 7d
+    baseline_window = parse_duration(baseline_spec, '--baseline') if baseline_spec else 0.0
+    if (record or baseline_spec) and (reuse or tls_resume or urls_file or watch or rate):
+        _exit('Error: --record and --baseline cannot be used with --reuse, --tls-resume, --urls-file, '
+              '--watch or --rate', 1)
+    if high_res and (urls_file or watch or rate):
+        _exit('Error: --high-res cannot be used with --urls-file, --watch or --rate', 1)
+    if all_ips and (reuse or tls_resume or urls_file or watch or rate or hops or record or baseline_spec
+                    or profile or count > 1 or phase != 'full' or backend != 'curl'):
+        _exit('Error: --all-ips cannot be used with --count, --reuse, --tls-resume, --urls-file, --watch, '
+              '--rate, --hops, --record, --baseline, --profile, --phase or an in-process backend', 1)
+    if hops and (reuse or tls_resume or urls_file or watch or rate or backend != 'curl'):
+        _exit('Error: --hops cannot be used with --reuse, --tls-resume, --urls-file, --watch, --rate '
+              'or an in-process backend', 1)
+
+    # configure logging, only when debugging since logging is slow to import
     if is_debug:
-        log_level = logging.DEBUG
+        import logging
+        logging.basicConfig(level=logging.DEBUG)
+        lg = logging.getLogger('httpstat')
+
+        # log envs
+        lg.debug('Envs:\n%s', '\n'.join(f'  {i.key}={i.get("")}' for i in Env._instances))
+        lg.debug('Flags: %s', dict(
+            show_body=show_body,
+            show_ip=show_ip,
+            show_speed=show_speed,
+            save_body=save_body,
+            curl_bin=curl_bin,
+            is_debug=is_debug,
+        ))
     else:
-        log_level = logging.INFO
-    logging.basicConfig(level=log_level)
-    lg = logging.getLogger('httpstat')
-
-    # log envs
-    lg.debug('Envs:\n%s', '\n'.join(f'  {i.key}={i.get("")}' for i in Env._instances))
-    lg.debug('Flags: %s', dict(
-        show_body=show_body,
-        show_ip=show_ip,
-        show_speed=show_speed,
-        save_body=save_body,
-        curl_bin=curl_bin,
-        is_debug=is_debug,
-    ))
-
-    # get url
-    url = args[0]
-    if url in ['-h', '--help']:
-        print_help()
-        _exit(None, 0)
-    elif url == '--version':
-        print(f'httpstat {__version__}')
-        _exit(None, 0)
+        lg = _NullLogger()
 
-    curl_args = args[1:]
+    # get url, in batch mode all remaining args are passed to curl
+    if urls_file:
+        url = None
+        curl_args = args
+    else:
+        if not args:
+            print_help()
+            _exit(None, 0)
+        url = args[0]
+        if url in ['-h', '--help']:
+            print_help()
+            _exit(None, 0)
+        elif url == '--version':
+            print(f'httpstat {__version__}')
+            _exit(None, 0)
+
+        curl_args = args[1:]
+
+        if tls_resume and not url.startswith('https://'):
+            _exit('Error: --tls-resume needs an https:// url', 1)
+
+        # --hops discovers the redirect chain by following it
+        if hops and not any(a in LOCATION_ARGS for a in curl_args):
+            curl_args = curl_args + ['-L']
 
     # check curl args
-    exclude_options = [
-        '-w', '--write-out',
-        '-D', '--dump-header',
-        '-o', '--output',
-        '-s', '--silent',
-    ]
-    for i in exclude_options:
-        if i in curl_args:
-            _exit(yellow(f'Error: {i} is not allowed in extra curl args'), 1)
+    check_curl_args(curl_args)
+    if all_ips:
+        for i in ADDRESS_ARGS:
+            if i in curl_args:
+                _exit(yellow(f'Error: {i} is not allowed with --all-ips'), 1)
+
+    fetch = INPROCESS_BACKENDS.get(backend)
+    if fetch:
+        try:
+            inprocess_opts = parse_inprocess_args(curl_args)
+        except ValueError as e:
+            if phase == 'connect' and not backend_spec:
+                _exit(yellow(f'Error: {e}, which --phase connect uses by default. '
+                             f'Pass --backend curl to probe with curl'), 1)
+            _exit(yellow(f'Error: {e}'), 1)
+        inprocess_opts['phase'] = phase
+
+    cmd_env = make_cmd_env()
+    timer.mark('args')
+
+    # batch mode: probe every url from the list, stream jsonl records
+    if urls_file:
+        try:
+            urls = read_urls(urls_file)
+        except OSError as e:
+            _exit(yellow(f'Error: could not read urls file: {e}'), 1)
+        probe_many = BATCH_ENGINES[batch_engine]
+        results = probe_many(urls, concurrency, curl_bin, curl_args, cmd_env, slo)
+        _exit(None, run_batch(results, save_path, save_format))
+
+    # load mode: open-loop probes at a fixed rate
+    if rate:
+        run = run_load(url, rate, duration, concurrency, curl_bin, curl_args, cmd_env)
+        load = build_load_result(rate, duration, run)
+        if not run['samples']:
+            e = run['errors'][-1]
+            _exit(yellow(f'All probes failed, last error: {e}'), e.exit_code)
+        slo_result = check_slo(slo, worst_timings(run['samples'])) if slo else None
+        exit_code = 4 if slo_result and not slo_result[0] else 0
+        if output_format in ('json', 'jsonl'):
+            result = build_json_result(url, run['samples'][-1], run['headers_text'],
+                                       slo_result, exit_code, load=load)
+            output_text = json.dumps(result, indent=2 if output_format == 'json' else None)
+        else:
+            output_text = format_load(load, show_tls=url.startswith('https://'))
+            if slo_result and not slo_result[0]:
+                output_text += '\n\n' + '\n'.join(
+                    red(f"SLO VIOLATION: {v['key']} = {v['actual_ms']}ms (threshold: {v['threshold_ms']}ms)")
+                    for v in slo_result[1])
+        print(output_text)
+        if save_path:
+            result = build_json_result(url, run['samples'][-1], run['headers_text'],
+                                       slo_result, exit_code, load=load)
+            with open(save_path, 'w') as f:
+                f.write(json.dumps(result, indent=2) + '\n')
+        _exit(None, exit_code)
 
-    # tempfile for output
-    bodyf = tempfile.NamedTemporaryFile(delete=False)
-    bodyf.close()
+    # watch mode: keep probing and redraw
+    if watch:
+        ticks = count if count_spec else None
+        _exit(None, run_watch(url, curl_bin, curl_args, cmd_env, interval, window,
+                              slo, output_format, ticks, save_path))
 
-    headerf = tempfile.NamedTemporaryFile(delete=False)
-    headerf.close()
+    # all-ips mode: probe every address of the host at once
+    if all_ips:
+        try:
+            host, port, ips = resolve_all(url, curl_args)
+        except ProbeError as e:
+            _exit(yellow(f'curl error: {e}'), e.exit_code)
+        lg.debug('ips: %s', ips)
+        ip_results = probe_ips(url, host, port, ips, concurrency, curl_bin, curl_args, cmd_env, high_res)
+        slowest = slowest_ip(ip_results)
+        if slowest is None:
+            e = ip_results[-1][1]
+            _exit(yellow(f'All probes failed, last error: {e}'), e.exit_code)
+        # an address that fails fails the run, an SLO violation on any takes precedence
+        samples = [d for _, d, _ in ip_results if not isinstance(d, ProbeError)]
+        failed = [e for _, e, _ in ip_results if isinstance(e, ProbeError)]
+        slo_result = check_slo(slo, worst_timings(samples)) if slo else None
+        exit_code = 4 if slo_result and not slo_result[0] else failed[0].exit_code if failed else 0
+        # the slowest address drives the rest of the result
+        _, d, headers_text = ip_results[slowest]
+        result = ProbeResult(url, d, headers_text, slo_result, exit_code).to_dict(
+            ips=build_ips_result(ip_results))
+        if output_format in ('json', 'jsonl'):
+            output_text = json.dumps(result, indent=2 if output_format == 'json' else None)
+        else:
+            fmt_ms = fmt_duration if high_res else _fmt_ms
+            lines = [f"{green('Addresses')} of {host}, {len(ips)} resolved:",
+                     format_ips(ip_results, show_tls=url.startswith('https://'))]
+            if len(samples) > 1:
+                fastest = min(s['time_total'] for s in samples)
+                lines += ['', f"Slowest is {red(ip_results[slowest][0])}, total {fmt_ms(d['time_total'])} "
+                              f"vs {fmt_ms(fastest)} for the fastest"]
+            if slo_result and not slo_result[0]:
+                lines.append('')
+                lines += [red(f"SLO VIOLATION: {v['key']} = {fmt_ms(v['actual_ms'])} "
+                              f"(threshold: {fmt_ms(v['threshold_ms'])})") for v in slo_result[1]]
+            output_text = '\n'.join(lines)
+        print(output_text)
+        if save_path:
+            with open(save_path, 'w') as f:
+                f.write(json.dumps(result, indent=2) + '\n')
+        _exit(None, exit_code)
+
+    # Headers go through a pipe when possible. The body only goes to a
+    # tempfile when it is kept, otherwise it is discarded, or previewed
+    # from a bounded in-memory pipe when HTTPSTAT_SHOW_BODY is set.
+    use_pipes = PIPES_SUPPORTED and not fetch
+    headerf = bodyf = None
+    if not use_pipes or save_body:
+        import tempfile
+    if not use_pipes:
+        headerf = tempfile.NamedTemporaryFile(delete=False)
+        headerf.close()
+    if save_body or (show_body and not use_pipes):
+        bodyf = tempfile.NamedTemporaryFile(delete=False)
+        bodyf.close()
+        body_path = bodyf.name
+    elif phase != 'full' and not fetch:
+        body_path = PHASE_BODY_PATH
+    else:
+        lg.debug('body is not saved, %s', 'previewed in memory' if show_body else 'discarded')
+        body_path = os.devnull
+    body_sink = None
+    timer.mark('tempfile')
+
+    def build_cmd(header_path, body_path):
+        # only the first body is kept, like its size_download, a shared pipe
+        # would otherwise collect all of them
+        rest_body_path = body_path if body_path == PHASE_BODY_PATH else os.devnull
+        if reuse:
+            return build_reuse_cmd(curl_bin, curl_args, url, header_path, body_path, reuse, rest_body_path)
+        elif tls_resume:
+            return build_reuse_cmd(curl_bin, curl_args + TLS_RESUME_ARGS, url,
+                                   header_path, body_path, tls_resume, rest_body_path)
+        return build_curl_cmd(curl_bin, curl_args, url, header_path, body_path)
 
     try:
         # run cmd
-        cmd_env = os.environ.copy()
-        cmd_env.update(
-            LC_ALL='C',
-        )
-        cmd_core = [curl_bin, '-w', curl_format, '-D', headerf.name, '-o', bodyf.name, '-s', '-S']
-        cmd = cmd_core + curl_args + [url]
-        lg.debug('cmd: %s', cmd)
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=cmd_env)
-        out, err = p.communicate()
-        out, err = out.decode(errors='replace'), err.decode(errors='replace')
-        lg.debug('out: %s', out)
-
-        # print stderr
-        if p.returncode == 0:
-            if err:
-                print(grayscale[16](err))
-        else:
-            _cmd = list(cmd)
-            _cmd[2] = '<output-format>'
-            _cmd[4] = '<tempfile>'
-            _cmd[6] = '<tempfile>'
-            print(f'> {" ".join(_cmd)}')
-            _exit(yellow(f'curl error: {err}'), p.returncode)
-
-        # parse output
-        try:
-            d = json.loads(out)
-        except ValueError as e:
-            print(yellow(f'Could not decode json: {e}'))
-            print('curl result:', p.returncode, grayscale[16](out), grayscale[16](err))
-            _exit(None, 1)
+        samples = []
+        for _ in range(count):
+            if fetch:
+                try:
+                    d = fetch(url, inprocess_opts, headerf.name, body_path)
+                except ProbeError as e:
+                    _exit(yellow(f'{backend} error: {e}'), e.exit_code)
+                timer.mark('curl')
+                samples.append(limit_phase(convert_metrics(d, high_res), phase))
+                timer.mark('decode')
+                continue
+
+            sinks = []
+            if use_pipes:
+                header_sink = PipeSink()
+                sinks.append(header_sink)
+                if show_body and not save_body:
+                    body_sink = PipeSink(BODY_LIMIT)
+                    sinks.append(body_sink)
+                cmd = build_cmd(header_sink.path, body_sink.path if body_sink else body_path)
+            else:
+                cmd = build_cmd(headerf.name, body_path)
+            lg.debug('cmd: %s', cmd)
+            timer.mark('tempfile')
 
-        # convert time_ metrics from seconds to milliseconds
-        for k in d:
-            if k.startswith('time_'):
-                v = d[k]
-                # Convert time_ values to milliseconds in int
-                if isinstance(v, float):
-                    # Before 7.61.0, time values are represented as seconds in float
-                    d[k] = int(v * 1000)
-                elif isinstance(v, int):
-                    # Starting from 7.61.0, libcurl uses microsecond in int
-                    # to return time values, references:
-                    # https://daniel.haxx.se/blog/2018/07/11/curl-7-61-0/
-                    # https://curl.se/bug/?i=2495
-                    d[k] = int(v / 1000)
-                else:
-                    raise TypeError(f'{k} value type is invalid: {type(v)}')
+            returncode, out, err = run_curl(cmd, cmd_env, sinks)
+            timer.mark('curl')
+            lg.debug('out: %s', out)
 
-        # calculate ranges
-        d.update(
-            range_dns=d['time_namelookup'],
-            range_connection=d['time_connect'] - d['time_namelookup'],
-            range_ssl=d['time_pretransfer'] - d['time_connect'],
-            range_server=d['time_starttransfer'] - d['time_pretransfer'],
-            range_transfer=d['time_total'] - d['time_starttransfer'],
-        )
+            # print stderr, --phase stops curl with a write error on purpose
+            if phase != 'full' and returncode == CURLE_WRITE_ERROR:
+                pass
+            elif returncode == 0:
+                if err:
+                    print(grayscale[16](err))
+            else:
+                _cmd = list(cmd)
+                _cmd[2] = '<output-format>'
+                _cmd[4] = '<tempfile>'
+                _cmd[6] = '<tempfile>'
+                print(f'> {" ".join(_cmd)}')
+                _exit(yellow(f'curl error: {err}'), returncode)
+
+            # parse output, one record per transfer
+            try:
+                records = split_write_out(out)
+            except ValueError as e:
+                print(yellow(f'Could not decode json: {e}'))
+                print('curl result:', returncode, grayscale[16](out), grayscale[16](err))
+                _exit(None, 1)
+
+            samples.extend(limit_phase(convert_metrics(d, high_res), phase) for d in records)
+            timer.mark('decode')
+            if use_pipes:
+                headers_text = header_sink.text().strip()
+                timer.mark('headers')
 
         # read headers
-        with open(headerf.name, 'r') as f:
-            headers_text = f.read().strip()
-
-        # check SLO
-        slo_result = check_slo(slo, d) if slo else None
+        if headerf:
+            with open(headerf.name, 'r') as f:
+                headers_text = f.read().strip()
+            timer.mark('headers')
+        if phase == 'connect':
+            # curl has sent a request regardless, its response is not part of the probe
+            headers_text = ''
+
+        aggregate = reuse_result = tls_resumption = None
+        if reuse or tls_resume:
+            # the first, cold request drives the single-run output
+            d = samples[0]
+            headers_text = split_header_blocks(headers_text)[0]
+            if reuse:
+                reuse_result = build_reuse_result(samples)
+            else:
+                tls_resumption = build_tls_resumption_result(samples)
+        else:
+            # the last sample drives the single-run output
+            d = samples[-1]
+            if count > 1:
+                aggregate = aggregate_samples(samples)
+        timer.mark('decode')
+
+        # time each hop of the redirect chain on its own
+        hop_results = None
+        if hops:
+            chain = redirect_chain(url, headers_text)
+            try:
+                hop_results = probe_hops(chain, curl_bin, curl_args, cmd_env, high_res)
+            except ProbeError as e:
+                _exit(yellow(f'Could not probe redirect hops: {e}'), e.exit_code)
+            lg.debug('hops: %s', chain)
+            timer.mark('curl')
+
+        # check SLO, in --count and --reuse mode every sample must pass
+        slo_result = check_slo(slo, worst_timings(samples)) if slo else None
         exit_code = 0
         if slo_result and not slo_result[0]:
             exit_code = 4
+        timer.mark('decode')
+
+        # compare with the history of url, then append this run to it
+        baseline_result = None
+        if record or baseline_spec:
+            import sqlite3
+            history_path = default_history_path()
+            try:
+                history = open_history(history_path)
+                try:
+                    if baseline_spec:
+                        stored = load_history(history, url, time.time() - baseline_window)
+                        baseline_result = build_baseline_result(stored, samples, baseline_spec)
+                    if record:
+                        record_history(history, url, samples, exit_code, time.time())
+                finally:
+                    history.close()
+            except (OSError, sqlite3.Error) as e:
+                _exit(yellow(f'Error: history store {history_path}: {e}'), 1)
+            lg.debug('history: %s', history_path)
+            if baseline_result and baseline_result['regressions'] and not exit_code:
+                exit_code = 5
+            timer.mark('history')
+        probe_result = ProbeResult(url, d, headers_text, slo_result, exit_code)
+        timer.mark('headers')
+        extra_blocks = dict(aggregate=aggregate, reuse=reuse_result, tls_resumption=tls_resumption,
+                            hops=build_hops_result(hop_results) if hops else None,
+                            baseline=baseline_result, phase=None if phase == 'full' else phase)
 
         # --- output ---
         if output_format in ('json', 'jsonl'):
-            result = build_json_result(url, d, headers_text, slo_result, exit_code)
+            result = probe_result.to_dict(**extra_blocks)
+            timer.mark('render')
+            if profile:
+                # serializing this very block is the only stage left out
+                result['overhead_ms'] = timer.result(interpreter_startup_ms(_IMPORT_START))
             indent = 2 if output_format == 'json' else None
             output_text = json.dumps(result, indent=indent)
             print(output_text)
@@ -467,89 +3578,120 @@ def main():
             sys.exit(exit_code)
 
         # --- pretty mode (default, unchanged behavior) ---
+        fmt_ms = fmt_duration if high_res else _fmt_ms
 
         # ip
         if show_ip:
             print(f"Connected to {cyan(d['remote_ip'])}:{cyan(d['remote_port'])} from {d['local_ip']}:{d['local_port']}")
             print()
 
-        for loop, line in enumerate(headers_text.split('\n')):
-            if loop == 0:
-                p1, p2 = tuple(line.split('/'))
-                print(green(p1) + grayscale[14]('/') + cyan(p2))
-            else:
-                pos = line.find(':')
-                print(grayscale[14](line[:pos + 1]) + cyan(line[pos + 1:]))
+        # none with --phase connect
+        if headers_text:
+            for loop, line in enumerate(headers_text.split('\n')):
+                if loop == 0:
+                    p1, p2 = tuple(line.split('/'))
+                    print(green(p1) + grayscale[14]('/') + cyan(p2))
+                else:
+                    pos = line.find(':')
+                    print(grayscale[14](line[:pos + 1]) + cyan(line[pos + 1:]))
 
-        print()
+            print()
 
         # body
         if show_body:
-            body_limit = 1024
-            with open(bodyf.name, 'r') as f:
-                body = f.read().strip()
-            body_len = len(body)
+            # only the preview is read, the true size comes from curl
+            body_limit = BODY_LIMIT
+            if body_sink:
+                preview = body_sink.wait()
+            else:
+                preview = read_body_preview(body_path, body_limit)
+            body_len = d.get('size_download', len(preview))
+            body = decode_body_preview(preview)
 
-            if body_len > body_limit:
-                print(body[:body_limit] + cyan('...'))
+            if body is None:
+                s = f"{green('Body')} is binary ({body_len} bytes)"
+                if save_body:
+                    s += f', stored in: {body_path}'
+                print(s)
+            elif body_len > body_limit:
+                print(body.strip() + cyan('...'))
                 print()
                 s = f"{green('Body')} is truncated ({body_limit} out of {body_len})"
                 if save_body:
-                    s += f', stored in: {bodyf.name}'
+                    s += f', stored in: {body_path}'
                 print(s)
             else:
-                print(body)
+                print(body.strip())
         else:
             if save_body:
-                print(f"{green('Body')} stored in: {bodyf.name}")
+                print(f"{green('Body')} stored in: {body_path}")
 
-        # print stat
-        if url.startswith('https://'):
-            template = https_template
-        else:
-            template = http_template
-
-        # colorize template first line
-        tpl_parts = template.split('\n')
-        tpl_parts[0] = grayscale[16](tpl_parts[0])
-        template = '\n'.join(tpl_parts)
-
-        def fmta(s):
-            return cyan(f'{str(s) + "ms":^7}')
-
-        def fmtb(s):
-            return cyan(f'{str(s) + "ms":<7}')
-
-        stat = template.format(
-            # a
-            a0000=fmta(d['range_dns']),
-            a0001=fmta(d['range_connection']),
-            a0002=fmta(d['range_ssl']),
-            a0003=fmta(d['range_server']),
-            a0004=fmta(d['range_transfer']),
-            # b
-            b0000=fmtb(d['time_namelookup']),
-            b0001=fmtb(d['time_connect']),
-            b0002=fmtb(d['time_pretransfer']),
-            b0003=fmtb(d['time_starttransfer']),
-            b0004=fmtb(d['time_total']),
-        )
+        stat = render_template(d, url.startswith('https://'), phase)
         print()
         print(stat)
+        details = render_details(d, url.startswith('https://'))
+        if details:
+            print(details)
+            print()
+
+        if aggregate:
+            print(f"{green('Statistics')} over {aggregate['count']} runs:")
+            print(format_aggregate(aggregate, show_tls=url.startswith('https://'), fmt=fmt_ms))
+            print()
+
+        if reuse_result:
+            rows = [(f'#{i + 1} ({"warm" if s.get("num_connects") == 0 else "cold"})', s)
+                    for i, s in enumerate(samples)]
+            print(f"{green('Connection reuse')} over {len(samples)} requests:")
+            print(format_phase_table(rows, show_tls=url.startswith('https://')))
+            if reuse_result['warm'] is None and len(samples) > 1:
+                print(yellow('Warning: no connection was reused, the server closed it after each request'))
+            print()
+
+        if tls_resumption:
+            print(f"{green('TLS handshake')} (time_appconnect - time_connect) over {len(samples)} connections:")
+            for i, ms in enumerate([tls_resumption['full_ms']] + tls_resumption['resumed_ms']):
+                label = f'#{i + 1} ({"full" if i == 0 else "resumed"})'
+                print(f'{label:<16}' + cyan(f'{fmt_ms(ms):>9}'))
+            if tls_resumption['saved_ms'] is not None:
+                print(f"Resumption saves {cyan(fmt_ms(tls_resumption['saved_ms']))} (full vs resumed p50)")
+            print()
+
+        if hop_results:
+            print(f"{green('Redirect chain')} over {len(hop_results)} hops:")
+            print(format_hops(hop_results))
+            print()
 
         # speed, originally bytes per second
-        if show_speed:
+        if show_speed and phase == 'full':
             print(f"speed_download: {d['speed_download'] / 1024:.1f} KiB/s, speed_upload: {d['speed_upload'] / 1024:.1f} KiB/s")
 
         # SLO violations in pretty mode
         if slo_result and not slo_result[0]:
             print()
             for v in slo_result[1]:
-                print(red(f"SLO VIOLATION: {v['key']} = {v['actual_ms']}ms (threshold: {v['threshold_ms']}ms)"))
+                print(red(f"SLO VIOLATION: {v['key']} = {fmt_ms(v['actual_ms'])} (threshold: {fmt_ms(v['threshold_ms'])})"))
+
+        # regressions against the stored history
+        if baseline_result:
+            print()
+            for line in format_baseline(url, baseline_result):
+                print(line)
+
+        # httpstat's own time per stage
+        overhead = None
+        if profile:
+            timer.mark('render')
+            overhead = timer.result(interpreter_startup_ms(_IMPORT_START))
+            print()
+            print(f"{green('Profile')} of httpstat itself, time_total is {_fmt_ms(d['time_total'])}:")
+            print(format_profile(overhead))
 
         # save pretty output as json if --save specified
         if save_path:
-            result = build_json_result(url, d, headers_text, slo_result, exit_code)
+            result = probe_result.to_dict(**extra_blocks)
+            if overhead:
+                result['overhead_ms'] = overhead
             with open(save_path, 'w') as f:
                 f.write(json.dumps(result, indent=2) + '\n')
 
@@ -557,12 +3699,12 @@ def main():
             sys.exit(exit_code)
     finally:
         # always clean header file; only clean body file if not saving
-        for path in (headerf.name,):
+        if headerf:
             try:
-                os.remove(path)
+                os.remove(headerf.name)
             except OSError:
                 pass
-        if not save_body:
+        if bodyf and not save_body:
             lg.debug('rm body file %s', bodyf.name)
             try:
                 os.remove(bodyf.name)
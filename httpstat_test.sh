@@ -86,7 +86,7 @@ for pybin in python; do
     assert_exit 0
 
     title "HTTPSTAT_SAVE_BODY=false"
-    HTTPSTAT_SAVE_BODY=false HTTPSTAT_DEBUG=true main $http_url | grep -q 'rm body file'
+    HTTPSTAT_SAVE_BODY=false HTTPSTAT_DEBUG=true main $http_url | grep -q 'body is not saved'
     assert_exit 0
 
     title "HTTPSTAT_SHOW_BODY=true HTTPSTAT_SAVE_BODY=true"
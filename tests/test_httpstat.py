@@ -2,6 +2,11 @@ from __future__ import annotations
 
 import json
 import os
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
 import pytest
 
 import httpstat
@@ -115,6 +120,14 @@ class TestParseSlo:
         result = httpstat.parse_slo(' total = 500 , connect = 100 ')
         assert result == {'total': 500, 'connect': 100}
 
+    def test_unit_suffix(self):
+        result = httpstat.parse_slo('total=500ms,connect=800us')
+        assert result == {'total': 500, 'connect': 0.8}
+
+    def test_invalid_unit(self):
+        with pytest.raises(SystemExit):
+            httpstat.parse_slo('total=5s')
+
 
 # --- check_slo ---
 
@@ -170,6 +183,487 @@ class TestCheckSlo:
         assert violations[0]['actual_ms'] == 30
 
 
+# --- parse_count ---
+
+class TestParseCount:
+    def test_valid(self):
+        assert httpstat.parse_count('10') == 10
+
+    @pytest.mark.parametrize('value', ['0', '-3', 'abc', ''])
+    def test_invalid(self, value):
+        with pytest.raises(SystemExit):
+            httpstat.parse_count(value)
+
+
+class TestParsePositiveInt:
+    def test_valid(self):
+        assert httpstat.parse_positive_int('4', '--concurrency') == 4
+
+    def test_invalid(self, capsys):
+        with pytest.raises(SystemExit):
+            httpstat.parse_positive_int('x', '--concurrency')
+        assert '--concurrency' in capsys.readouterr().out
+
+
+# --- read_urls ---
+
+class TestReadUrls:
+    def test_skips_blank_and_comments(self, tmp_path):
+        path = tmp_path / 'urls.txt'
+        path.write_text('https://a.example\n\n# comment\n  https://b.example  \n')
+        assert httpstat.read_urls(str(path)) == ['https://a.example', 'https://b.example']
+
+    def test_stdin(self, monkeypatch):
+        import io
+        monkeypatch.setattr('sys.stdin', io.StringIO('a.example\nb.example\n'))
+        assert httpstat.read_urls('-') == ['a.example', 'b.example']
+
+
+# --- build_curl_cmd ---
+
+class TestBuildCurlCmd:
+    def test_fixed_positions(self):
+        cmd = httpstat.build_curl_cmd('curl', ['-k'], 'https://example.com', '/tmp/h', '/tmp/b')
+        assert cmd[1] == '-w'
+        assert cmd[2] == httpstat.curl_format
+        assert cmd[4] == '/tmp/h'
+        assert cmd[6] == '/tmp/b'
+        assert cmd[-2:] == ['-k', 'https://example.com']
+
+
+# --- TLS resumption ---
+
+class TestTlsResumption:
+    def _make_sample(self, connect, appconnect):
+        return {'time_namelookup': connect / 2, 'time_connect': connect, 'time_appconnect': appconnect}
+
+    def test_result(self):
+        samples = [self._make_sample(10, 40), self._make_sample(10, 20),
+                   self._make_sample(12, 20), self._make_sample(10, 22)]
+        result = httpstat.build_tls_resumption_result(samples)
+        assert result['count'] == 4
+        assert result['full_ms'] == 30
+        assert result['resumed_ms'] == [10, 8, 12]
+        assert result['resumed']['p50'] == 10
+        assert result['saved_ms'] == 20
+
+    def test_high_res(self):
+        samples = [self._make_sample(0.1, 0.4), self._make_sample(0.1, 0.2341),
+                   self._make_sample(0.1, 0.2127), self._make_sample(0.1, 0.2252)]
+        result = httpstat.build_tls_resumption_result(samples)
+        assert result['full_ms'] == 0.3
+        assert result['resumed_ms'] == [0.134, 0.113, 0.125]
+        assert result['resumed']['p50'] == 0.125
+        assert result['saved_ms'] == 0.175
+
+    def test_single_handshake(self):
+        result = httpstat.build_tls_resumption_result([self._make_sample(10, 40)])
+        assert result['resumed'] is None
+        assert result['saved_ms'] is None
+
+    def test_forces_new_connections(self):
+        assert '--http1.1' in httpstat.TLS_RESUME_ARGS
+        assert 'Connection: close' in httpstat.TLS_RESUME_ARGS
+
+    @pytest.mark.parametrize('flag', [['--reuse', '2'], ['--count', '2'], ['--urls-file', 'urls.txt']])
+    def test_conflicts(self, monkeypatch, capsys, flag):
+        monkeypatch.setattr(sys, 'argv', ['httpstat', 'https://a', '--tls-resume', '3'] + flag)
+        with pytest.raises(SystemExit) as e:
+            httpstat.main()
+        assert e.value.code == 1
+        assert '--tls-resume cannot be used' in capsys.readouterr().out
+
+
+# --- body preview ---
+
+class TestBodyPreview:
+    def test_reads_only_limit(self, tmp_path):
+        path = tmp_path / 'body'
+        path.write_bytes(b'x' * 5000)
+        assert httpstat.read_body_preview(str(path), 1024) == b'x' * 1024
+
+    def test_short_body(self, tmp_path):
+        path = tmp_path / 'body'
+        path.write_bytes(b'ok')
+        assert httpstat.read_body_preview(str(path)) == b'ok'
+
+    def test_decode_text(self):
+        assert httpstat.decode_body_preview(b'{"a": 1}') == '{"a": 1}'
+
+    def test_decode_binary(self):
+        assert httpstat.decode_body_preview(b'\x89PNG\r\n\x1a\n\x00\x00') is None
+
+    def test_decode_cut_multibyte(self):
+        preview = '中文'.encode()[:-1]
+        assert httpstat.decode_body_preview(preview) == '中'
+
+    def test_format_has_size_download(self):
+        assert 'size_download' in httpstat.CURL_FORMAT_KEYS
+
+
+# --- PipeSink ---
+
+@pytest.mark.skipif(not httpstat.PIPES_SUPPORTED, reason='needs /dev/fd')
+class TestPipeSink:
+    def test_run_curl_drains_sink(self):
+        sink = httpstat.PipeSink()
+        cmd = ['sh', '-c', f'printf "HTTP/1.1 200 OK" > {sink.path}; printf out']
+        returncode, out, err = httpstat.run_curl(cmd, os.environ.copy(), [sink])
+        assert returncode == 0
+        assert out == 'out'
+        assert sink.text() == 'HTTP/1.1 200 OK'
+
+    def test_limit(self):
+        sink = httpstat.PipeSink(limit=4)
+        cmd = ['sh', '-c', f'printf 0123456789 > {sink.path}']
+        httpstat.run_curl(cmd, os.environ.copy(), [sink])
+        assert sink.wait() == b'0123'
+        assert sink.size == 10
+
+    def test_run_curl_drops_write_out_warnings(self):
+        cmd = ['sh', '-c', 'printf "curl: unknown --write-out variable: \'time_queue\'\\nwarning\\n" >&2']
+        _, _, err = httpstat.run_curl(cmd, os.environ.copy())
+        assert err == 'warning\n'
+
+
+# --- parallel batch engine ---
+
+class TestParallelEngine:
+    def test_format_keys(self):
+        assert httpstat.CURL_FORMAT_KEYS[0] == 'time_namelookup'
+        assert 'remote_ip' in httpstat.CURL_FORMAT_KEYS
+
+    def test_parallel_format(self):
+        fmt = httpstat.parallel_format.format(index=3)
+        assert fmt == '{"index": 3, "metrics": %{json}}\n'
+
+    @pytest.mark.parametrize('metrics, error', [
+        ({'exitcode': 0, 'response_code': 200}, None),
+        ({'exitcode': 7, 'errormsg': 'refused', 'response_code': 0}, (7, 'curl error: curl: (7) refused')),
+        # curl 7.70-7.74 has no exitcode
+        ({'response_code': 200}, None),
+        ({'response_code': 0}, (1, 'curl error: transfer failed, curl older than 7.75 reports no exit code')),
+    ])
+    def test_parallel_record_error(self, metrics, error):
+        assert httpstat.parallel_record_error(metrics) == error
+
+    def test_build_parallel_cmd(self):
+        cmd = httpstat.build_parallel_cmd('curl', ['-k'], ['a.example', 'b.example'], '/tmp/hd', 4)
+        assert cmd[:4] == ['curl', '--parallel', '--parallel-max', '4']
+        assert cmd.count('--next') == 1
+        nxt = cmd.index('--next')
+        assert cmd[nxt - 2:nxt] == ['-k', 'a.example']
+        assert cmd[-2:] == ['-k', 'b.example']
+        assert os.path.join('/tmp/hd', '1') in cmd
+
+    def test_record_metrics(self):
+        metrics = {k: 0 for k in httpstat.CURL_FORMAT_KEYS}
+        metrics.update(remote_port=443, local_port=50000, errormsg=None, urlnum=0)
+        d = httpstat.parallel_record_metrics(metrics)
+        assert set(d) == set(httpstat.CURL_FORMAT_KEYS)
+        assert d['remote_port'] == '443'
+        assert d['local_port'] == '50000'
+
+
+# --- run_batch ---
+
+class TestRunBatch:
+    def test_streams_and_saves(self, tmp_path, capsys):
+        save = tmp_path / 'out.jsonl'
+        results = [
+            {'url': 'a', 'exit_code': 0},
+            {'url': 'b', 'exit_code': 7},
+            {'url': 'c', 'exit_code': 4},
+        ]
+        assert httpstat.run_batch(iter(results), str(save)) == 7
+        lines = capsys.readouterr().out.splitlines()
+        assert [json.loads(l)['url'] for l in lines] == ['a', 'b', 'c']
+        assert save.read_text().splitlines() == lines
+
+    def test_columnar(self, tmp_path, capsys):
+        save = tmp_path / 'out.col'
+        ok = httpstat.build_json_result('https://a', {
+            'time_namelookup': 1, 'time_connect': 3, 'time_pretransfer': 6, 'time_starttransfer': 10,
+            'time_total': 15, 'range_dns': 1, 'range_connection': 2, 'range_ssl': 3, 'range_server': 4,
+            'range_transfer': 5, 'speed_download': 12800.0, 'speed_upload': 0.0, 'remote_ip': '10.0.0.1',
+        }, 'HTTP/2 200\r\n', None, 0)
+        failed = httpstat.build_error_result('https://b', 7, 'curl error: refused')
+        assert httpstat.run_batch(iter([ok, failed, ok]), str(save), 'columnar') == 7
+        assert len(capsys.readouterr().out.splitlines()) == 3
+
+        data = httpstat.read_columnar(str(save))
+        columns, dictionaries = data['columns'], data['dictionaries']
+        assert data['rows'] == 3
+        assert list(columns['exit_code']) == [0, 7, 0]
+        assert list(columns['total']) == [15, -1, 15]
+        assert list(columns['queue']) == [-1, -1, -1]
+        assert columns['download_kbs'][0] == 12.5
+        assert columns['download_kbs'][1] != columns['download_kbs'][1]  # NaN
+        assert [dictionaries['url'][c] for c in columns['url']] == ['https://a', 'https://b', 'https://a']
+        assert [dictionaries['status_code'][c] for c in columns['status_code']] == [200, 0, 200]
+        assert dictionaries['remote_ip'] == ['10.0.0.1', '']
+        assert dictionaries['error'][columns['error'][1]] == 'curl error: refused'
+
+    def test_read_columnar_rejects_other_files(self, tmp_path):
+        path = tmp_path / 'out.jsonl'
+        path.write_text('{}\n')
+        with pytest.raises(ValueError):
+            httpstat.read_columnar(str(path))
+
+    def test_count_conflict(self, monkeypatch, capsys):
+        monkeypatch.setattr(sys, 'argv', ['httpstat', '--urls-file', 'urls.txt', '--count', '5'])
+        with pytest.raises(SystemExit) as e:
+            httpstat.main()
+        assert e.value.code == 1
+        assert '--count cannot be used with --urls-file' in capsys.readouterr().out
+
+
+# --- parse_duration ---
+
+class TestParseDuration:
+    @pytest.mark.parametrize('spec,seconds', [
+        ('1', 1.0), ('1s', 1.0), ('500ms', 0.5), ('2.5s', 2.5),
+        ('5m', 300.0), ('2h', 7200.0), ('7d', 604800.0),
+    ])
+    def test_valid(self, spec, seconds):
+        assert httpstat.parse_duration(spec, '--interval') == pytest.approx(seconds)
+
+    @pytest.mark.parametrize('spec', ['', 'abc', '1x', '-1s', '0', '0ms'])
+    def test_invalid(self, spec):
+        with pytest.raises(SystemExit):
+            httpstat.parse_duration(spec, '--interval')
+
+
+# --- convert_metrics ---
+
+class TestConvertMetrics:
+    def _make_raw(self, scale):
+        return {
+            'time_namelookup': 5 * scale,
+            'time_connect': 15 * scale,
+            'time_appconnect': 25 * scale,
+            'time_pretransfer': 30 * scale,
+            'time_redirect': 0 * scale,
+            'time_starttransfer': 80 * scale,
+            'time_total': 100 * scale,
+            'speed_download': 10240.0,
+        }
+
+    def test_microseconds_int(self):
+        d = httpstat.convert_metrics(self._make_raw(1000))
+        assert d['time_total'] == 100
+        assert d['range_server'] == 50
+
+    def test_seconds_float(self):
+        d = httpstat.convert_metrics(self._make_raw(0.001))
+        assert d['time_namelookup'] == 5
+        assert d['range_connection'] == 10
+
+    def test_ranges(self):
+        d = httpstat.convert_metrics(self._make_raw(1000))
+        assert d['range_dns'] == 5
+        assert d['range_connection'] == 10
+        assert d['range_ssl'] == 15
+        assert d['range_server'] == 50
+        assert d['range_transfer'] == 20
+
+    def test_high_res(self):
+        raw = dict(self._make_raw(1000), time_namelookup=5400, time_connect=5900, time_total=100123)
+        d = httpstat.convert_metrics(dict(raw), high_res=True)
+        assert httpstat.is_high_res(d)
+        assert d['time_total'] == 100.123
+        # 0.5ms, where truncating first would give 5 - 5 = 0
+        assert d['range_connection'] == 0.5
+        assert httpstat.convert_metrics(dict(raw))['range_connection'] == 0
+        assert not httpstat.is_high_res(httpstat.convert_metrics(dict(raw)))
+
+    def test_high_res_seconds_float(self):
+        d = httpstat.convert_metrics(self._make_raw(0.000_999), high_res=True)
+        assert d['time_namelookup'] == 4.995
+        assert d['range_server'] == 49.95
+
+    def test_high_res_slo(self):
+        raw = dict(self._make_raw(1000), time_total=100400)
+        d = httpstat.convert_metrics(raw, high_res=True)
+        assert not httpstat.check_slo({'total': 100}, d)[0]
+        assert httpstat.check_slo({'total': 100.5}, d)[0]
+
+    def test_fmt_duration(self):
+        assert httpstat.fmt_duration(0.027) == '27µs'
+        assert httpstat.fmt_duration(1.5) == '1.50ms'
+        assert httpstat.fmt_duration(123.456) == '123.5ms'
+        assert httpstat.fmt_duration(1234.5) == '1.234s'
+        assert httpstat.fmt_duration(12345) == '12.35s'
+
+    def test_invalid_type(self):
+        with pytest.raises(TypeError):
+            httpstat.convert_metrics({'time_total': '1'})
+
+    def test_reused_connection_clamped(self):
+        raw = self._make_raw(1000)
+        raw['time_connect'] = 0
+        d = httpstat.convert_metrics(raw)
+        assert d['time_connect'] == 5
+        assert d['range_connection'] == 0
+
+    def test_optional_time_keys(self):
+        raw = self._make_raw(1000)
+        raw.update(time_queue='', time_posttransfer='31000')
+        d = httpstat.convert_metrics(raw)
+        assert d['time_queue'] is None
+        assert d['time_posttransfer'] == 31
+        assert 'time_queue' not in httpstat.worst_timings([d])
+
+
+# --- connection reuse ---
+
+class TestReuse:
+    def test_build_reuse_cmd(self):
+        cmd = httpstat.build_reuse_cmd('curl', ['-k'], 'https://example.com', '/tmp/h', '/tmp/b', 3)
+        assert cmd[:9] == httpstat.build_curl_cmd('curl', ['-k'], 'https://example.com', '/tmp/h', '/tmp/b')[:9]
+        assert cmd.count('https://example.com') == 3
+        assert cmd[-3:] == ['-o', '/tmp/b', 'https://example.com']
+
+    def test_build_reuse_cmd_rest_body(self):
+        cmd = httpstat.build_reuse_cmd('curl', [], 'https://example.com', '/tmp/h', '/tmp/b', 3, os.devnull)
+        assert cmd[6] == '/tmp/b'
+        assert cmd[-6:] == ['-o', os.devnull, 'https://example.com'] * 2
+
+    def test_cli_body_preview(self, local_server, monkeypatch, capsys):
+        monkeypatch.setenv('HTTPSTAT_SHOW_BODY', 'true')
+        monkeypatch.setenv('HTTPSTAT_SAVE_BODY', 'false')
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        monkeypatch.setattr(sys, 'argv', ['httpstat', local_server, '--reuse', '3'])
+        httpstat.main()
+        out = capsys.readouterr().out
+        assert out.count('hello') == 1
+
+    def test_split_write_out(self):
+        out = '{"a": 1}{"a": 2}\n{"a": 3}\n'
+        assert httpstat.split_write_out(out) == [{'a': 1}, {'a': 2}, {'a': 3}]
+
+    def test_split_write_out_invalid(self):
+        with pytest.raises(ValueError):
+            httpstat.split_write_out('{"a": 1}garbage')
+
+    def test_split_header_blocks(self):
+        text = 'HTTP/1.1 200 OK\r\nA: 1\r\n\r\nHTTP/1.1 200 OK\r\nA: 2\r\n\r\n'
+        blocks = httpstat.split_header_blocks(text)
+        assert len(blocks) == 2
+        assert blocks[1].endswith('A: 2')
+
+    def test_build_reuse_result(self):
+        cold = {
+            'range_dns': 5, 'range_connection': 10, 'range_ssl': 15,
+            'range_server': 50, 'range_transfer': 20, 'time_total': 100,
+            'time_namelookup': 5, 'time_connect': 15, 'time_pretransfer': 30,
+            'time_starttransfer': 80, 'num_connects': 1,
+        }
+        warm = dict(cold, range_dns=0, range_connection=0, range_ssl=0, time_total=70, num_connects=0)
+        result = httpstat.build_reuse_result([cold, warm, cold, warm])
+        assert result['count'] == 4
+        assert result['requests'][0]['connect'] == 10
+        assert result['requests'][1]['connect'] == 0
+        assert [r['num_connects'] for r in result['requests']] == [1, 0, 1, 0]
+        assert result['warm']['count'] == 2
+        assert result['warm']['total']['p50'] == 70
+
+        assert httpstat.build_reuse_result([cold, cold, cold])['warm'] is None
+
+    def test_cli_no_keep_alive(self, monkeypatch, capsys, tmp_path):
+        import http.server
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        # SimpleHTTPRequestHandler speaks HTTP/1.0 and closes every connection
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        monkeypatch.setattr(sys, 'argv', ['httpstat', f'http://127.0.0.1:{server.server_port}/', '--reuse', '3'])
+        try:
+            httpstat.main()
+        finally:
+            server.shutdown()
+            server.server_close()
+        out = capsys.readouterr().out
+        assert '#3 (cold)' in out and '(warm)' not in out
+        assert 'no connection was reused' in out
+
+    def test_build_reuse_result_single(self):
+        d = {k: 1 for k in ('range_dns', 'range_connection', 'range_ssl', 'range_server',
+                            'range_transfer', 'time_total', 'time_namelookup', 'time_connect',
+                            'time_pretransfer', 'time_starttransfer')}
+        assert httpstat.build_reuse_result([d])['warm'] is None
+
+    def test_urls_file_conflict(self, monkeypatch, capsys):
+        monkeypatch.setattr(sys, 'argv', ['httpstat', '--urls-file', 'urls.txt', '--reuse', '3'])
+        with pytest.raises(SystemExit) as e:
+            httpstat.main()
+        assert e.value.code == 1
+        assert '--reuse cannot be used with --urls-file' in capsys.readouterr().out
+
+
+# --- percentile / aggregate_samples ---
+
+class TestPercentile:
+    def test_single_value(self):
+        assert httpstat.percentile([7], 99) == 7
+
+    def test_interpolation(self):
+        assert httpstat.percentile([1, 2, 3, 4], 50) == pytest.approx(2.5)
+
+    def test_bounds(self):
+        values = [5, 1, 9, 3]
+        assert httpstat.percentile(values, 0) == 1
+        assert httpstat.percentile(values, 100) == 9
+
+    def test_empty(self):
+        with pytest.raises(ValueError):
+            httpstat.percentile([], 50)
+
+
+class TestAggregateSamples:
+    def _make_sample(self, total):
+        return {
+            'time_namelookup': 1,
+            'time_connect': 2,
+            'time_pretransfer': 3,
+            'time_starttransfer': total - 1,
+            'time_total': total,
+            'range_dns': 1,
+            'range_connection': 1,
+            'range_ssl': 1,
+            'range_server': total - 4,
+            'range_transfer': 1,
+        }
+
+    def test_keys(self):
+        agg = httpstat.aggregate_samples([self._make_sample(10)])
+        assert agg['count'] == 1
+        for name in ('dns', 'connect', 'tls', 'server', 'transfer', 'total'):
+            assert set(agg[name]) == set(httpstat.AGGREGATE_STATS)
+
+    def test_stats(self):
+        samples = [self._make_sample(t) for t in range(10, 110, 10)]
+        agg = httpstat.aggregate_samples(samples)
+        assert agg['count'] == 10
+        assert agg['total']['min'] == 10
+        assert agg['total']['max'] == 100
+        assert agg['total']['mean'] == 55.0
+        assert agg['total']['p50'] == 55.0
+        assert agg['total']['p90'] == 91.0
+
+    def test_worst_timings(self):
+        samples = [self._make_sample(10), self._make_sample(50), self._make_sample(30)]
+        worst = httpstat.worst_timings(samples)
+        assert worst['time_total'] == 50
+        assert 'range_server' not in worst
+
+
 # --- build_json_result ---
 
 class TestBuildJsonResult:
@@ -290,6 +784,38 @@ class TestBuildJsonResult:
         assert result['response']['status_line'] == 'HTTP/1.1 301 Moved Permanently'
         assert result['response']['status_code'] == 301
 
+    def test_aggregate_omitted_by_default(self):
+        result = httpstat.build_json_result(
+            'https://example.com', self._make_d(),
+            'HTTP/2 200\r\n',
+            None, 0,
+        )
+        assert 'aggregate' not in result
+        assert 'timings_us' not in result
+
+    def test_timings_us(self):
+        raw = {k: 0 for k in httpstat.CURL_FORMAT_KEYS if k.startswith('time_')}
+        raw.update(time_namelookup=1234, time_connect=1734, time_pretransfer=1734,
+                   time_starttransfer=9001, time_total=10000, time_queue='')
+        d = httpstat.convert_metrics(raw, high_res=True)
+        result = httpstat.build_json_result('https://example.com', d, 'HTTP/2 200\r\n', None, 0)
+        assert result['timings_us']['dns'] == 1234
+        assert result['timings_us']['connect'] == 500
+        assert result['timings_us']['queue'] is None
+        assert result['timings_ms']['server'] == 7.267
+        agg = httpstat.aggregate_samples([d, d])
+        assert agg['server']['p50'] == 7.267
+
+    def test_aggregate_included(self):
+        agg = httpstat.aggregate_samples([self._make_d()])
+        result = httpstat.build_json_result(
+            'https://example.com', self._make_d(),
+            'HTTP/2 200\r\n',
+            None, 0, agg,
+        )
+        assert result['aggregate']['count'] == 1
+        assert result['aggregate']['server']['p50'] == 50
+
     def test_json_serializable(self):
         result = httpstat.build_json_result(
             'https://example.com', self._make_d(),
@@ -299,6 +825,1011 @@ class TestBuildJsonResult:
         # Should not raise
         json.dumps(result)
 
+    def test_extended_metrics(self):
+        d = self._make_d()
+        d.update(time_queue=1, time_posttransfer=None, num_connects=0, num_redirects=2,
+                 size_request=78, size_header=155, size_download=889,
+                 http_version='2', ssl_verify_result=0)
+        result = httpstat.build_json_result('https://example.com', d, 'HTTP/2 200\r\n', None, 0)
+        assert result['response']['http_version'] == '2'
+        assert result['timings_ms']['queue'] == 1
+        assert result['timings_ms']['posttransfer'] is None
+        assert result['connection'] == {'num_connects': 0, 'num_redirects': 2, 'ssl_verify_result': 0}
+        assert result['size_bytes'] == {'request': 78, 'header': 155, 'download': 889}
+
+    def test_render_details(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        d = dict(self._make_d(), time_queue=None, time_posttransfer=31, num_connects=1, num_redirects=0,
+                 size_request=78, size_header=155, size_download=889,
+                 http_version='1.1', ssl_verify_result=0)
+        assert httpstat.render_details(d, https=True).splitlines() == [
+            'http_version: 1.1   num_connects: 1   num_redirects: 0   ssl_verify_result: 0 (ok)',
+            'size_request: 78B   size_header: 155B   size_download: 889B',
+            'time_posttransfer: 31ms',
+        ]
+        assert 'ssl_verify_result' not in httpstat.render_details(d, https=False)
+
+
+# --- watch mode ---
+
+class TestWatch:
+    def _make_d(self, total):
+        return {
+            'time_namelookup': 5, 'time_connect': 15, 'time_appconnect': 25,
+            'time_pretransfer': 30, 'time_starttransfer': total - 20, 'time_total': total,
+            'range_dns': 5, 'range_connection': 10, 'range_ssl': 15,
+            'range_server': total - 50, 'range_transfer': 20,
+        }
+
+    def test_render(self):
+        samples = [self._make_d(t) for t in (100, 200, 300)]
+        screen = httpstat.render_watch('https://example.com', samples[-1], samples,
+                                       3, 0, None, None)
+        assert '3 probes, 3 in window, 0 errors' in screen
+        assert 'TLS Handshake' in screen
+        assert 'p95' in screen
+
+    def test_render_slo(self):
+        samples = [self._make_d(t) for t in (100, 600)]
+        screen = httpstat.render_watch('http://example.com', samples[-1], samples,
+                                       2, 0, None, {'total': 500})
+        assert 'SLO VIOLATION: total = 600ms' in screen
+        assert '1/2 in window' in screen
+
+    def test_render_failed_probe(self):
+        screen = httpstat.render_watch('http://example.com', None, [], 1, 1,
+                                       'curl error: boom', None)
+        assert 'last probe failed: curl error: boom' in screen
+
+    def test_ring_buffer(self, monkeypatch, capsys):
+        totals = iter(range(100, 1000, 100))
+        monkeypatch.setattr(httpstat, 'probe_metrics',
+                            lambda *args: (self._make_d(next(totals)), 'HTTP/1.1 200 OK'))
+        code = httpstat.run_watch('http://example.com', 'curl', [], {}, 0.001, 2,
+                                  {'total': 250}, 'jsonl', ticks=4)
+        records = [json.loads(l) for l in capsys.readouterr().out.splitlines()]
+        assert len(records) == 4
+        assert records[-1]['aggregate']['count'] == 2
+        assert records[-1]['aggregate']['total']['min'] == 300
+        assert code == 4
+
+    def test_save(self, monkeypatch, capsys, tmp_path):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        monkeypatch.setattr(httpstat, 'probe_metrics', lambda *args: (self._make_d(100), 'HTTP/1.1 200 OK'))
+        save_path = tmp_path / 'watch.jsonl'
+        httpstat.run_watch('http://example.com', 'curl', [], {}, 0.001, 2, None, 'pretty',
+                           ticks=3, save_path=str(save_path))
+        records = [json.loads(l) for l in save_path.read_text().splitlines()]
+        assert len(records) == 3
+        assert records[-1]['aggregate']['count'] == 2
+
+    def test_skips_missed_ticks(self, monkeypatch, capsys):
+        clock = [0.0]
+        started = []
+
+        def probe_metrics(*args):
+            started.append(clock[0])
+            # the second probe stalls for 3.5 intervals
+            clock[0] += 3.5 if len(started) == 2 else 0.1
+            return self._make_d(100), 'HTTP/1.1 200 OK'
+
+        def sleep(seconds):
+            assert seconds >= 0
+            clock[0] += seconds
+
+        monkeypatch.setattr(httpstat, 'probe_metrics', probe_metrics)
+        monkeypatch.setattr(httpstat.time, 'monotonic', lambda: clock[0])
+        monkeypatch.setattr(httpstat.time, 'sleep', sleep)
+        httpstat.run_watch('http://example.com', 'curl', [], {}, 1.0, 10, None, 'jsonl', ticks=4)
+        assert started == [0.0, 1.0, 5.0, 6.0]
+
+
+# --- open-loop load ---
+
+class TestLoad:
+    def _make_d(self):
+        return {
+            'time_namelookup': 1, 'time_connect': 2, 'time_appconnect': 0,
+            'time_pretransfer': 3, 'time_starttransfer': 15, 'time_total': 20,
+            'range_dns': 1, 'range_connection': 1, 'range_ssl': 1,
+            'range_server': 12, 'range_transfer': 5,
+        }
+
+    def test_parse_rate(self):
+        assert httpstat.parse_rate('2.5') == 2.5
+        with pytest.raises(SystemExit):
+            httpstat.parse_rate('0')
+        with pytest.raises(SystemExit):
+            httpstat.parse_rate('fast')
+
+    def test_coordinated_omission_correction(self, monkeypatch):
+        import time
+
+        def slow_probe(*args):
+            time.sleep(0.03)
+            return self._make_d(), 'HTTP/1.1 200 OK'
+
+        monkeypatch.setattr(httpstat, 'probe_metrics', slow_probe)
+        # 100/s with a single worker and 30ms probes: later probes start late
+        run = httpstat.run_load('http://example.com', 100, 0.1, 1, 'curl', [], {})
+        assert len(run['samples']) == 10
+        assert run['lags'][0] < run['lags'][-1]
+        assert run['lags'][-1] >= 100
+
+        load = httpstat.build_load_result(100, 0.1, run)
+        assert load['sent'] == 10
+        assert load['errors'] == 0
+        assert load['aggregate']['total']['max'] == 20
+        assert load['total_corrected_ms']['max'] == 20 + max(run['lags'])
+
+    def test_errors_counted(self, monkeypatch):
+        def failing_probe(*args):
+            raise httpstat.ProbeError(7, 'curl error: refused')
+
+        monkeypatch.setattr(httpstat, 'probe_metrics', failing_probe)
+        run = httpstat.run_load('http://example.com', 50, 0.1, 4, 'curl', [], {})
+        load = httpstat.build_load_result(50, 0.1, run)
+        assert load['sent'] == 5
+        assert load['errors'] == 5
+        assert load['aggregate'] is None
+
+    @pytest.mark.parametrize('extra, concurrency', [([], 100), (['--concurrency', '3'], 3)])
+    def test_cli_concurrency(self, monkeypatch, capsys, extra, concurrency):
+        seen = []
+
+        def run_load(url, rate, duration, concurrency, *args):
+            seen.append(concurrency)
+            return {'samples': [self._make_d()], 'lags': [0], 'errors': [], 'headers_text': '', 'elapsed': 1.0}
+
+        monkeypatch.setattr(httpstat, 'run_load', run_load)
+        monkeypatch.setattr(sys, 'argv', ['httpstat', 'http://example.com', '--rate', '1'] + extra)
+        with pytest.raises(SystemExit):
+            httpstat.main()
+        assert seen == [concurrency]
+
+
+# --- serve ---
+
+class TestMetricsRegistry:
+    def _make_result(self, total, violations=None):
+        return {
+            'url': 'https://example.com',
+            'timings_ms': {'dns': 5, 'connect': 10, 'tls': 15, 'server': total - 50,
+                           'transfer': 20, 'total': total},
+            'slo': {'pass': not violations, 'violations': violations or []},
+        }
+
+    def test_histogram(self):
+        registry = httpstat.MetricsRegistry(buckets=(0.05, 0.1, 0.5))
+        registry.observe(self._make_result(100))
+        registry.observe(self._make_result(300))
+        text = registry.render()
+        labels = 'target="https://example.com",phase="total"'
+        assert f'httpstat_phase_duration_seconds_bucket{{{labels},le="0.05"}} 0' in text
+        assert f'httpstat_phase_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+        assert f'httpstat_phase_duration_seconds_bucket{{{labels},le="0.5"}} 2' in text
+        assert f'httpstat_phase_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+        assert f'httpstat_phase_duration_seconds_sum{{{labels}}} 0.400000' in text
+        assert f'httpstat_phase_duration_seconds_count{{{labels}}} 2' in text
+        assert 'httpstat_probes_total{target="https://example.com"} 2' in text
+
+    def test_errors_and_slo(self):
+        registry = httpstat.MetricsRegistry()
+        registry.observe(self._make_result(100, [{'key': 'total', 'threshold_ms': 50, 'actual_ms': 100}]))
+        registry.observe(httpstat.build_error_result('https://example.com', 7, 'boom'))
+        text = registry.render()
+        assert 'httpstat_probe_errors_total{target="https://example.com"} 1' in text
+        assert 'httpstat_probe_success{target="https://example.com"} 0' in text
+        assert 'httpstat_slo_violations_total{target="https://example.com",key="total"} 1' in text
+
+    def test_label_escaping(self):
+        registry = httpstat.MetricsRegistry()
+        registry.observe(httpstat.build_error_result('http://a/"x"', 7, 'boom'))
+        assert 'target="http://a/\\"x\\""' in registry.render()
+
+
+class TestParseListen:
+    def test_host_port(self):
+        assert httpstat.parse_listen('0.0.0.0:9000') == ('0.0.0.0', 9000)
+
+    def test_port_only(self):
+        assert httpstat.parse_listen(':9000') == ('127.0.0.1', 9000)
+
+    def test_invalid(self):
+        with pytest.raises(SystemExit):
+            httpstat.parse_listen('localhost')
+
+
+class TestServe:
+    @pytest.mark.parametrize('opt', ['-w', '--output', '-s'])
+    def test_excluded_curl_args(self, opt, capsys):
+        with pytest.raises(SystemExit) as e:
+            httpstat.serve_main(['https://example.com', '--', opt, 'x'])
+        assert e.value.code == 1
+        assert f'{opt} is not allowed' in capsys.readouterr().out
+
+    def test_missing_curl(self, monkeypatch, capsys):
+        monkeypatch.setenv('HTTPSTAT_CURL_BIN', '/nonexistent/curl')
+        with pytest.raises(SystemExit) as e:
+            httpstat.serve_main(['https://example.com'])
+        assert e.value.code == 1
+        assert 'not found' in capsys.readouterr().out
+
+    def test_probe_loop_survives_errors(self, monkeypatch):
+        stop = threading.Event()
+
+        def probe_pool(urls, *args):
+            stop.set()
+            yield httpstat.build_error_result('a', 7, 'refused')
+            raise FileNotFoundError('curl')
+
+        monkeypatch.setattr(httpstat, 'probe_pool', probe_pool)
+        registry = httpstat.MetricsRegistry()
+        httpstat.run_probe_loop(registry, ['a', 'b'], 1, 1, 'curl', [], {}, None, stop)
+        text = registry.render()
+        assert 'httpstat_probe_errors_total{target="a"} 1' in text
+        assert 'httpstat_probe_errors_total{target="b"} 1' in text
+        assert 'httpstat_probe_success{target="b"} 0' in text
+
+
+# --- build_error_result ---
+
+class TestBuildErrorResult:
+    def test_fields(self):
+        result = httpstat.build_error_result('https://example.com', 7, 'curl error: boom')
+        assert result == {
+            'schema_version': 1,
+            'url': 'https://example.com',
+            'ok': False,
+            'exit_code': 7,
+            'error': 'curl error: boom',
+        }
+
+
+# --- in-process backends ---
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'hello ' + self.headers.get('X-Test', '').encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server():
+    server = HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/'
+    server.shutdown()
+    server.server_close()
+
+
+class TestParseInprocessArgs:
+    def test_supported(self):
+        opts = httpstat.parse_inprocess_args(['-k', '-H', 'A: 1', '--header', 'B: 2', '-X', 'PUT', '-m', '2.5'])
+        assert opts == {'insecure': True, 'headers': ['A: 1', 'B: 2'], 'method': 'PUT', 'timeout': 2.5}
+
+    def test_empty(self):
+        opts = httpstat.parse_inprocess_args([])
+        assert opts['insecure'] is False
+        assert opts['method'] is None
+
+    def test_unsupported(self):
+        with pytest.raises(ValueError):
+            httpstat.parse_inprocess_args(['--http2'])
+
+    def test_missing_value(self):
+        with pytest.raises(ValueError):
+            httpstat.parse_inprocess_args(['-H'])
+
+
+class TestResolveBackend:
+    def test_inprocess(self, monkeypatch):
+        monkeypatch.setattr(httpstat, '_pycurl_available', lambda: False)
+        assert httpstat.resolve_backend('inprocess') == 'socket'
+        monkeypatch.setattr(httpstat, '_pycurl_available', lambda: True)
+        assert httpstat.resolve_backend('inprocess') == 'pycurl'
+
+    def test_passthrough(self):
+        assert httpstat.resolve_backend('curl') == 'curl'
+
+
+class TestFetchSocket:
+    def test_metrics(self, local_server, tmp_path):
+        header_path = tmp_path / 'h'
+        body_path = tmp_path / 'b'
+        opts = httpstat.parse_inprocess_args(['-H', 'X-Test: world'])
+        d = httpstat.fetch_socket(local_server, opts, str(header_path), str(body_path))
+        assert set(d) == set(httpstat.CURL_FORMAT_KEYS)
+        assert d['remote_ip'] == '127.0.0.1'
+        assert d['time_appconnect'] == 0.0
+        assert 0 < d['time_connect'] <= d['time_pretransfer'] <= d['time_starttransfer'] <= d['time_total']
+        assert body_path.read_bytes() == b'hello world'
+        assert header_path.read_text().startswith('HTTP/1.1 200 OK')
+        assert d['time_pretransfer'] <= d['time_posttransfer'] <= d['time_starttransfer']
+        assert d['size_request'] > 0
+        assert d['size_header'] == len(header_path.read_bytes())
+        assert d['http_version'] == '1.1'
+
+        d = httpstat.convert_metrics(d)
+        result = httpstat.build_json_result(local_server, d, header_path.read_text(), None, 0)
+        assert result['response']['status_code'] == 200
+
+    def test_connection_refused(self, tmp_path):
+        opts = httpstat.parse_inprocess_args([])
+        with pytest.raises(httpstat.ProbeError) as e:
+            httpstat.fetch_socket('http://127.0.0.1:1/', opts, str(tmp_path / 'h'), str(tmp_path / 'b'))
+        assert e.value.exit_code == 7
+
+    def test_insecure_tls(self, tmp_path):
+        import shutil
+        import ssl
+        if not shutil.which('openssl'):
+            pytest.skip('openssl not available')
+        cert, key = tmp_path / 'cert.pem', tmp_path / 'key.pem'
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+                        '-days', '1', '-keyout', str(key), '-out', str(cert)], check=True, capture_output=True)
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(str(cert), str(key))
+        server = HTTPServer(('127.0.0.1', 0), _Handler)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = f'https://127.0.0.1:{server.server_port}/'
+        header_path, body_path = str(tmp_path / 'h'), str(tmp_path / 'b')
+        try:
+            with pytest.raises(httpstat.ProbeError) as e:
+                httpstat.fetch_socket(url, httpstat.parse_inprocess_args([]), header_path, body_path)
+            assert e.value.exit_code == 60
+            d = httpstat.fetch_socket(url, httpstat.parse_inprocess_args(['-k']), header_path, body_path)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert d['ssl_verify_result'] is None
+        assert d['time_appconnect'] > 0
+        assert 'ssl_verify_result' not in httpstat.render_details(httpstat.convert_metrics(d), https=True)
+
+
+class TestFetchPycurl:
+    @pytest.mark.filterwarnings('error::DeprecationWarning')
+    def test_phases(self, local_server, tmp_path):
+        pytest.importorskip('pycurl')
+        header_path, body_path = tmp_path / 'h', tmp_path / 'b'
+        opts = httpstat.parse_inprocess_args(['-H', 'X-Test: world'])
+        d = httpstat.fetch_pycurl(local_server, opts, str(header_path), str(body_path))
+        assert set(d) == set(httpstat.CURL_FORMAT_KEYS)
+        assert body_path.read_bytes() == b'hello world'
+        assert header_path.read_text().startswith('HTTP/1.1 200 OK')
+        assert d['size_download'] == 11
+        assert d['remote_ip'] == '127.0.0.1'
+        d = httpstat.convert_metrics(d)
+        assert d['time_connect'] <= d['time_starttransfer'] <= d['time_total']
+
+        d = httpstat.fetch_pycurl(local_server, dict(opts, phase='ttfb'), str(header_path), str(body_path))
+        assert header_path.read_text().startswith('HTTP/1.1 200 OK')
+        assert d['size_download'] == 0
+        assert d['time_starttransfer'] > 0
+
+        d = httpstat.fetch_pycurl(local_server, dict(opts, phase='connect'), str(header_path), str(body_path))
+        assert header_path.read_bytes() == b''
+        assert d['time_connect'] > 0 and d['size_request'] == 0
+
+    def test_info_t_fallback(self, monkeypatch):
+        pycurl = pytest.importorskip('pycurl')
+
+        info = {pycurl.SIZE_DOWNLOAD: 11.0, pycurl.SIZE_DOWNLOAD_T: 11}
+
+        class Curl:
+            def getinfo(self, option):
+                return info[option]
+
+        assert httpstat._pycurl_info_t(Curl(), 'SIZE_DOWNLOAD') == 11
+        monkeypatch.delattr(pycurl, 'SIZE_DOWNLOAD_T')
+        assert httpstat._pycurl_info_t(Curl(), 'SIZE_DOWNLOAD') == 11.0
+
+    def test_connection_refused(self, tmp_path):
+        pytest.importorskip('pycurl')
+        with pytest.raises(httpstat.ProbeError) as e:
+            httpstat.fetch_pycurl('http://127.0.0.1:1/', httpstat.parse_inprocess_args([]),
+                                  str(tmp_path / 'h'), str(tmp_path / 'b'))
+        assert e.value.exit_code == 7
+
+
+
+class TestProbe:
+    def test_result(self, local_server):
+        r = httpstat.probe(local_server, ['-H', 'X-Test: world'], slo='total=60000')
+        assert r.ok and r.slo_pass is True
+        assert r.status_code == 200
+        assert r.status_line.startswith('HTTP/1.1 200')
+        assert 'Server' in r.headers
+        assert r.timings['total'] == r.metrics['time_total']
+        assert set(r.speed) == {'download_kbs', 'upload_kbs'}
+        assert not hasattr(r, '__dict__')
+        assert r.to_dict()['slo'] == {'pass': True, 'violations': []}
+
+    def test_slo_violation(self, monkeypatch):
+        d = httpstat.convert_metrics({k: 0.1 for k in httpstat.CURL_FORMAT_KEYS if k.startswith('time_')})
+        monkeypatch.setattr(httpstat, 'probe_metrics', lambda *args: (d, 'HTTP/1.1 200 OK\r\n'))
+        r = httpstat.probe('http://a/', slo={'total': 50, 'dns': 60000})
+        assert not r.ok and r.exit_code == 4
+        assert r.slo_pass is False
+        assert r.slo[1] == [{'key': 'total', 'threshold_ms': 50, 'actual_ms': 100}]
+
+    def test_invalid_slo(self, local_server):
+        with pytest.raises(ValueError):
+            httpstat.probe(local_server, slo='total=abc')
+        with pytest.raises(ValueError):
+            httpstat.probe(local_server, slo={'latency': 5})
+
+    def test_curl_error(self):
+        with pytest.raises(httpstat.ProbeError) as e:
+            httpstat.probe('http://127.0.0.1:1/')
+        assert e.value.exit_code == 7
+
+    def test_matches_build_json_result(self):
+        d = httpstat.convert_metrics({k: 0 for k in httpstat.CURL_FORMAT_KEYS if k.startswith('time_')})
+        r = httpstat.ProbeResult('https://a', d, 'HTTP/2 204\r\nX-A: 1\r\n')
+        assert r.to_dict() == httpstat.build_json_result('https://a', d, 'HTTP/2 204\r\nX-A: 1\r\n', None, 0)
+        assert r.headers == {'X-A': '1'}
+        assert r.slo_pass is None
+        assert 'hops' not in r.to_dict(hops=None)
+
+
+
+class TestAsyncProbe:
+    def test_aprobe(self, local_server):
+        import asyncio
+        r = asyncio.run(httpstat.aprobe(local_server, ['-H', 'X-Test: world'], slo='total=60000'))
+        assert r.ok and r.slo_pass is True
+        assert r.status_line == 'HTTP/1.1 200 OK'
+        assert r.headers['Content-Length'] == '11'
+        assert r.metrics['size_download'] == 11
+
+    def test_aprobe_error(self):
+        import asyncio
+        with pytest.raises(httpstat.ProbeError) as e:
+            asyncio.run(httpstat.aprobe('http://127.0.0.1:1/'))
+        assert e.value.exit_code == 7
+
+    def test_aprobe_many(self, local_server):
+        import asyncio
+
+        async def collect():
+            return [item async for item in httpstat.aprobe_many(
+                [local_server] * 5 + ['http://127.0.0.1:1/'], limit=2)]
+
+        results = asyncio.run(collect())
+        assert len(results) == 6
+        errors = [r for _, r in results if isinstance(r, httpstat.ProbeError)]
+        assert [e.exit_code for e in errors] == [7]
+        assert all(r.status_code == 200 for _, r in results if r not in errors)
+
+    @pytest.mark.parametrize('eol', ['\r\n', '\n'])
+    def test_split_header_dump(self, eol):
+        write_out = '{\n"time_namelookup": 1,\n"x": 1\n}'
+        out = f'HTTP/1.1 301 Moved{eol}Location: /b{eol}{eol}HTTP/1.1 200 OK{eol}A: {{1}}{eol}{eol}' + write_out
+        headers_text, rest = httpstat.split_header_dump(out)
+        assert headers_text.endswith('A: {1}')
+        assert rest == write_out
+        assert httpstat.split_header_dump(write_out) == ('', write_out)
+
+    def test_bare_lf_headers(self):
+        import asyncio
+        import socket
+
+        listener = socket.create_server(('127.0.0.1', 0))
+
+        def serve():
+            conn, _ = listener.accept()
+            with conn:
+                conn.recv(65536)
+                conn.sendall(b'HTTP/1.1 200 OK\nContent-Length: 2\nX-Test: lf\n\nok')
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        url = f'http://127.0.0.1:{listener.getsockname()[1]}/'
+        try:
+            result = asyncio.run(httpstat.aprobe(url))
+        finally:
+            listener.close()
+        assert result.status_code == 200
+        assert result.headers['X-Test'] == 'lf'
+
+
+
+class TestPhase:
+    def _d(self):
+        raw = {k: 0 for k in httpstat.CURL_FORMAT_KEYS if k.startswith('time_')}
+        raw.update(time_namelookup=1000, time_connect=3000, time_appconnect=6000,
+                   time_pretransfer=6000, time_starttransfer=9000, time_total=12000)
+        return httpstat.convert_metrics(raw)
+
+    def test_limit_phase(self):
+        d = httpstat.limit_phase(self._d(), 'connect')
+        timings = httpstat.build_timings(d)
+        assert timings['tls'] == 3
+        assert timings['server'] is None and timings['transfer'] is None and timings['total'] is None
+        d = httpstat.limit_phase(self._d(), 'ttfb')
+        assert d['range_server'] == 3 and d['range_transfer'] is None
+
+    def test_aggregate_nulls(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        d = httpstat.limit_phase(self._d(), 'ttfb')
+        agg = httpstat.aggregate_samples([d, d])
+        assert agg['transfer'] is None and agg['total'] is None
+        assert agg['server']['p50'] == 3
+        assert 'Content Transfer' not in httpstat.format_aggregate(agg)
+
+    def test_render_template(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        text = httpstat.render_template(httpstat.limit_phase(self._d(), 'connect'), True, 'connect')
+        assert 'TLS Handshake' in text and 'Server Processing' not in text
+        assert 'pretransfer:6ms' in text and 'total' not in text
+        text = httpstat.render_template(httpstat.limit_phase(self._d(), 'ttfb'), False, 'ttfb')
+        assert 'starttransfer:9ms' in text and 'Content Transfer' not in text
+
+    def test_fetch_socket(self, local_server, tmp_path):
+        opts = dict(httpstat.parse_inprocess_args([]), phase='connect')
+        header_path, body_path = tmp_path / 'h', tmp_path / 'b'
+        d = httpstat.fetch_socket(local_server, opts, str(header_path), str(body_path))
+        assert d['size_request'] == 0 and header_path.read_bytes() == b''
+        assert d['time_connect'] <= d['time_pretransfer'] == d['time_starttransfer'] <= d['time_total']
+        opts['phase'] = 'ttfb'
+        d = httpstat.fetch_socket(local_server, opts, str(header_path), str(body_path))
+        assert header_path.read_text().startswith('HTTP/1.1 200 OK')
+        assert d['size_download'] == 0 and not body_path.exists()
+
+    def test_cli(self, local_server):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        cmd = [sys.executable, os.path.join(root, 'httpstat.py'), local_server, '-f', 'json']
+        p = subprocess.run(cmd + ['--phase', 'ttfb', '--slo', 'ttfb=60000'], capture_output=True, text=True)
+        assert p.returncode == 0, p.stdout
+        result = json.loads(p.stdout)
+        assert result['phase'] == 'ttfb' and result['slo']['pass']
+        assert result['response']['status_code'] == 200
+        assert result['timings_ms']['transfer'] is None
+        assert result['size_bytes']['download'] is None
+        p = subprocess.run(cmd + ['--phase', 'connect', '--slo', 'ttfb=5'], capture_output=True, text=True)
+        assert p.returncode == 1
+
+    def test_cli_connect_sends_no_request(self):
+        requests = []
+
+        class Handler(_Handler):
+            def do_GET(self):
+                requests.append(self.path)
+                super().do_GET()
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            url = f'http://127.0.0.1:{server.server_port}/'
+            cmd = [sys.executable, os.path.join(root, 'httpstat.py'), url, '-f', 'json', '--phase', 'connect']
+            p = subprocess.run(cmd, capture_output=True, text=True)
+            assert p.returncode == 0, p.stdout
+            result = json.loads(p.stdout)
+            assert result['response']['headers'] == {}
+            assert result['timings_ms']['starttransfer'] is None
+            assert result['size_bytes'] == {'request': None, 'header': None, 'download': None}
+            assert result['speed'] == {'download_kbs': None, 'upload_kbs': None}
+            assert result['response']['http_version'] is None
+            # curl still works when asked for, it only stops at the first body byte
+            p = subprocess.run(cmd + ['--backend', 'curl'], capture_output=True, text=True)
+            assert p.returncode == 0, p.stdout
+            assert requests == ['/']
+            p = subprocess.run(cmd + ['--http2'], capture_output=True, text=True)
+            assert p.returncode == 1 and '--backend curl' in p.stdout
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+
+class TestAllIps:
+    def _d(self, total):
+        raw = {k: 0 for k in httpstat.CURL_FORMAT_KEYS if k.startswith('time_')}
+        raw.update(time_namelookup=1000, time_connect=2000, time_pretransfer=2000,
+                   time_starttransfer=total - 1000, time_total=total)
+        return httpstat.convert_metrics(raw)
+
+    def test_resolve_all(self):
+        assert httpstat.resolve_all('http://127.0.0.1:8080/x', []) == ('127.0.0.1', 8080, ['127.0.0.1'])
+        assert httpstat.resolve_all('127.0.0.1/x', [])[1] == 80
+        with pytest.raises(httpstat.ProbeError) as e:
+            httpstat.resolve_all('https://127.0.0.1/', ['-6'])
+        assert e.value.exit_code == 6
+
+    def test_slowest_and_block(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        ips = [('10.0.0.1', self._d(20000), 'HTTP/1.1 200 OK\r\n'),
+               ('10.0.0.2', self._d(90000), 'HTTP/1.1 503 Busy\r\n'),
+               ('10.0.0.3', httpstat.ProbeError(7, 'curl error: refused'), '')]
+        assert httpstat.slowest_ip(ips) == 1
+        block = httpstat.build_ips_result(ips)
+        assert [(b['ip'], b['ok'], b['status_code']) for b in block] == [
+            ('10.0.0.1', True, 200), ('10.0.0.2', True, 503), ('10.0.0.3', False, None)]
+        assert block[1]['timings_ms']['total'] == 90
+        assert block[2]['exit_code'] == 7 and block[2]['timings_ms'] is None
+        lines = httpstat.format_ips(ips, show_tls=False).splitlines()
+        assert lines[1].startswith('10.0.0.1') and lines[2].startswith('10.0.0.2')
+        assert lines[3] == '10.0.0.3  curl error: refused'
+        assert httpstat.slowest_ip(ips[2:]) is None
+
+    def test_probe_ips(self, local_server):
+        port = int(local_server.rsplit(':', 1)[1].strip('/'))
+        curl_args = ['-H', 'X-Test: world']
+        results = httpstat.probe_ips(local_server, '127.0.0.1', port, ['127.0.0.1', '127.0.0.2'], 10,
+                                     'curl', curl_args, httpstat.make_cmd_env())
+        assert [ip for ip, _, _ in results] == ['127.0.0.1', '127.0.0.2']
+        assert results[0][1]['remote_ip'] == '127.0.0.1'
+        assert results[0][1]['size_download'] == 11
+        assert isinstance(results[1][1], httpstat.ProbeError)
+        assert curl_args == ['-H', 'X-Test: world']
+
+    def test_cli(self, local_server):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.run([sys.executable, os.path.join(root, 'httpstat.py'), local_server, '--all-ips',
+                            '-f', 'json'], capture_output=True, text=True)
+        assert p.returncode == 0, p.stdout
+        result = json.loads(p.stdout)
+        assert [i['ip'] for i in result['ips']] == ['127.0.0.1']
+        assert result['response']['status_code'] == 200
+        p = subprocess.run([sys.executable, os.path.join(root, 'httpstat.py'), local_server, '--all-ips',
+                            '--resolve', 'a:80:127.0.0.1'], capture_output=True, text=True)
+        assert p.returncode == 1
+
+
+# --- redirect hops ---
+
+class _RedirectHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    redirects = {'/a': (301, '/b'), '/b': (302, '/c')}
+
+    def do_GET(self):
+        status, location = self.redirects.get(self.path, (200, None))
+        body = b'' if location else b'done'
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHops:
+    HEADERS = ('HTTP/1.1 301 Moved Permanently\r\nLocation: /b\r\n\r\n'
+               'HTTP/1.1 302 Found\r\nlocation: https://other.example/c?x=1\r\n\r\n'
+               'HTTP/2 200\r\ncontent-type: text/plain\r\n')
+
+    def test_parse_status_line(self):
+        assert httpstat.parse_status_line('HTTP/1.1 301 Moved Permanently\nLocation: /b') == \
+            ('HTTP/1.1 301 Moved Permanently', 301)
+        assert httpstat.parse_status_line('') == ('', 0)
+
+    def test_redirect_chain(self):
+        assert httpstat.redirect_chain('example.com/a', self.HEADERS) == [
+            'http://example.com/a', 'http://example.com/b', 'https://other.example/c?x=1']
+
+    def test_redirect_chain_skips_other_blocks(self):
+        headers = 'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nLocation: /ignored\r\n'
+        assert httpstat.redirect_chain('https://example.com/', headers) == ['https://example.com/']
+
+    def test_json_result_uses_final_response(self):
+        d = TestBuildJsonResult()._make_d()
+        result = httpstat.build_json_result('https://example.com/a', d, self.HEADERS, None, 0)
+        assert result['response']['status_code'] == 200
+        assert result['response']['headers'] == {'content-type': 'text/plain'}
+        assert 'hops' not in result
+
+    def test_probe_hops(self):
+        server = HTTPServer(('127.0.0.1', 0), _RedirectHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            base = f'http://127.0.0.1:{server.server_port}'
+            cmd_env = httpstat.make_cmd_env()
+            _, headers_text = httpstat.probe_metrics(base + '/a', 'curl', ['-L'], cmd_env)
+            chain = httpstat.redirect_chain(base + '/a', headers_text)
+            assert chain == [base + '/a', base + '/b', base + '/c']
+            hops = httpstat.probe_hops(chain, 'curl', ['-L'], cmd_env)
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert [(url, code) for url, code, _ in hops] == [(base + '/a', 301), (base + '/b', 302), (base + '/c', 200)]
+        # later hops reuse the first connection
+        assert [d['num_connects'] for _, _, d in hops] == [1, 0, 0]
+        block = httpstat.build_hops_result(hops)
+        assert block[2]['status_code'] == 200
+        assert set(block[0]['timings_ms']) == set(httpstat.build_timings(hops[0][2]))
+
+
+# --- aggregate subcommand ---
+
+class TestQuantileSketch:
+    def test_relative_accuracy(self):
+        import random
+        rng = random.Random(0)
+        values = [rng.lognormvariate(4, 1) for _ in range(20000)]
+        sketch = httpstat.QuantileSketch(0.01)
+        for v in values:
+            sketch.add(v)
+        ordered = sorted(values)
+        for q in (0.5, 0.9, 0.99):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.011)
+        assert sketch.count == 20000
+        assert len(sketch.buckets) < 1000
+
+    def test_zeros_and_empty(self):
+        sketch = httpstat.QuantileSketch()
+        assert sketch.quantile(0.5) is None
+        for v in (0, 0, 0, 10):
+            sketch.add(v)
+        assert sketch.quantile(0.5) == 0
+        assert sketch.quantile(1) == pytest.approx(10, rel=0.01)
+
+    def test_merge_matches_single_sketch(self):
+        a, b, both = httpstat.QuantileSketch(), httpstat.QuantileSketch(), httpstat.QuantileSketch()
+        for v in range(1, 1001):
+            (a if v % 3 else b).add(v)
+            both.add(v)
+        a.merge(httpstat.QuantileSketch.from_dict(json.loads(json.dumps(b.to_dict()))))
+        assert a.buckets == both.buckets
+        assert (a.count, a.min, a.max, a.sum) == (both.count, both.min, both.max, both.sum)
+        assert a.quantile(0.9) == both.quantile(0.9)
+
+    def test_bounded_buckets(self):
+        sketch = httpstat.QuantileSketch(max_buckets=64)
+        for v in range(1, 100000, 7):
+            sketch.add(v)
+        assert len(sketch.buckets) == 64
+        assert sketch.quantile(0.99) == pytest.approx(99000, rel=0.02)
+
+
+class TestStreamAggregator:
+    def _line(self, url, total, ok=True):
+        if total is None:
+            return json.dumps(httpstat.build_error_result(url, 7, 'refused'))
+        timings = {'dns': 1, 'connect': 2, 'tls': 0, 'server': total - 4, 'transfer': 1, 'total': total}
+        return json.dumps({'url': url, 'ok': ok, 'exit_code': 0 if ok else 4, 'timings_ms': timings})
+
+    def test_report(self):
+        agg = httpstat.StreamAggregator()
+        for line in [self._line('a', 10), self._line('a', 20, ok=False), self._line('a', None),
+                     self._line('b', 30), 'not json', '', '[1]']:
+            agg.add_line(line)
+        report = agg.report(sketches=False)
+        assert (report['records'], report['skipped']) == (4, 2)
+        assert report['targets']['a']['count'] == 2
+        assert report['targets']['a']['errors'] == 1
+        total = report['targets']['a']['phases']['total']
+        assert (total['min'], total['mean'], total['max']) == (10, 15.0, 20)
+        assert 'sketches' not in report['targets']['a']
+
+    def test_merge_reports(self, capsys):
+        for chunk in ([self._line('a', 10)], [self._line('a', 30), self._line('b', 5)]):
+            httpstat.aggregate_main(['-f', 'jsonl'], stream=chunk)
+        reports = capsys.readouterr().out.splitlines()
+        assert httpstat.aggregate_main(['-f', 'json'], stream=reports) == 0
+        merged = json.loads(capsys.readouterr().out)['aggregate_stream']
+        assert merged['records'] == 3
+        assert merged['targets']['a']['count'] == 2
+        assert merged['targets']['a']['phases']['total']['max'] == 30
+
+    def test_malformed_lines(self):
+        agg = httpstat.StreamAggregator()
+        agg.add_line(self._line('a', 10))
+        report = agg.report()
+        bad_sketch = json.loads(json.dumps(report))
+        bad_sketch['targets']['a']['sketches']['total']['count'] = 'x'
+        lines = [
+            json.dumps({'aggregate_stream': {'records': 1}}),
+            json.dumps({'aggregate_stream': bad_sketch}),
+            json.dumps({'aggregate_stream': dict(report, records=-1)}),
+            json.dumps({'aggregate_stream': 1}),
+            json.dumps({'url': 'a', 'timings_ms': {'total': 'slow'}}),
+            json.dumps({'url': 'a', 'timings_ms': [1]}),
+        ]
+        for line in lines:
+            agg.add_line(line)
+        report = agg.report(sketches=False)
+        assert (report['records'], report['skipped']) == (1, len(lines))
+        assert report['targets']['a']['count'] == 1
+
+    def test_pretty(self, monkeypatch, capsys):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        httpstat.aggregate_main([], stream=[self._line('a', 10), self._line('a', None)])
+        out = capsys.readouterr().out
+        assert out.startswith('Aggregated 2 records for 1 targets')
+        assert 'a (1 probes, 1 errors)' in out
+        assert 'Server Processing' in out
+
+
+# --- history store ---
+
+class TestHistory:
+    def _sample(self, server, total=None):
+        return {'range_dns': 1, 'range_connection': 2, 'range_ssl': 3,
+                'range_server': server, 'range_transfer': 1, 'time_total': total or server + 7}
+
+    def test_default_path(self, monkeypatch):
+        monkeypatch.delenv('HTTPSTAT_HISTORY_DB', raising=False)
+        monkeypatch.setenv('XDG_DATA_HOME', '/data')
+        assert httpstat.default_history_path() == '/data/httpstat/history.db'
+        monkeypatch.setenv('HTTPSTAT_HISTORY_DB', '/tmp/h.db')
+        assert httpstat.default_history_path() == '/tmp/h.db'
+
+    def test_record_and_load(self, tmp_path):
+        conn = httpstat.open_history(str(tmp_path / 'sub' / 'history.db'))
+        httpstat.record_history(conn, 'https://a', [self._sample(10), self._sample(20)], 0, 1000.0)
+        httpstat.record_history(conn, 'https://a', [self._sample(30)], 4, 2000.0)
+        httpstat.record_history(conn, 'https://b', [self._sample(40)], 0, 2000.0)
+        rows = httpstat.load_history(conn, 'https://a', 1500.0)
+        assert rows == [self._sample(30)]
+        assert len(httpstat.load_history(conn, 'https://a', 0)) == 3
+        plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM probes WHERE url = ? AND ts >= ?',
+                            ('https://a', 0)).fetchall()
+        assert 'probes_url_ts' in str(plan)
+        conn.close()
+
+    def test_regression(self):
+        history = [self._sample(s) for s in (100, 98, 102, 101, 99)]
+        result = httpstat.build_baseline_result(history, [self._sample(135)], '7d')
+        assert result['count'] == 5
+        assert result['phases']['server'] == {
+            'baseline_p50': 100, 'current_p50': 135, 'change_pct': 35.0, 'regression': True}
+        assert result['regressions'] == ['server', 'total']
+
+    def test_small_changes_are_not_regressions(self):
+        history = [self._sample(2)] * 5
+        # +50%, but only 1ms
+        result = httpstat.build_baseline_result(history, [self._sample(3)], '7d')
+        assert result['regressions'] == []
+        # 10% slower
+        result = httpstat.build_baseline_result([self._sample(100)], [self._sample(110)], '7d')
+        assert result['regressions'] == []
+
+    def test_format_baseline(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        history = [self._sample(100)] * 3
+        result = httpstat.build_baseline_result(history, [self._sample(135, total=107)], '7d')
+        assert httpstat.format_baseline('https://a', result) == [
+            'REGRESSION: server processing p50 up 35% vs last 7d (100ms -> 135ms, 3 stored probes)']
+        empty = httpstat.build_baseline_result([], [self._sample(1)], '7d')
+        assert 'No history' in httpstat.format_baseline('https://a', empty)[0]
+
+
+# --- compare ---
+
+class TestCompare:
+    def test_rank_ties(self):
+        assert httpstat.rank([10, 20, 10, 30]) == [1.5, 3.0, 1.5, 4.0]
+
+    def test_mann_whitney_u(self):
+        u, p = httpstat.mann_whitney_u([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        assert u == 0
+        assert p == pytest.approx(0.01219, abs=1e-4)
+
+    def test_mann_whitney_u_identical(self):
+        assert httpstat.mann_whitney_u([5, 5, 5], [5, 5]) == (3.0, 1.0)
+
+    def test_bootstrap_ci(self):
+        a = [10, 11, 12, 13, 14, 15, 16, 17]
+        b = [x + 20 for x in a]
+        lo, hi = httpstat.bootstrap_median_diff_ci(a, b)
+        assert lo <= 20 <= hi
+        assert (lo, hi) == httpstat.bootstrap_median_diff_ci(a, b)
+
+    def _sample(self, total):
+        return {'range_dns': 1, 'range_connection': 2, 'range_ssl': 0,
+                'range_server': total - 3, 'range_transfer': 0, 'time_total': total}
+
+    def test_compare_samples(self):
+        a = [self._sample(t) for t in (50, 52, 51, 53, 50, 49, 52, 51)]
+        b = [self._sample(t) for t in (70, 72, 71, 73, 70, 69, 72, 71)]
+        phases = httpstat.compare_samples(a, b)
+        assert phases['total']['diff'] == 20
+        assert phases['total']['significant'] is True
+        assert phases['total']['ci95'][0] > 0
+        assert phases['dns']['significant'] is False
+        assert phases['dns']['p_value'] == 1.0
+
+    def test_run_compare_interleaves(self, monkeypatch):
+        calls = []
+
+        def probe_metrics(url, curl_bin, curl_args, cmd_env):
+            calls.append(url)
+            if url == 'b' and len(calls) == 2:
+                raise httpstat.ProbeError(7, 'refused')
+            return self._sample(10), 'HTTP/1.1 200 OK'
+
+        monkeypatch.setattr(httpstat, 'probe_metrics', probe_metrics)
+        runs = httpstat.run_compare(('a', []), ('b', []), 4, 'curl', {})
+        assert calls == ['a', 'b', 'b', 'a', 'a', 'b', 'b', 'a']
+        assert len(runs[0]['samples']) == 4
+        assert len(runs[1]['samples']) == 3
+        assert runs[1]['errors'][0].exit_code == 7
+
+    @pytest.mark.parametrize('args', [[], ['a', 'b', 'c'], ['a'], ['a', '--a-args', '-k', '--b-args', '-k'],
+                                      ['a', 'b', '--count', '1'], ['a', 'b', '--', '-o', 'x'],
+                                      ['a', '--a-args', '-s', '--b-args', '-k']])
+    def test_invalid_args(self, args):
+        with pytest.raises(SystemExit) as e:
+            httpstat.compare_main(args)
+        assert e.value.code == 1
+
+    def test_too_few_samples(self, monkeypatch):
+        run = {'samples': [self._sample(10)], 'errors': [httpstat.ProbeError(7, 'refused')], 'headers_text': ''}
+        monkeypatch.setattr(httpstat, 'run_compare', lambda *args: [run, run])
+        with pytest.raises(SystemExit) as e:
+            httpstat.compare_main(['a', 'b', '--count', '2'])
+        assert e.value.code == 7
+        run['errors'] = []
+        with pytest.raises(SystemExit) as e:
+            httpstat.compare_main(['a', 'b', '--count', '2'])
+        assert e.value.code == 1
+
+
+# --- profile ---
+
+class TestProfile:
+    def test_stage_timer(self, monkeypatch):
+        now = iter([1.0, 1.5, 1.75, 3.0])
+        monkeypatch.setattr(httpstat.time, 'perf_counter', lambda: next(now))
+        timer = httpstat.StageTimer(0.5)
+        timer.mark('import')
+        timer.mark('curl')
+        timer.mark('import')
+        timer.mark('curl')
+        assert timer.result() == {'import': 750.0, 'curl': 1750.0, 'total': 2500.0, 'httpstat': 750.0}
+
+    def test_result_order_and_interpreter(self):
+        timer = httpstat.StageTimer(0.0)
+        timer.stages = {'render': 1.0, 'args': 2.0}
+        overhead = timer.result(interpreter_ms=10.0)
+        assert list(overhead) == ['interpreter', 'args', 'render', 'total', 'httpstat']
+        assert overhead['total'] == 13.0
+
+    def test_format_profile(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', False)
+        text = httpstat.format_profile({'curl': 12.5, 'total': 40.0, 'httpstat': 27.5})
+        assert text.splitlines() == [
+            'curl spawn to exit        12.50ms',
+            'Total                     40.00ms',
+            'httpstat (not curl)       27.50ms',
+        ]
+
+    def test_json_overhead_block(self, local_server):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.run([sys.executable, os.path.join(root, 'httpstat.py'), local_server,
+                            '--profile', '-f', 'json'], capture_output=True, text=True)
+        assert p.returncode == 0, p.stderr
+        overhead = json.loads(p.stdout)['overhead_ms']
+        for stage in ('import', 'args', 'tempfile', 'curl', 'decode', 'headers', 'render', 'total', 'httpstat'):
+            assert overhead[stage] >= 0
+        assert 'history' not in overhead
+        assert overhead['httpstat'] == pytest.approx(overhead['total'] - overhead['curl'], abs=0.02)
+
+    def test_history_stage(self, local_server, tmp_path):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, HTTPSTAT_HISTORY_DB=str(tmp_path / 'history.db'))
+        p = subprocess.run([sys.executable, os.path.join(root, 'httpstat.py'), local_server,
+                            '--profile', '--record', '-f', 'json'], capture_output=True, text=True, env=env)
+        assert p.returncode == 0, p.stdout
+        assert json.loads(p.stdout)['overhead_ms']['history'] > 0
+
 
 # --- NO_COLOR ---
 
@@ -318,3 +1849,39 @@ class TestNoColor:
         monkeypatch.setattr(httpstat, 'ISATTY', True)
         func = httpstat.make_color(31)
         assert func('hello') == '\x1b[31mhello\x1b[0m'
+
+    def test_grayscale_built_lazily(self, monkeypatch):
+        monkeypatch.setattr(httpstat, 'ISATTY', True)
+        assert httpstat.grayscale[16]('x') == '\x1b[38;5;248mx\x1b[0m'
+        with pytest.raises(KeyError):
+            httpstat.grayscale[24]
+
+
+# --- startup ---
+
+# generous, import takes ~30ms here, the budget only catches regressions
+# such as a heavy module imported at module level again
+IMPORT_BUDGET_MS = 150
+
+
+def _import_httpstat(code: str) -> subprocess.CompletedProcess:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=root, capture_output=True, text=True, check=True)
+
+
+class TestStartup:
+    def test_heavy_modules_not_imported(self):
+        p = _import_httpstat(
+            'import sys, httpstat; '
+            "print([m for m in ('logging', 'tempfile', 'shutil', 'concurrent.futures') if m in sys.modules])")
+        assert p.stdout.strip() == '[]'
+
+    def test_import_time_budget(self):
+        best = None
+        for _ in range(3):
+            p = _import_httpstat('import httpstat')
+            line = [l for l in p.stderr.splitlines() if l.endswith('| httpstat')][-1]
+            cumulative_ms = int(line.split('|')[1]) / 1000
+            best = cumulative_ms if best is None else min(best, cumulative_ms)
+        assert best < IMPORT_BUDGET_MS